@@ -0,0 +1,466 @@
+"""
+Offline end-to-end benchmark for CognitiveShell.
+
+Runs the real handlers (handle_text_message, handle_debug_callback,
+run_shell_observer_telegram) against a local OpenAI-compatible stub server and an
+in-process fake Telegram bot, so no network, token or API key is needed.
+
+    python benchmark.py -o hasil.json
+    python benchmark.py --compare hasil_lama.json
+
+Results are written as JSON so runs of different versions can be compared. The exit status
+is 1 if a failure scenario did not end as expected; tests/ holds the assertion-based checks
+and the stub server and fake bot used here (tests/support.py). Runs from a source checkout;
+it is not part of the installed package.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on every platform
+    resource = None
+
+from tests.support import (CHAT_ID, FakeBot, FakeContext, FakeUpdate, POTONGAN_FUZZ, StubLLMServer,
+                           periksa_markdown_v2, siapkan_lingkungan, tanpa_markup)
+
+
+# Messages per intent path; handle_text_message decides the path exactly as in production
+PESAN_PER_JALUR = {
+    "shell_literal": "ls -la",
+    "shell_translated": "tolong tampilkan isi folder ini",
+    "program": "create a python function that adds two numbers",
+    "conversation": "what is the difference between a process and a thread?",
+}
+
+
+def persentil(data: list, p: float) -> float:
+    """Linear-interpolated percentile (p in 0..100) of a non-empty list."""
+    urut = sorted(data)
+    if len(urut) == 1:
+        return urut[0]
+    posisi = (len(urut) - 1) * p / 100
+    bawah = int(posisi)
+    atas = min(bawah + 1, len(urut) - 1)
+    return urut[bawah] + (urut[atas] - urut[bawah]) * (posisi - bawah)
+
+def ringkas_latensi(sampel: list) -> dict:
+    """p50/p95/p99/mean/max in milliseconds."""
+    if not sampel:
+        return {}
+    return {
+        "p50_ms": round(persentil(sampel, 50) * 1000, 2),
+        "p95_ms": round(persentil(sampel, 95) * 1000, 2),
+        "p99_ms": round(persentil(sampel, 99) * 1000, 2),
+        "mean_ms": round(sum(sampel) / len(sampel) * 1000, 2),
+        "max_ms": round(max(sampel) * 1000, 2),
+    }
+
+def memori_saat_ini() -> dict:
+    """Current RSS (from /proc) and the process high-water mark (ru_maxrss), in KiB."""
+    hasil = {}
+    try:
+        with open("/proc/self/statm") as f:
+            hasil["rss_kib"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KiB, macOS bytes
+        hasil["max_rss_kib"] = maxrss // 1024 if sys.platform == "darwin" else maxrss
+    return hasil
+
+
+# === Scenarios ===
+async def _tunggu_selesai(cs, chat_id: int):
+    """Waits until the chat's shell jobs have finished and its outbound queue is empty."""
+    while True:
+        tugas = [job.task for job in cs.SHELL_JOB_MANAGER.daftar(chat_id) if job.aktif and job.task is not None]
+        if not tugas:
+            break
+        await asyncio.gather(*tugas, return_exceptions=True)
+    await cs.TELEGRAM_SEND_QUEUE.tunggu_kosong(chat_id)
+
+async def ukur_perintah(cs, bot: FakeBot, jalankan) -> dict:
+    """Times one user interaction until its last message is delivered."""
+    awal_panggilan = len(bot.calls)
+    t0 = time.perf_counter()
+    await jalankan()
+    await _tunggu_selesai(cs, CHAT_ID)
+    selesai = time.perf_counter()
+    panggilan = bot.calls[awal_panggilan:]
+    return {
+        "latency": (panggilan[-1][0] if panggilan else selesai) - t0,
+        "first_message": (panggilan[0][0] - t0) if panggilan else None,
+        "messages": sum(1 for c in panggilan if c[1] == "send"),
+        "edits": sum(1 for c in panggilan if c[1] == "edit"),
+    }
+
+async def bench_jalur_niat(cs, bot: FakeBot, jalur: str, iterasi: int) -> dict:
+    """Runs one intent path `iterasi` times through the real handlers."""
+    context = FakeContext(bot)
+    hasil = []
+    gagal = 0
+    for _ in range(iterasi):
+        if jalur == "debug":
+            # The "Yes" button of a failed job's debug question
+            user_context = cs.get_user_context(CHAT_ID)
+            user_context["last_generated_code_language"] = "python"
+            user_context.setdefault("pending_debug", {})["1-0"] = {"job": 1, "command": "python app.py",
+                "error_log": "Traceback (most recent call last):\n  File \"app.py\", line 1, in <module>\nNameError: name 'x' is not defined"}
+            jalankan = lambda: cs.handle_debug_callback(FakeUpdate(callback_data="debug:1-0:yes"), context)
+        else:
+            jalankan = lambda: cs.handle_text_message(FakeUpdate(PESAN_PER_JALUR[jalur]), context)
+        try:
+            hasil.append(await ukur_perintah(cs, bot, jalankan))
+        except Exception as e:
+            gagal += 1
+            logging.getLogger(__name__).warning(f"[Benchmark] {jalur} iteration failed: {e}")
+    ringkasan = ringkas_latensi([h["latency"] for h in hasil])
+    pertama = [h["first_message"] for h in hasil if h["first_message"] is not None]
+    if pertama:
+        ringkasan["first_message_p50_ms"] = round(persentil(pertama, 50) * 1000, 2)
+    ringkasan.update(
+        iterations=len(hasil),
+        errors=gagal,
+        messages_per_command=round(sum(h["messages"] for h in hasil) / len(hasil), 2) if hasil else 0,
+        edits_per_command=round(sum(h["edits"] for h in hasil) / len(hasil), 2) if hasil else 0,
+        memory=memori_saat_ini(),
+    )
+    return ringkasan
+
+async def bench_throughput_shell(cs, bot: FakeBot, jumlah_byte: int) -> dict:
+    """Streams `jumlah_byte` of output through the pty reader, detector and batcher."""
+    baris = "benchmark output line 0123456789 abcdefghijklmnopqrstuvwxyz"
+    perintah = f"yes '{baris}' | head -c {jumlah_byte}"
+    awal_panggilan = len(bot.calls)
+    t0 = time.perf_counter()
+    await cs.run_shell_observer_telegram(perintah, FakeUpdate(perintah), FakeContext(bot))
+    durasi = time.perf_counter() - t0
+    await cs.TELEGRAM_SEND_QUEUE.tunggu_kosong(CHAT_ID)
+    jumlah_baris = jumlah_byte // (len(baris) + 1)
+    return {
+        "bytes": jumlah_byte,
+        "seconds": round(durasi, 3),
+        "mb_per_s": round(jumlah_byte / durasi / 1e6, 2),
+        "lines_per_s": round(jumlah_baris / durasi),
+        "messages": sum(1 for c in bot.calls[awal_panggilan:] if c[1] == "send"),
+        "memory": memori_saat_ini(),
+    }
+
+def bench_deteksi_error(cs, jumlah_baris: int = 200000) -> dict:
+    """Scans synthetic build/run output (one traceback per ~500 lines) with the error engine."""
+    acak = random.Random(7)
+    baris = []
+    for i in range(jumlah_baris):
+        if i % 500 == 499:
+            baris.extend(["Traceback (most recent call last):", '  File "app.py", line 3, in <module>', "ValueError: bad value"])
+        else:
+            baris.append(f"[{i:06d}] compiling module_{acak.randint(0, 999)}.c ... ok ({acak.random():.3f}s)")
+    teks = "\n".join(baris)
+    hasil = {}
+    for program in (False, True):
+        t0 = time.perf_counter()
+        temuan = cs.ERROR_DETECTION_ENGINE.pindai(teks, program=program)
+        durasi = time.perf_counter() - t0
+        hasil["program" if program else "shell"] = {
+            "mb_per_s": round(len(teks) / durasi / 1e6, 2),
+            "lines_per_s": round(len(baris) / durasi),
+            "matches": len(temuan),
+        }
+    return hasil
+
+
+# Failure scenarios: (scripted failures, per-call deadline or None, calls, expected success of the last call)
+SKENARIO_KETAHANAN = {
+    "rate_limited": (lambda: [(429, 1)], None, 1, True),
+    "bad_gateway": (lambda: [502, 502], None, 1, True),
+    "connection_reset": (lambda: ["reset"], None, 1, True),
+    "hung_upstream": (lambda: ["hang"], 1.0, 1, False),
+    "endpoint_down": (lambda: itertools.repeat(503), None, 4, False),
+}
+
+async def bench_ketahanan(cs, latency: float) -> dict:
+    """
+    Replays transient and persistent upstream failures against a dedicated stub endpoint each
+    and reports whether the retry, deadline and circuit-breaker layer produced the expected
+    outcome, how long the last call took and how many requests reached the endpoint.
+    """
+    hasil = {}
+    pesan = [{"role": "system", "content": "You are a helpful assistant."}, {"role": "user", "content": "hello"}]
+    for nama, (kegagalan, deadline, panggilan, harapan) in SKENARIO_KETAHANAN.items():
+        stub = await StubLLMServer(latency, 0, 5, kegagalan=kegagalan()).start()
+        task = f"bench_{nama}"
+        if deadline is not None:
+            cs.LLM_TASK_DEADLINES[task] = deadline
+        try:
+            for _ in range(panggilan):
+                t0 = time.perf_counter()
+                success, _ = await cs.call_llm_async(pesan, f"stub@{stub.url}", "benchmark", task=task, use_cache=False)
+                durasi = time.perf_counter() - t0
+            hasil[nama] = {
+                "ok": success == harapan,
+                "success": success,
+                "last_call_ms": round(durasi * 1000, 2),
+                "upstream_requests": stub.requests,
+                "circuit": cs.LLM_ROUTER.breaker(stub.url).status,
+            }
+        finally:
+            cs.LLM_TASK_DEADLINES.pop(task, None)
+            await stub.close()
+    return hasil
+
+async def bench_single_flight(cs, latency: float, jumlah: int = 8) -> dict:
+    """
+    Fires `jumlah` identical calls at once (like a resent message, or two jobs failing with the
+    same log), cancels one of them early, and counts what reached upstream.
+    """
+    stub = await StubLLMServer(latency, 0, 5).start()
+    pesan = [{"role": "system", "content": "You are a helpful assistant."}, {"role": "user", "content": "explain this error"}]
+    try:
+        tugas = [asyncio.ensure_future(cs.call_llm_async(pesan, f"stub@{stub.url}", "benchmark", task="bench_single_flight", use_cache=False))
+                 for _ in range(jumlah)]
+        await asyncio.sleep(latency / 3)
+        tugas[0].cancel()
+        hasil = await asyncio.gather(*tugas, return_exceptions=True)
+        return {
+            "calls": jumlah,
+            "answered": sum(1 for h in hasil if isinstance(h, tuple) and h[0]),
+            "upstream_requests": stub.requests,
+            "coalesced": sum(nilai for nama, label, nilai in cs.METRICS.counter()
+                             if nama == "llm_coalesced_total" and label.get("task") == "bench_single_flight"),
+        }
+    finally:
+        await stub.close()
+
+
+# === MarkdownV2 renderer ===
+def render_markdown_lama(pesan_raw: str) -> str:
+    """The renderer before the single-pass rewrite, kept as the reference for comparison."""
+    pesan = re.sub(r'\033\[[0-9;]*m', '', pesan_raw)
+    bagian = []
+    for ml_part in re.split(r'(```(?:\w+)?\n.*?```)', pesan, flags=re.DOTALL):
+        if ml_part.startswith('```') and ml_part.endswith('```'):
+            bagian.append(ml_part)
+            continue
+        for il_part in re.split(r'(`[^`]+`)', ml_part):
+            if il_part.startswith('`') and il_part.endswith('`'):
+                bagian.append(il_part)
+            else:
+                bagian.append(re.sub(r'[\[\]()~`>#+\-=|{}.!]', r'\\\g<0>', il_part.replace('\\', '\\\\')))
+    return "".join(bagian)
+
+def bench_markdown(cs, kasus: int, iterasi: int = 2000) -> dict:
+    """
+    Fuzzes the renderer with random markup-heavy text (how often would Telegram reject the
+    result, and does the visible text survive?) and times it on typical messages, both
+    against the legacy renderer.
+    """
+    acak = random.Random(25)
+    ditolak = {"legacy": 0, "single_pass": 0}
+    teks_berubah = 0
+    contoh = None
+    for _ in range(kasus):
+        pesan = "".join(acak.choice(POTONGAN_FUZZ) for _ in range(acak.randint(1, 120)))
+        if periksa_markdown_v2(render_markdown_lama(pesan))[0]:
+            ditolak["legacy"] += 1
+        galat, terlihat = periksa_markdown_v2(cs.format_pesan_markdown_v2(pesan))
+        if galat:
+            ditolak["single_pass"] += 1
+            contoh = contoh or {"input": pesan, "error": galat}
+        elif tanpa_markup(terlihat) != tanpa_markup(cs._teks_polos(pesan)):
+            teks_berubah += 1
+            contoh = contoh or {"input": pesan, "error": "visible text changed"}
+
+    log = "```log\n" + "\n".join(f"[{i:05d}] compiling module_{i}.c ... ok (0.{i:03d}s) -> build/obj-{i}.o" for i in range(10)) + "\n```"
+    jawaban = ("**Summary**: the `KeyError` comes from `config['path']` (line 42).\n\n"
+               "* check that the key exists\n* use `dict.get()` with a default\n\n"
+               "```python\nvalue = config.get('path', '/tmp')  # fallback\nprint(f\"{value!r}\")\n```\n"
+               "Then re-run `python app.py --verbose`. That's it!") * 3
+    sampel = {"status": "*✅ SUCCESS* File `add_numbers.py` successfully deleted.", "log_chunk": log, "llm_answer": jawaban}
+    waktu = {}
+    for nama, pesan in sampel.items():
+        for label, fungsi in (("legacy", render_markdown_lama), ("single_pass", cs.format_pesan_markdown_v2)):
+            t0 = time.perf_counter()
+            for _ in range(iterasi):
+                fungsi(pesan)
+            waktu.setdefault(nama, {})[f"{label}_us"] = round((time.perf_counter() - t0) / iterasi * 1e6, 2)
+    return {
+        "fuzz_cases": kasus,
+        "rejected": ditolak,
+        "visible_text_changed": teks_berubah,
+        "first_failure": contoh,
+        "render_us": waktu,
+    }
+
+
+# === Comparison ===
+def _ratakan(data, awalan: str = "") -> dict:
+    hasil = {}
+    if isinstance(data, dict):
+        for kunci, nilai in data.items():
+            hasil.update(_ratakan(nilai, f"{awalan}.{kunci}" if awalan else str(kunci)))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        hasil[awalan] = data
+    return hasil
+
+def bandingkan(lama: dict, baru: dict) -> list:
+    """Returns (metric, old, new, change %) for every numeric metric present in both results."""
+    a, b = _ratakan(lama.get("results", {})), _ratakan(baru.get("results", {}))
+    baris = []
+    for kunci in sorted(a.keys() & b.keys()):
+        perubahan = (b[kunci] - a[kunci]) / a[kunci] * 100 if a[kunci] else None
+        baris.append((kunci, a[kunci], b[kunci], perubahan))
+    return baris
+
+
+# === Runner ===
+async def jalankan_benchmark(args) -> dict:
+    stub = await StubLLMServer(args.llm_latency, args.token_rate, args.response_tokens).start()
+    direktori = tempfile.mkdtemp(prefix="cognitiveshell-bench-")
+    siapkan_lingkungan(direktori, stub.url, cache=args.with_cache, rate_limit=args.realistic_rate)
+    asal = os.getcwd()
+    # Generated files and shell commands stay inside the scratch directory
+    os.chdir(direktori)
+    try:
+        from cognitive_shell import cognitveshell as cs
+        cs.check_system_info(background=False)
+        bot = FakeBot(args.telegram_latency)
+        hasil = {"intent_paths": {}}
+        for jalur in args.paths:
+            print(f"[Benchmark] {jalur} x{args.iterations} ...", file=sys.stderr)
+            hasil["intent_paths"][jalur] = await bench_jalur_niat(cs, bot, jalur, args.iterations)
+        if args.shell_bytes:
+            print(f"[Benchmark] shell throughput ({args.shell_bytes} bytes) ...", file=sys.stderr)
+            hasil["shell_throughput"] = await bench_throughput_shell(cs, bot, args.shell_bytes)
+        print(f"[Benchmark] error detection ...", file=sys.stderr)
+        hasil["error_detection"] = bench_deteksi_error(cs)
+        if args.resilience:
+            print(f"[Benchmark] failure scenarios ...", file=sys.stderr)
+            hasil["resilience"] = await bench_ketahanan(cs, args.llm_latency)
+        hasil["single_flight"] = await bench_single_flight(cs, args.llm_latency)
+        if args.markdown_cases:
+            print(f"[Benchmark] MarkdownV2 renderer ({args.markdown_cases} fuzz cases) ...", file=sys.stderr)
+            hasil["markdown"] = bench_markdown(cs, args.markdown_cases)
+        hasil["stages"] = {
+            nama + "".join(f",{k}={v}" for k, v in label.items()): {"count": h.count, "p50": round(h.kuantil(0.5), 6), "p95": round(h.kuantil(0.95), 6), "max": round(h.maks, 6)}
+            for nama, label, h in cs.METRICS.histogram()
+        }
+        hasil["memory"] = memori_saat_ini()
+        hasil["llm_requests"] = stub.requests
+        hasil["telegram_queue"] = cs.TELEGRAM_SEND_QUEUE.ringkasan()
+        await cs.SHELL_JOB_MANAGER.hentikan_semua()
+        await cs.close_llm_http_client()
+        return hasil
+    finally:
+        os.chdir(asal)
+        await stub.close()
+        shutil.rmtree(direktori, ignore_errors=True)
+
+def _versi_paket() -> str:
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+        try:
+            return version("neuronet-ai-cognitiveshell")
+        except PackageNotFoundError:
+            return "unknown"
+    except ImportError:
+        return "unknown"
+
+def cetak_ringkasan(data: dict):
+    hasil = data["results"]
+    print(f"{'path':<18}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'msgs/cmd':>10}{'errors':>8}")
+    for jalur, r in hasil["intent_paths"].items():
+        print(f"{jalur:<18}{r.get('p50_ms', 0):>10}{r.get('p95_ms', 0):>10}{r.get('p99_ms', 0):>10}{r.get('messages_per_command', 0):>10}{r.get('errors', 0):>8}")
+    if "shell_throughput" in hasil:
+        s = hasil["shell_throughput"]
+        print(f"shell output: {s['mb_per_s']} MB/s, {s['lines_per_s']} lines/s, {s['messages']} messages")
+    for lingkup, r in hasil["error_detection"].items():
+        print(f"error detection ({lingkup}): {r['mb_per_s']} MB/s")
+    for nama, r in hasil.get("resilience", {}).items():
+        print(f"{nama}: {'ok' if r['ok'] else 'UNEXPECTED'} (success={r['success']}, last call {r['last_call_ms']} ms, "
+              f"{r['upstream_requests']} upstream requests, circuit {r['circuit']})")
+    if "single_flight" in hasil:
+        s = hasil["single_flight"]
+        print(f"single flight: {s['calls']} identical calls, {s['answered']} answered, {s['upstream_requests']} upstream requests")
+    if "markdown" in hasil:
+        md = hasil["markdown"]
+        print(f"markdown fuzz: {md['fuzz_cases']} cases, rejected legacy={md['rejected']['legacy']} single_pass={md['rejected']['single_pass']}, "
+              f"visible text changed={md['visible_text_changed']}")
+        for nama, r in md["render_us"].items():
+            print(f"markdown render ({nama}): legacy {r['legacy_us']} us, single pass {r['single_pass_us']} us")
+    print(f"memory: {hasil['memory']}")
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Offline CognitiveShell benchmark (stub LLM, fake Telegram).")
+    parser.add_argument("-n", "--iterations", type=int, default=20, help="Iterations per intent path (default 20)")
+    parser.add_argument("--paths", default="shell_literal,shell_translated,program,conversation,debug",
+                        help="Comma-separated intent paths to run")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Stub time to first byte in seconds")
+    parser.add_argument("--token-rate", type=float, default=80.0, help="Stub tokens per second (0 = instant)")
+    parser.add_argument("--response-tokens", type=int, default=60, help="Tokens in conversational/code answers")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="Fake Bot API round trip in seconds")
+    parser.add_argument("--realistic-rate", action="store_true", help="Keep the configured Telegram rate limits")
+    parser.add_argument("--shell-bytes", type=int, default=8 * 1024 * 1024, help="Bytes of output for the throughput run (0 = skip)")
+    parser.add_argument("--with-cache", action="store_true", help="Leave the LLM and error caches enabled")
+    parser.add_argument("--markdown-cases", type=int, default=3000, help="Random messages for the MarkdownV2 fuzz run (0 = skip)")
+    parser.add_argument("--no-resilience", dest="resilience", action="store_false", help="Skip the upstream failure scenarios")
+    parser.add_argument("-o", "--output", help="Write the JSON result to this file")
+    parser.add_argument("--compare", help="Previous JSON result to compare against")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Keep the bot's INFO logging")
+    args = parser.parse_args(argv)
+    args.paths = [p.strip() for p in args.paths.split(",") if p.strip()]
+    tidak_dikenal = [p for p in args.paths if p != "debug" and p not in PESAN_PER_JALUR]
+    if tidak_dikenal:
+        parser.error(f"unknown path(s): {', '.join(tidak_dikenal)}")
+
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    mulai = time.time()
+    hasil = asyncio.run(jalankan_benchmark(args))
+    data = {
+        "meta": {
+            "version": _versi_paket(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "started_at": mulai,
+            "duration_s": round(time.time() - mulai, 2),
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "verbose")},
+        },
+        "results": hasil,
+    }
+
+    cetak_ringkasan(data)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(data, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            lama = json.load(f)
+        print(f"\n{'metric':<55}{'old':>12}{'new':>12}{'change':>10}")
+        for kunci, a, b, perubahan in bandingkan(lama, data):
+            print(f"{kunci:<55}{a:>12}{b:>12}{'' if perubahan is None else f'{perubahan:+.1f}%':>10}")
+    return data
+
+def skenario_gagal(data: dict) -> list:
+    """Names of the failure scenarios whose outcome was not the expected one."""
+    return [nama for nama, r in data["results"].get("resilience", {}).items() if not r["ok"]]
+
+if __name__ == "__main__":
+    gagal = skenario_gagal(main())
+    if gagal:
+        print(f"[Benchmark] Unexpected outcome in failure scenario(s): {', '.join(gagal)}", file=sys.stderr)
+        sys.exit(1)
@@ -1,20 +1,43 @@
 import pexpect
-import requests
+import httpx
 import re
 import os
 import time
 import subprocess
 import logging
 import shlex
-from telegram import Update
+import weakref
+import shutil
+import json
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+import math
+import platform
+import itertools
+import codecs
+import signal
+import bisect
+import random
+import email.utils
+try:
+    import resource
+except ImportError:  # Not available on every platform; limits are then not applied
+    resource = None
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, OrderedDict, deque
+from typing import Awaitable, Callable
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
 from telegram.constants import ChatAction, ParseMode
 from telegram.ext import (
     Application,
+    CallbackQueryHandler,
     CommandHandler,
     MessageHandler,
     filters,
     CallbackContext,
-    ConversationHandler,
     JobQueue
 )
 from dotenv import load_dotenv
@@ -30,7 +53,8 @@ LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://openrouter.ai/api/v1/chat/comp
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID", "")
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 
-# Configure LLM models for various tasks
+# Configure LLM models for various tasks. Each may be an ordered, comma-separated list of
+# candidates ("model" or "model@https://host/v1/chat/completions"); the router picks the fastest healthy one
 CODE_GEN_MODEL = os.getenv("CODE_GEN_MODEL", "moonshotai/kimi-dev-72b:free")
 ERROR_FIX_MODEL = os.getenv("ERROR_FIX_MODEL", "nvidia/llama-3.3-nemotron-super-49b-v1:free")
 CONVERSATION_MODEL = os.getenv("CONVERSATION_MODEL", "mistralai/mistral-small-3.2-24b-instruct")
@@ -38,6 +62,146 @@ COMMAND_CONVERSION_MODEL = os.getenv("COMMAND_CONVERSION_MODEL", "nvidia/llama-3
 FILENAME_GEN_MODEL = os.getenv("FILENAME_GEN_MODEL", "mistralai/mistral-small-3.2-24b-instruct")
 INTENT_DETECTION_MODEL = os.getenv("INTENT_DETECTION_MODEL", "mistralai/mistral-small-3.2-24b-instruct")
 
+# Configure the pooled HTTP client used for LLM requests
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "300"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "10"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "5"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_MAX_CONCURRENT_REQUESTS = int(os.getenv("LLM_MAX_CONCURRENT_REQUESTS", "4"))
+
+# Model router: EWMA of latency and error rate per candidate. A candidate whose error rate reaches
+# LLM_ROUTER_MAX_ERROR_RATE is skipped for LLM_ROUTER_COOLDOWN seconds after its last failure.
+# While another candidate remains, an attempt gets LLM_ATTEMPT_TIMEOUT seconds to produce its first byte.
+LLM_ROUTER_EWMA_ALPHA = float(os.getenv("LLM_ROUTER_EWMA_ALPHA", "0.3"))
+LLM_ROUTER_MAX_ERROR_RATE = float(os.getenv("LLM_ROUTER_MAX_ERROR_RATE", "0.5"))
+LLM_ROUTER_COOLDOWN = float(os.getenv("LLM_ROUTER_COOLDOWN", "60"))
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "90"))
+# Hedged requests (non-streamed calls only): a second attempt starts once the first has taken longer
+# than the candidate's p95 (LLM_HEDGE_DEFAULT_DELAY until LLM_HEDGE_MIN_SAMPLES calls were seen)
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "8"))
+# Retries: HTTP 408/425/429/5xx, timeouts and connection errors are retried up to LLM_RETRY_MAX_ATTEMPTS
+# times in total, with full-jitter exponential back-off (at least the server's Retry-After)
+LLM_RETRY_MAX_ATTEMPTS = int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "20"))
+LLM_RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+# Circuit breaker per endpoint: after LLM_BREAKER_THRESHOLD consecutive upstream failures requests fail
+# fast for LLM_BREAKER_COOLDOWN seconds, then a single probe decides whether the endpoint is back
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# Identical LLM calls in flight at the same time share one upstream request and its answer
+LLM_SINGLE_FLIGHT = os.getenv("LLM_SINGLE_FLIGHT", "true").lower() in ("1", "true", "yes")
+
+# Stream LLM answers into a single Telegram message that is edited as tokens arrive
+LLM_STREAMING_ENABLED = os.getenv("LLM_STREAMING_ENABLED", "true").lower() in ("1", "true", "yes")
+TELEGRAM_STREAM_EDIT_INTERVAL = float(os.getenv("TELEGRAM_STREAM_EDIT_INTERVAL", "1.0"))
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Outbound Telegram queue: token buckets per chat and across all chats (Telegram allows
+# roughly one message per second per chat and 30 per second overall)
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1.0"))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "5"))
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_GLOBAL_BURST = int(os.getenv("TELEGRAM_GLOBAL_BURST", "30"))
+TELEGRAM_SEND_QUEUE_MAX = int(os.getenv("TELEGRAM_SEND_QUEUE_MAX", "200"))
+TELEGRAM_SEND_MAX_RETRIES = int(os.getenv("TELEGRAM_SEND_MAX_RETRIES", "3"))
+# Updates handled at the same time, so a slow LLM answer does not hold up /kill, /jobs or other messages
+TELEGRAM_CONCURRENT_UPDATES = int(os.getenv("TELEGRAM_CONCURRENT_UPDATES", "16"))
+
+# Shell output is batched into log messages flushed by size, by age, or when the process exits
+SHELL_LOG_BATCH_BYTES = int(os.getenv("SHELL_LOG_BATCH_BYTES", "3500"))
+SHELL_LOG_FLUSH_INTERVAL = float(os.getenv("SHELL_LOG_FLUSH_INTERVAL", "1.0"))
+
+# LLM response cache: in-memory LRU in front of a SQLite store that survives restarts
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cognitiveshell", "llm_cache.sqlite3"))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "256"))
+LLM_CACHE_DISK_ENTRIES = int(os.getenv("LLM_CACHE_DISK_ENTRIES", "5000"))
+# Calls sampled above this temperature are creative answers and are never cached
+LLM_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.5"))
+# Time-to-live in seconds per task, overridable with e.g. LLM_CACHE_TTLS="intent=3600,filename=86400"
+def _baca_peta_tugas(nama_env: str, default: dict) -> dict:
+    """Reads a per-task setting such as "intent=3600,filename=86400" from the environment on top of defaults."""
+    peta = dict(default)
+    peta.update({
+        task.strip(): float(nilai) for task, _, nilai in
+        (item.partition("=") for item in os.getenv(nama_env, "").split(",") if "=" in item)
+    })
+    return peta
+
+LLM_CACHE_TTLS = _baca_peta_tugas("LLM_CACHE_TTLS", {"intent": 7 * 86400, "shell_command": 86400, "filename": 7 * 86400, "default": 3600})
+
+# Input token budget per task for prompts built by bangun_pesan_llm (e.g. PROMPT_TOKEN_BUDGETS="code=4000")
+PROMPT_TOKEN_BUDGETS = _baca_peta_tugas("PROMPT_TOKEN_BUDGETS", {
+    "code": 3000, "shell_command": 1200, "error_fix": 2500, "conversation": 2000, "structured": 3000, "default": 2000,
+})
+# Deadline in seconds per task for a whole LLM call, retries included, until its answer starts streaming (e.g. LLM_TASK_DEADLINES="code=300")
+LLM_TASK_DEADLINES = _baca_peta_tugas("LLM_TASK_DEADLINES", {
+    "intent": 20, "filename": 20, "shell_command": 45, "code": 240, "structured": 240, "error_fix": 180, "conversation": 120, "default": 120,
+})
+PROMPT_MAX_HISTORY_MESSAGES = int(os.getenv("PROMPT_MAX_HISTORY_MESSAGES", "10"))
+
+# Error-fingerprint cache: reuse AI suggestions for errors that were seen before
+ERROR_CACHE_ENABLED = os.getenv("ERROR_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ERROR_CACHE_TTL = float(os.getenv("ERROR_CACHE_TTL", str(30 * 86400)))
+ERROR_CACHE_MAX_ENTRIES = int(os.getenv("ERROR_CACHE_MAX_ENTRIES", "500"))
+
+# Session store: user contexts and chat histories kept in an LRU of active chats, backed by SQLite
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join(os.path.expanduser("~"), ".cognitiveshell", "sessions.sqlite3"))
+SESSION_MEMORY_CHATS = int(os.getenv("SESSION_MEMORY_CHATS", "64"))
+SESSION_HISTORY_MAX_MESSAGES = int(os.getenv("SESSION_HISTORY_MAX_MESSAGES", "40"))
+SESSION_HISTORY_MAX_CHARS = int(os.getenv("SESSION_HISTORY_MAX_CHARS", "4000"))
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "5"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(30 * 86400)))
+
+# Latency spans aggregated into in-process histograms (/stats); a Prometheus text endpoint
+# is served on METRICS_HTTP_HOST:METRICS_HTTP_PORT when the port is set
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+METRICS_HTTP_HOST = os.getenv("METRICS_HTTP_HOST", "127.0.0.1")
+METRICS_HTTP_PORT = int(os.getenv("METRICS_HTTP_PORT", "0"))
+
+# Memory caps for the captured output of shell commands, per chat
+SHELL_OUTPUT_MAX_LINES = int(os.getenv("SHELL_OUTPUT_MAX_LINES", "2000"))
+SHELL_OUTPUT_MAX_BYTES = int(os.getenv("SHELL_OUTPUT_MAX_BYTES", str(256 * 1024)))
+
+# Background shell jobs: running jobs across all chats, running jobs per chat, jobs waiting for a slot
+SHELL_JOBS_MAX_CONCURRENT = int(os.getenv("SHELL_JOBS_MAX_CONCURRENT", "4"))
+SHELL_JOBS_MAX_PER_CHAT = int(os.getenv("SHELL_JOBS_MAX_PER_CHAT", "2"))
+SHELL_JOBS_MAX_QUEUED = int(os.getenv("SHELL_JOBS_MAX_QUEUED", "10"))
+SHELL_JOBS_HISTORY = int(os.getenv("SHELL_JOBS_HISTORY", "20"))
+
+# Execution profiles applied to every spawned command. cpu: CPU seconds, as: address space,
+# data: heap/private memory, nofile: open files, fsize: size of files written, wall: wall-clock
+# seconds, output: bytes of terminal output. "default" caps data rather than address space because
+# runtimes such as V8 or Go reserve large address ranges up front.
+PROFIL_EKSEKUSI = {
+    "strict": {"cpu": 60, "as": 1024 ** 3, "nofile": 256, "fsize": 64 * 1024 ** 2, "wall": 300, "output": 8 * 1024 ** 2},
+    "default": {"cpu": 1800, "data": 2 * 1024 ** 3, "nofile": 1024, "fsize": 1024 ** 3, "wall": 7200, "output": 64 * 1024 ** 2},
+    "unlimited": {},
+}
+SHELL_LIMIT_PROFILE = os.getenv("SHELL_LIMIT_PROFILE", "default").lower()
+# Per-limit overrides on top of the profile, e.g. SHELL_LIMITS="wall=600,cpu=120" (0 removes a limit)
+SHELL_LIMITS = _baca_peta_tugas("SHELL_LIMITS", PROFIL_EKSEKUSI.get(SHELL_LIMIT_PROFILE, PROFIL_EKSEKUSI["default"]))
+# Seconds between SIGTERM and SIGKILL when a command is stopped
+SHELL_KILL_GRACE = float(os.getenv("SHELL_KILL_GRACE", "5"))
+
+# Extra error-detection rules (JSON list of rule objects, see ATURAN_ERROR_BAWAAN)
+ERROR_RULES_PATH = os.getenv("ERROR_RULES_PATH", os.path.join(os.path.expanduser("~"), ".cognitiveshell", "error_rules.json"))
+
+# "local": derive filenames from the prompt without a network call. "llm": ask FILENAME_GEN_MODEL
+FILENAME_GEN_MODE = os.getenv("FILENAME_GEN_MODE", "local").lower()
+
+# "multi": intent -> code -> filename as separate LLM calls. "combined": one structured JSON call
+PROGRAM_PIPELINE_MODE = os.getenv("PROGRAM_PIPELINE_MODE", "multi").lower()
+STRUCTURED_PIPELINE_MODEL = os.getenv("STRUCTURED_PIPELINE_MODEL", CODE_GEN_MODEL)
+
+# Local intent classifier: the LLM is only consulted below this confidence
+INTENT_LOCAL_ENABLED = os.getenv("INTENT_LOCAL_ENABLED", "true").lower() in ("1", "true", "yes")
+INTENT_LOCAL_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_LOCAL_CONFIDENCE_THRESHOLD", "0.75"))
+
 # ANSI colors for Termux console output (for internal logs only)
 COLOR_GREEN = "\033[92m"
 COLOR_YELLOW = "\033[93m"
@@ -46,8 +210,8 @@ COLOR_BLUE = "\033[94m"
 COLOR_PURPLE = "\033[95m"
 COLOR_RESET = "\033[0m"
 
-# State for ConversationHandler (debugging)
-DEBUGGING_STATE = 1
+# Unanswered debug questions kept per chat; older ones expire
+DEBUG_PENDING_MAX = 5
 
 # --- Logging Configuration ---
 # Modify logger format to be more concise and readable
@@ -62,33 +226,317 @@ logger = logging.getLogger(__name__)
 SYSTEM_INFO = {
     "os": "Unknown",
     "shell": "Unknown",
-    "neofetch_output": "Not available"
+    "neofetch_output": "Not available",
+    # Compact structured profile (os, shell, arch, package manager, interpreters) used in prompts
+    "profile": {}
 }
+SYSTEM_PROFILE_PATH = os.getenv("SYSTEM_PROFILE_PATH", os.path.join(os.path.expanduser("~"), ".cognitiveshell", "system_profile.json"))
+# neofetch only enriches the natively collected details: "auto" uses it when installed, "false" never
+SYSTEM_INFO_NEOFETCH = os.getenv("SYSTEM_INFO_NEOFETCH", "auto").lower()
+# A cached profile is also re-detected after this many seconds (interpreters get installed/upgraded)
+SYSTEM_PROFILE_MAX_AGE = float(os.getenv("SYSTEM_PROFILE_MAX_AGE", str(7 * 86400)))
+# Durations of the startup phases in seconds, reported once the bot is ready
+STARTUP_TIMINGS: dict = {}
+
+# --- Bounded buffer for captured shell output ---
+class OutputRingBuffer:
+    """
+    Keeps the most recent output lines of a command, capped by line count and by
+    UTF-8 bytes. Appending is O(1) amortized; the oldest lines are evicted first.
+    Lines are numbered from the start of the command, so `window` stays stable
+    while old lines are dropped.
+    """
+
+    def __init__(self, max_lines: int = SHELL_OUTPUT_MAX_LINES, max_bytes: int = SHELL_OUTPUT_MAX_BYTES):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self._lines: deque = deque()
+        self._sizes: deque = deque()
+        self._bytes = 0
+        self.total_lines = 0
+        self.dropped_lines = 0
+
+    def append(self, line: str):
+        size = (len(line) if line.isascii() else len(line.encode("utf-8", "replace"))) + 1
+        if size > self.max_bytes:
+            # A single line larger than the whole budget: keep its tail
+            line = line[-(self.max_bytes // 4):]
+            size = len(line.encode("utf-8", "replace")) + 1
+        self._lines.append(line)
+        self._sizes.append(size)
+        self._bytes += size
+        self.total_lines += 1
+        while len(self._lines) > self.max_lines or self._bytes > self.max_bytes:
+            self._lines.popleft()
+            self._bytes -= self._sizes.popleft()
+            self.dropped_lines += 1
+
+    def extend(self, lines):
+        lines = list(lines)
+        if len(lines) > self.max_lines:
+            # Lines that would be evicted within this same batch are only counted
+            lewati = len(lines) - self.max_lines
+            self.total_lines += lewati
+            self.dropped_lines += lewati
+            lines = lines[lewati:]
+        if "".join(lines).isascii():
+            sizes = [n + 1 for n in map(len, lines)]
+        else:
+            sizes = [len(line.encode("utf-8", "replace")) + 1 for line in lines]
+        if any(size > self.max_bytes for size in sizes):
+            for line in lines:
+                self.append(line)
+            return
+        self._lines.extend(lines)
+        self._sizes.extend(sizes)
+        self._bytes += sum(sizes)
+        self.total_lines += len(lines)
+        while len(self._lines) > self.max_lines or self._bytes > self.max_bytes:
+            self._lines.popleft()
+            self._bytes -= self._sizes.popleft()
+            self.dropped_lines += 1
+
+    def __len__(self) -> int:
+        return len(self._lines)
+
+    def __bool__(self) -> bool:
+        return bool(self._lines)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def tail_lines(self, n: int) -> list:
+        """Returns the last n lines, oldest first."""
+        n = min(n, len(self._lines))
+        return list(itertools.islice(self._lines, len(self._lines) - n, None))
+
+    def tail_chars(self, n: int) -> str:
+        """Returns the last n characters of the joined output, reading only the lines it needs."""
+        parts = []
+        total = 0
+        for line in reversed(self._lines):
+            parts.append(line)
+            total += len(line) + 1
+            # Stop only once there is more than n, so a line that fits exactly still gets its leading newline
+            if total > n:
+                break
+        return "\n".join(reversed(parts))[-n:]
+
+    def window(self, start: int, end: int = None) -> list:
+        """Returns lines [start, end) by line number since the command started (dropped lines are skipped)."""
+        offset = self.total_lines - len(self._lines)
+        start = max(start - offset, 0)
+        end = len(self._lines) if end is None else max(min(end - offset, len(self._lines)), start)
+        return list(itertools.islice(self._lines, start, end))
+
+    def text(self) -> str:
+        return "\n".join(self._lines)
+
+    def clear(self):
+        self._lines.clear()
+        self._sizes.clear()
+        self._bytes = 0
+        self.total_lines = 0
+        self.dropped_lines = 0
 
 # --- Global Functions for Context Storage ---
-user_contexts: dict = {}
-chat_histories: dict = {}
+def _konteks_awal() -> dict:
+    return {
+        "last_error_log": None,
+        "last_command_run": None,
+        "last_generated_code": None,
+        "pending_debug": {},
+        "full_error_output": OutputRingBuffer(),
+        "last_user_message_intent": None,
+        "last_ai_response_type": None,
+        "last_generated_code_language": None
+    }
+
+class SessionStore:
+    """
+    Keeps user contexts and chat histories for the most recently active chats in an
+    in-memory LRU (OrderedDict), backed by a SQLite table in WAL mode so they survive restarts.
+    A chat is loaded lazily on first access. Callers mutate the returned dict/list in place,
+    so changes are detected at flush time by comparing each session's serialized form with
+    what was last written (write-behind); evicted chats are written on the next flush.
+    The output ring buffer (full_error_output) is never persisted and starts empty after a load.
+    If the SQLite file cannot be opened the store stays memory-only.
+    """
+
+    _TIDAK_DISIMPAN = ("full_error_output",)
+
+    def __init__(self, path: str, memory_chats: int, history_max_messages: int, history_max_chars: int, ttl: float):
+        self.path = path
+        self.memory_chats = memory_chats
+        self.history_max_messages = history_max_messages
+        self.history_max_chars = history_max_chars
+        self.ttl = ttl
+        self._sesi: OrderedDict = OrderedDict()
+        self._tersimpan: dict = {}
+        self._tertunda: dict = {}
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_failed = False
+        self.stats = Counter()
+
+    def _connection(self):
+        if self._db is None and not self._db_failed and self.path:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._db = sqlite3.connect(self.path, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS sessions ("
+                    "chat_id INTEGER PRIMARY KEY, context TEXT NOT NULL, history TEXT NOT NULL, updated_at REAL NOT NULL)"
+                )
+                self._db.execute("DELETE FROM sessions WHERE updated_at <= ?", (time.time() - self.ttl,))
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"[Session] ⚠ Cannot open session store at {self.path}: {e}. Using memory only.")
+                self._db = None
+                self._db_failed = True
+        return self._db
+
+    def _serialisasi(self, sesi: dict) -> tuple:
+        konteks = {k: v for k, v in sesi["context"].items() if k not in self._TIDAK_DISIMPAN}
+        return json.dumps(konteks, ensure_ascii=False, default=str), json.dumps(sesi["history"], ensure_ascii=False)
+
+    def _muat(self, chat_id: int) -> dict:
+        """Returns the session for chat_id, loading it from SQLite (or creating it) on first access."""
+        sesi = self._sesi.get(chat_id)
+        if sesi is not None:
+            self._sesi.move_to_end(chat_id)
+            self.stats["memory_hits"] += 1
+            return sesi
+
+        konteks = _konteks_awal()
+        history = []
+        baris = None
+        with self._lock:
+            # A chat evicted but not yet written is newer than its row on disk
+            tertunda = self._tertunda.pop(chat_id, None)
+            if tertunda is not None:
+                baris = tertunda
+            else:
+                db = self._connection()
+                if db is not None:
+                    try:
+                        baris = db.execute("SELECT context, history FROM sessions WHERE chat_id = ?", (chat_id,)).fetchone()
+                    except sqlite3.Error as e:
+                        logger.warning(f"[Session] ⚠ Failed to load session for {chat_id}: {e}")
+        if baris is not None:
+            try:
+                konteks.update(json.loads(baris[0]))
+                history = json.loads(baris[1])
+                self.stats["loaded"] += 1
+            except (TypeError, ValueError) as e:
+                logger.warning(f"[Session] ⚠ Ignoring unreadable session for {chat_id}: {e}")
+        else:
+            self.stats["created"] += 1
+
+        sesi = {"context": konteks, "history": history}
+        self._sesi[chat_id] = sesi
+        if tertunda is not None:
+            self._tersimpan[chat_id] = None
+        elif baris is not None:
+            self._tersimpan[chat_id] = tuple(baris)
+        else:
+            # New sessions are only written once something changes
+            self._tersimpan[chat_id] = self._serialisasi(sesi)
+        while len(self._sesi) > self.memory_chats:
+            lama_id, lama = self._sesi.popitem(last=False)
+            data = self._serialisasi(lama)
+            if data != self._tersimpan.pop(lama_id, None):
+                with self._lock:
+                    self._tertunda[lama_id] = data
+            self.stats["evictions"] += 1
+        return sesi
+
+    def context(self, chat_id: int) -> dict:
+        return self._muat(chat_id)["context"]
+
+    def history(self, chat_id: int) -> list:
+        return self._muat(chat_id)["history"]
+
+    def tambah_riwayat(self, chat_id: int, *pesan: dict):
+        """Appends messages to a chat history and compacts it to the configured caps."""
+        history = self.history(chat_id)
+        for p in pesan:
+            konten = str(p.get("content", ""))
+            if len(konten) > self.history_max_chars:
+                konten = konten[:self.history_max_chars] + " …[truncated]"
+            history.append({"role": p.get("role"), "content": konten})
+        if len(history) > self.history_max_messages:
+            del history[:len(history) - self.history_max_messages]
+
+    def hapus_riwayat(self, chat_id: int) -> bool:
+        """Clears a chat history. Returns False if there was nothing to clear."""
+        history = self.history(chat_id)
+        if not history:
+            return False
+        history.clear()
+        return True
+
+    def ambil_perubahan(self) -> dict:
+        """Collects sessions changed since the last write (call on the event loop thread)."""
+        perubahan = {}
+        for chat_id, sesi in self._sesi.items():
+            data = self._serialisasi(sesi)
+            if data != self._tersimpan.get(chat_id):
+                perubahan[chat_id] = data
+        with self._lock:
+            perubahan.update(self._tertunda)
+            self._tertunda.clear()
+        return perubahan
+
+    def tulis(self, perubahan: dict):
+        """Writes collected changes in one transaction (safe to call from a worker thread)."""
+        if not perubahan:
+            return
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            if db is None:
+                return
+            try:
+                db.executemany(
+                    "INSERT OR REPLACE INTO sessions (chat_id, context, history, updated_at) VALUES (?, ?, ?, ?)",
+                    [(chat_id, data[0], data[1], now) for chat_id, data in perubahan.items()],
+                )
+                db.commit()
+                self.stats["writes"] += len(perubahan)
+                self.stats["flushes"] += 1
+            except sqlite3.Error as e:
+                logger.warning(f"[Session] ⚠ Failed to write {len(perubahan)} session(s): {e}")
+                return
+        for chat_id, data in perubahan.items():
+            if chat_id in self._sesi:
+                self._tersimpan[chat_id] = data
+
+    def flush(self):
+        """Collects and writes pending changes synchronously (used at shutdown)."""
+        self.tulis(self.ambil_perubahan())
+
+    def ringkasan(self) -> dict:
+        return dict(self.stats, memory_chats=len(self._sesi), pending_evicted=len(self._tertunda))
+
+SESSION_STORE = SessionStore(SESSION_DB_PATH, SESSION_MEMORY_CHATS, SESSION_HISTORY_MAX_MESSAGES, SESSION_HISTORY_MAX_CHARS, SESSION_TTL)
+
+async def simpan_sesi_berkala(context: CallbackContext):
+    """JobQueue callback: writes changed sessions in a worker thread (write-behind)."""
+    perubahan = SESSION_STORE.ambil_perubahan()
+    if perubahan:
+        await asyncio.to_thread(SESSION_STORE.tulis, perubahan)
 
 def get_user_context(chat_id: int) -> dict:
-    """Retrieves user context. Initializes if not already present."""
-    if chat_id not in user_contexts:
-        user_contexts[chat_id] = {
-            "last_error_log": None,
-            "last_command_run": None,
-            "last_generated_code": None,
-            "awaiting_debug_response": False,
-            "full_error_output": [],
-            "last_user_message_intent": None,
-            "last_ai_response_type": None,
-            "last_generated_code_language": None
-        }
-    return user_contexts[chat_id]
+    """Retrieves user context. Loads or initializes it if not already present."""
+    return SESSION_STORE.context(chat_id)
 
 def get_chat_history(chat_id: int) -> list:
-    """Retrieves user chat history. Initializes if not already present."""
-    if chat_id not in chat_histories:
-        chat_histories[chat_id] = []
-    return chat_histories[chat_id]
+    """Retrieves user chat history. Loads or initializes it if not already present."""
+    return SESSION_STORE.history(chat_id)
 
 def _escape_plaintext_markdown_v2(text: str) -> str:
     """
@@ -110,22 +558,1013 @@ def _escape_plaintext_markdown_v2(text: str) -> str:
     
     return escaped_text
 
+# === Metrics: latency spans and histograms ===
+# Upper bucket bounds (Prometheus "le"): seconds for durations, counts for token sizes
+_BUCKET_DETIK = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+_BUCKET_TOKEN = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+class Histogram:
+    """Fixed-bucket histogram with count, sum and max; quantiles are interpolated within a bucket."""
+
+    __slots__ = ("batas", "bucket", "count", "total", "maks")
+
+    def __init__(self, batas: tuple = _BUCKET_DETIK):
+        self.batas = batas
+        self.bucket = [0] * (len(batas) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maks = 0.0
+
+    def observe(self, nilai: float):
+        self.bucket[bisect.bisect_left(self.batas, nilai)] += 1
+        self.count += 1
+        self.total += nilai
+        if nilai > self.maks:
+            self.maks = nilai
+
+    def kuantil(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        kumulatif = 0
+        for i, jumlah in enumerate(self.bucket):
+            if jumlah and kumulatif + jumlah >= target:
+                bawah = self.batas[i - 1] if i > 0 else 0.0
+                atas = self.batas[i] if i < len(self.batas) else self.maks
+                return min(bawah + (atas - bawah) * (target - kumulatif) / jumlah, self.maks)
+            kumulatif += jumlah
+        return self.maks
+
+class _Span:
+    """Times a block into a histogram; `label` may still be changed inside the block."""
+
+    __slots__ = ("registry", "nama", "label", "mulai")
+
+    def __init__(self, registry: "MetricsRegistry", nama: str, label: dict):
+        self.registry = registry
+        self.nama = nama
+        self.label = label
+
+    def __enter__(self):
+        self.mulai = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.amati(self.nama, time.perf_counter() - self.mulai, **self.label)
+        if exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            self.registry.tambah(self.nama.replace("_seconds", "") + "_errors_total", **self.label)
+        return False
+
+class MetricsRegistry:
+    """
+    In-process histograms, counters and gauges keyed by name and labels. An observation is
+    a dict lookup, a bisect and a few additions under a lock, so spans can stay on in production.
+    """
+
+    def __init__(self, enabled: bool = True, awalan: str = "cognitiveshell"):
+        self.enabled = enabled
+        self.awalan = awalan
+        self._histogram = {}
+        self._counter = Counter()
+        self._gauge = {}
+        self._lock = threading.Lock()
+        self.mulai = time.time()
+
+    def amati(self, nama: str, nilai: float, batas: tuple = _BUCKET_DETIK, **label):
+        """Records one observation into the histogram `nama` with the given labels."""
+        if not self.enabled:
+            return
+        kunci = (nama, tuple(sorted(label.items())))
+        with self._lock:
+            histogram = self._histogram.get(kunci)
+            if histogram is None:
+                histogram = self._histogram[kunci] = Histogram(batas)
+            histogram.observe(nilai)
+
+    def tambah(self, nama: str, nilai: float = 1, **label):
+        if self.enabled:
+            with self._lock:
+                self._counter[(nama, tuple(sorted(label.items())))] += nilai
+
+    def gauge(self, nama: str, fungsi: Callable[[], float]):
+        """Registers a value read at export time (e.g. a queue depth)."""
+        self._gauge[nama] = fungsi
+
+    def span(self, nama: str, **label) -> _Span:
+        return _Span(self, nama, label)
+
+    def reset(self):
+        with self._lock:
+            self._histogram.clear()
+            self._counter.clear()
+            self.mulai = time.time()
+
+    def histogram(self) -> list:
+        """Returns (name, labels, Histogram) sorted by name and labels."""
+        with self._lock:
+            return [(nama, dict(label), h) for (nama, label), h in sorted(self._histogram.items())]
+
+    def counter(self) -> list:
+        with self._lock:
+            return [(nama, dict(label), nilai) for (nama, label), nilai in sorted(self._counter.items())]
+
+    def nilai_gauge(self) -> dict:
+        hasil = {}
+        for nama, fungsi in self._gauge.items():
+            try:
+                hasil[nama] = float(fungsi())
+            except Exception:
+                continue
+        return hasil
+
+    def ekspor_prometheus(self) -> str:
+        """Renders everything in the Prometheus text exposition format (version 0.0.4)."""
+        def teks_label(label: dict, **tambahan) -> str:
+            semua = dict(label, **tambahan)
+            if not semua:
+                return ""
+            return "{" + ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in semua.items()) + "}"
+
+        baris = []
+        sudah = set()
+        for nama, label, h in self.histogram():
+            penuh = f"{self.awalan}_{nama}"
+            if penuh not in sudah:
+                sudah.add(penuh)
+                baris.append(f"# TYPE {penuh} histogram")
+            kumulatif = 0
+            for batas, jumlah in zip(h.batas, h.bucket):
+                kumulatif += jumlah
+                baris.append(f"{penuh}_bucket{teks_label(label, le=batas)} {kumulatif}")
+            baris.append(f"{penuh}_bucket{teks_label(label, le='+Inf')} {h.count}")
+            baris.append(f"{penuh}_sum{teks_label(label)} {h.total}")
+            baris.append(f"{penuh}_count{teks_label(label)} {h.count}")
+        for nama, label, nilai in self.counter():
+            penuh = f"{self.awalan}_{nama}"
+            if penuh not in sudah:
+                sudah.add(penuh)
+                baris.append(f"# TYPE {penuh} counter")
+            baris.append(f"{penuh}{teks_label(label)} {nilai}")
+        for nama, nilai in sorted(self.nilai_gauge().items()):
+            baris.append(f"# TYPE {self.awalan}_{nama} gauge")
+            baris.append(f"{self.awalan}_{nama} {nilai}")
+        return "\n".join(baris) + "\n"
+
+METRICS = MetricsRegistry(METRICS_ENABLED)
+
+async def _layani_metrik(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Answers GET /metrics with the Prometheus text format; everything else gets 404."""
+    try:
+        baris_permintaan = (await asyncio.wait_for(reader.readline(), 5)).decode("latin-1").split()
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        if len(baris_permintaan) >= 2 and baris_permintaan[0] == "GET" and baris_permintaan[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", METRICS.ekspor_prometheus().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def mulai_server_metrik(host: str = METRICS_HTTP_HOST, port: int = METRICS_HTTP_PORT):
+    """Starts the local Prometheus endpoint. Returns the server, or None if disabled or the port is taken."""
+    if not port:
+        return None
+    try:
+        server = await asyncio.start_server(_layani_metrik, host, port)
+    except OSError as e:
+        logger.warning(f"[Metrics] ⚠ Cannot serve metrics on {host}:{port}: {e}")
+        return None
+    logger.info(f"[Metrics] Prometheus metrics at http://{host}:{port}/metrics")
+    return server
+
+def _format_durasi(detik: float) -> str:
+    return f"{detik * 1000:.1f}ms" if detik < 1 else f"{detik:.2f}s"
+
+def ringkasan_metrik() -> str:
+    """Renders the histograms as a compact table for /stats."""
+    baris = []
+    for nama, label, h in METRICS.histogram():
+        judul = nama.replace("_seconds", "") + "".join(f" {k}={v}" for k, v in label.items())
+        if nama.endswith("_seconds"):
+            nilai = [_format_durasi(h.kuantil(0.5)), _format_durasi(h.kuantil(0.95)), _format_durasi(h.maks)]
+        else:
+            nilai = [f"{h.kuantil(0.5):.0f}", f"{h.kuantil(0.95):.0f}", f"{h.maks:.0f}"]
+        baris.append(f"{judul[:38]:<38} {h.count:>6} {nilai[0]:>8} {nilai[1]:>8} {nilai[2]:>8}")
+    if baris:
+        baris.insert(0, f"{'stage':<38} {'n':>6} {'p50':>8} {'p95':>8} {'max':>8}")
+    for nama, label, nilai in METRICS.counter():
+        baris.append(f"{nama}{''.join(f' {k}={v}' for k, v in label.items())}: {nilai:g}")
+    for nama, nilai in METRICS.nilai_gauge().items():
+        baris.append(f"{nama}: {nilai:g}")
+    return "\n".join(baris)
+
+# === LLM HTTP Client (pooled, one per event loop) ===
+_llm_http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_llm_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+def get_llm_http_client() -> httpx.AsyncClient:
+    """
+    Returns the persistent HTTP client for the running event loop.
+    Connections are kept alive and reused across LLM requests.
+    """
+    loop = asyncio.get_running_loop()
+    client = _llm_http_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+        )
+        _llm_http_clients[loop] = client
+        _llm_semaphores[loop] = asyncio.Semaphore(LLM_MAX_CONCURRENT_REQUESTS)
+    return client
+
+def _get_llm_semaphore() -> asyncio.Semaphore:
+    """Returns the semaphore limiting concurrent LLM requests on the running event loop."""
+    get_llm_http_client()
+    return _llm_semaphores[asyncio.get_running_loop()]
+
+async def close_llm_http_client():
+    """Closes the HTTP client of the running event loop, if any."""
+    loop = asyncio.get_running_loop()
+    client = _llm_http_clients.pop(loop, None)
+    _llm_semaphores.pop(loop, None)
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+def _jalankan_sync(coro):
+    """
+    Runs an LLM coroutine to completion for synchronous callers (scripts, REPL).
+    Must not be called from inside a running event loop; use the *_async variants there.
+    """
+    async def _runner():
+        try:
+            return await coro
+        finally:
+            await close_llm_http_client()
+    return asyncio.run(_runner())
+
+# === LLM Response Cache ===
+class LLMResponseCache:
+    """
+    Two-level cache for deterministic LLM answers: an in-memory LRU (OrderedDict)
+    in front of a SQLite table. Entries expire after a per-task TTL and both levels
+    are size bounded. If the SQLite file cannot be opened the cache stays memory-only.
+    """
+
+    def __init__(self, path: str, memory_entries: int, disk_entries: int):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_failed = False
+        self._writes_since_prune = 0
+        self.stats = Counter()
+
+    def _connection(self):
+        if self._db is None and not self._db_failed and self.path:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._db = sqlite3.connect(self.path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache ("
+                    "key TEXT PRIMARY KEY, task TEXT, value TEXT NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)")
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"[Cache] ⚠ Cannot open LLM cache at {self.path}: {e}. Using memory only.")
+                self._db = None
+                self._db_failed = True
+        return self._db
+
+    def _simpan_memori(self, key: str, value: str, expires_at: float):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.stats["memory_evictions"] += 1
+
+    def get(self, key: str) -> str | None:
+        """Returns the cached value or None. Expired entries are dropped on access."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return entry[0]
+                del self._memory[key]
+
+            db = self._connection()
+            if db is not None:
+                try:
+                    row = db.execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                    if row is not None and row[1] > now:
+                        db.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                        db.commit()
+                        self._simpan_memori(key, row[0], row[1])
+                        self.stats["disk_hits"] += 1
+                        return row[0]
+                except sqlite3.Error as e:
+                    logger.warning(f"[Cache] ⚠ LLM cache read failed: {e}")
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key: str, value: str, ttl: float, task: str = None):
+        """Stores a value in both levels and prunes the SQLite table when it grows too large."""
+        now = time.time()
+        expires_at = now + ttl
+        with self._lock:
+            self._simpan_memori(key, value, expires_at)
+            self.stats["writes"] += 1
+            db = self._connection()
+            if db is None:
+                return
+            try:
+                db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, task, value, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, task, value, expires_at, now),
+                )
+                self._writes_since_prune += 1
+                # Prune in batches: at most every 100 writes, sooner for small stores
+                if self._writes_since_prune >= min(100, max(1, self.disk_entries // 10)):
+                    self._writes_since_prune = 0
+                    db.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+                    db.execute(
+                        "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                        (self.disk_entries,),
+                    )
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"[Cache] ⚠ LLM cache write failed: {e}")
+
+    def clear(self):
+        """Removes every entry from memory and disk."""
+        with self._lock:
+            self._memory.clear()
+            db = self._connection()
+            if db is not None:
+                try:
+                    db.execute("DELETE FROM llm_cache")
+                    db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"[Cache] ⚠ LLM cache clear failed: {e}")
+
+    def ringkasan(self) -> dict:
+        """Returns hit/miss counters and current sizes."""
+        with self._lock:
+            hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+            lookups = hits + self.stats["misses"]
+            ringkasan = dict(self.stats, memory_entries=len(self._memory), hit_ratio=round(hits / lookups, 3) if lookups else 0.0)
+            db = self._connection()
+            if db is not None:
+                try:
+                    ringkasan["disk_entries"] = db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+                except sqlite3.Error as e:
+                    logger.warning(f"[Cache] ⚠ LLM cache read failed: {e}")
+            return ringkasan
+
+LLM_CACHE = LLMResponseCache(LLM_CACHE_PATH, LLM_CACHE_MEMORY_ENTRIES, LLM_CACHE_DISK_ENTRIES)
+
+def kunci_cache_llm(messages: list, model: str, max_tokens: int, temperature: float) -> str:
+    """
+    Builds the cache key from the model, the normalized messages and the sampling parameters.
+    Normalization only removes whitespace noise (CRLF, trailing spaces), never indentation.
+    """
+    normalized = [
+        {"role": m.get("role"), "content": "\n".join(line.rstrip() for line in str(m.get("content", "")).replace("\r\n", "\n").strip().split("\n"))}
+        for m in messages
+    ]
+    raw = json.dumps({"url": LLM_BASE_URL, "model": model, "messages": normalized, "max_tokens": max_tokens, "temperature": temperature}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+# === Error Fingerprinting ===
+# Volatile parts of an error log, replaced by placeholders before hashing (order matters)
+_POLA_NORMALISASI_ERROR = [
+    (re.compile(r'\033\[[0-9;]*[A-Za-z]'), ''),
+    (re.compile(r'\b\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:?\d{2})?'), '<time>'),
+    (re.compile(r'\b\d{1,2}:\d{2}:\d{2}(\.\d+)?\b'), '<time>'),
+    (re.compile(r'0x[0-9a-fA-F]+'), '<hex>'),
+    (re.compile(r'\b(pid|PID|process)[ =:]*\d+'), r'\1 <pid>'),
+    (re.compile(r'\[\d+\]'), '[<pid>]'),
+    (re.compile(r'(?:~|\.{1,2})?(?:/[\w.@+-]+)+/?'), '<path>'),
+    (re.compile(r'\b[lL]ine \d+'), 'line <n>'),
+    (re.compile(r':\d+(:\d+)?\b'), ':<n>'),
+    (re.compile(r'\b\d{3,}\b'), '<num>'),
+    (re.compile(r'[ \t]+'), ' '),
+]
+
+# Lines that carry the identity of an error; everything else is context
+_POLA_BARIS_ERROR = re.compile(
+    r'(error|exception|not found|failed|permission denied|no such file|segmentation fault|fatal|denied|cannot|unable to|traceback|npm err!)',
+    re.IGNORECASE,
+)
+
+def sidik_jari_error(log_error: str) -> tuple[str, str]:
+    """
+    Reduces an error log to a stable signature (paths, line numbers, timestamps, PIDs and
+    hex addresses removed; only error-bearing lines kept) and hashes it.
+    Returns a tuple: (fingerprint, signature).
+    """
+    baris_normal = []
+    for baris in log_error.splitlines():
+        for pola, pengganti in _POLA_NORMALISASI_ERROR:
+            baris = pola.sub(pengganti, baris)
+        baris = baris.strip()
+        if baris:
+            baris_normal.append(baris)
+
+    baris_error = [baris for baris in baris_normal if _POLA_BARIS_ERROR.search(baris)] or baris_normal[-5:]
+    # Keep order but drop repeats (e.g. the same warning printed in a loop)
+    signature = "\n".join(dict.fromkeys(baris_error[-10:]))
+    return hashlib.sha256(signature.encode("utf-8")).hexdigest()[:16], signature
+
+class ErrorSuggestionCache:
+    """
+    Remembers AI answers per error fingerprint and kind ("suggestion" or "fix:<lang>:<code hash>").
+    Entries live in memory and are written through to the SQLite file of the LLM cache,
+    with hit counts for statistics and manual invalidation by fingerprint.
+    """
+
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: dict = {}
+        self._lock = threading.Lock()
+        self._db = None
+        self._loaded = False
+        self.stats = Counter()
+
+    def _muat(self):
+        """Opens the SQLite table and loads unexpired entries on first use."""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS error_suggestions ("
+                "fingerprint TEXT NOT NULL, kind TEXT NOT NULL, signature TEXT, suggestion TEXT NOT NULL, "
+                "hits INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, last_hit REAL, PRIMARY KEY (fingerprint, kind))"
+            )
+            self._db.execute("DELETE FROM error_suggestions WHERE created_at <= ?", (time.time() - self.ttl,))
+            self._db.commit()
+            for fingerprint, kind, signature, suggestion, hits, created_at, last_hit in self._db.execute(
+                "SELECT fingerprint, kind, signature, suggestion, hits, created_at, last_hit FROM error_suggestions "
+                "ORDER BY COALESCE(last_hit, created_at) DESC LIMIT ?", (self.max_entries,)
+            ):
+                self._entries[(fingerprint, kind)] = {"signature": signature, "suggestion": suggestion, "hits": hits, "created_at": created_at, "last_hit": last_hit}
+        except sqlite3.Error as e:
+            logger.warning(f"[ErrorCache] ⚠ Cannot open error cache at {self.path}: {e}. Using memory only.")
+            self._db = None
+
+    def get(self, fingerprint: str, kind: str) -> str | None:
+        with self._lock:
+            self._muat()
+            entry = self._entries.get((fingerprint, kind))
+            if entry is None or entry["created_at"] <= time.time() - self.ttl:
+                self.stats["misses"] += 1
+                return None
+            entry["hits"] += 1
+            entry["last_hit"] = time.time()
+            self.stats["hits"] += 1
+            if self._db is not None:
+                try:
+                    self._db.execute("UPDATE error_suggestions SET hits = ?, last_hit = ? WHERE fingerprint = ? AND kind = ?", (entry["hits"], entry["last_hit"], fingerprint, kind))
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"[ErrorCache] ⚠ Failed to update hit count: {e}")
+            return entry["suggestion"]
+
+    def set(self, fingerprint: str, kind: str, signature: str, suggestion: str):
+        with self._lock:
+            self._muat()
+            now = time.time()
+            self._entries[(fingerprint, kind)] = {"signature": signature, "suggestion": suggestion, "hits": 0, "created_at": now, "last_hit": None}
+            buang = []
+            if len(self._entries) > self.max_entries:
+                # Evict the least recently useful entry
+                buang.append(min(self._entries, key=lambda k: self._entries[k]["last_hit"] or self._entries[k]["created_at"]))
+                del self._entries[buang[0]]
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO error_suggestions (fingerprint, kind, signature, suggestion, hits, created_at, last_hit) VALUES (?, ?, ?, ?, 0, ?, NULL)",
+                        (fingerprint, kind, signature, suggestion, now),
+                    )
+                    self._db.executemany("DELETE FROM error_suggestions WHERE fingerprint = ? AND kind = ?", buang)
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"[ErrorCache] ⚠ Failed to store suggestion: {e}")
+
+    def invalidate(self, fingerprint: str = None) -> int:
+        """Forgets all answers for one fingerprint (or every fingerprint if None). Returns the number removed."""
+        with self._lock:
+            self._muat()
+            keys = [k for k in self._entries if fingerprint is None or k[0] == fingerprint]
+            for k in keys:
+                del self._entries[k]
+            if self._db is not None:
+                try:
+                    if fingerprint is None:
+                        self._db.execute("DELETE FROM error_suggestions")
+                    else:
+                        self._db.execute("DELETE FROM error_suggestions WHERE fingerprint = ?", (fingerprint,))
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"[ErrorCache] ⚠ Delete failed: {e}")
+            self.stats["invalidated"] += len(keys)
+            return len(keys)
+
+    def teratas(self, limit: int = 10) -> list:
+        """Returns the most frequently reused entries as (fingerprint, kind, hits, signature) tuples."""
+        with self._lock:
+            self._muat()
+            urut = sorted(self._entries.items(), key=lambda item: item[1]["hits"], reverse=True)[:limit]
+            return [(k[0], k[1], v["hits"], v["signature"]) for k, v in urut]
+
+ERROR_SUGGESTION_CACHE = ErrorSuggestionCache(LLM_CACHE_PATH, ERROR_CACHE_MAX_ENTRIES, ERROR_CACHE_TTL)
+
 # === General Function: Call LLM ===
-def call_llm(messages: list, model: str, api_key: str, max_tokens: int = 512, temperature: float = 0.7, extra_headers: dict = None) -> tuple[bool, str]:
+async def _baca_stream_llm(res: httpx.Response, on_delta: Callable[[str], Awaitable[None]]) -> tuple[bool, str]:
+    """
+    Reads an OpenAI-compatible SSE stream ("data: {...}" lines ending with "data: [DONE]").
+    Calls on_delta for every content fragment and returns the accumulated text.
+    """
+    parts = []
+    async for line in res.aiter_lines():
+        if not line.startswith("data:"):
+            # Blank separators and ": keep-alive" comments
+            continue
+        data_str = line[len("data:"):].strip()
+        if data_str == "[DONE]":
+            break
+        chunk = json.loads(data_str)
+        if "error" in chunk:
+            logger.error(f"[LLM] Error inside LLM stream: {chunk['error']}")
+            return False, f"LLM stream error: {chunk['error']}"
+        choices = chunk.get("choices") or []
+        delta = (choices[0].get("delta") or {}).get("content") if choices else None
+        if delta:
+            parts.append(delta)
+            try:
+                await on_delta(delta)
+            except Exception as e:
+                logger.warning(f"[LLM] Stream callback failed: {e}")
+    if not parts:
+        logger.error(f"[LLM] LLM stream ended without any content.")
+        return False, "LLM stream ended without any content."
+    return True, "".join(parts)
+
+def _detik_retry_after_http(nilai: str | None) -> float | None:
+    """Parses a Retry-After header given either as seconds or as an HTTP date."""
+    if not nilai:
+        return None
+    try:
+        return max(0.0, float(nilai))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(nilai).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+async def _kirim_permintaan_llm_async(payload: dict, headers: dict, on_delta: Callable[[str], Awaitable[None]] = None, waktu: dict = None, url: str = None) -> tuple[bool, str]:
+    """
+    Performs a single HTTP request to `url` (LLM_BASE_URL by default) with the pooled client.
+    If `waktu` is given, it receives perf_counter stamps "queued" (client ready), "slot"
+    (concurrency slot acquired) and "first" (first streamed fragment, or the full response),
+    and "tokens_out" from usage. On failure it also receives "retryable", "upstream_down"
+    (5xx, timeout or connection error), and "status" and "retry_after" when the server answered.
+    Returns a tuple: (True, result) on success, (False, error_message) on failure.
+    """
+    data = None
+    waktu = {} if waktu is None else waktu
+    url = url or LLM_BASE_URL
+    try:
+        client = get_llm_http_client()
+        waktu["queued"] = time.perf_counter()
+        async with _get_llm_semaphore():
+            waktu["slot"] = time.perf_counter()
+            if on_delta is not None:
+                async def on_delta_terukur(delta: str):
+                    waktu.setdefault("first", time.perf_counter())
+                    await on_delta(delta)
+                async with client.stream("POST", url, json=payload, headers=headers) as res:
+                    res.raise_for_status()
+                    return await _baca_stream_llm(res, on_delta_terukur)
+            res = await client.post(url, json=payload, headers=headers)
+            waktu["first"] = time.perf_counter()
+        res.raise_for_status()
+        data = res.json()
+        waktu["tokens_out"] = (data.get("usage") or {}).get("completion_tokens")
+        if "choices" in data and data["choices"]:
+            return True, data["choices"][0]["message"]["content"]
+        else:
+            logger.error(f"[LLM] LLM response does not contain 'choices'. Debug response: {data}")
+            return False, f"LLM response not in expected format. Debug response: {data}"
+    except httpx.TimeoutException:
+        waktu.update(retryable=True, upstream_down=True)
+        logger.error(f"[LLM] LLM API request timed out ({url}).")
+        return False, f"LLM API request timed out. Please try again."
+    except httpx.HTTPError as e:
+        if isinstance(e, httpx.HTTPStatusError):
+            status = e.response.status_code
+            waktu.update(status=status, retryable=status in LLM_RETRY_STATUS, upstream_down=status >= 500,
+                         retry_after=_detik_retry_after_http(e.response.headers.get("Retry-After")))
+        else:
+            waktu.update(retryable=True, upstream_down=True)
+        logger.error(f"[LLM] Failed to connect to LLM API ({url}): {e}")
+        return False, f"Failed to connect to LLM API: {e}"
+    except (KeyError, TypeError, json.JSONDecodeError) as e:
+        logger.error(f"[LLM] LLM response not in expected format (no 'choices' or 'message'): {e}. Debug response: {data}")
+        return False, f"LLM response not in expected format: {e}. Debug response: {data}"
+    except Exception as e:
+        logger.error(f"[LLM] An unexpected error occurred while calling LLM: {e}")
+        return False, f"An unexpected error occurred while calling LLM: {e}"
+
+# === Latency-aware model router ===
+def daftar_kandidat(model: str) -> list:
+    """Parses "a,b@https://host/v1/chat/completions" into [(model, url), ...] in configured order."""
+    kandidat = []
+    for item in str(model).split(","):
+        nama, _, url = item.strip().partition("@")
+        if nama:
+            kandidat.append((nama, url or LLM_BASE_URL))
+    return kandidat
+
+class CircuitBreaker:
+    """
+    Per-endpoint breaker. Consecutive upstream failures (5xx, timeouts, connection errors) open it;
+    while open, requests are rejected without touching the network. After the cooldown a single
+    probe request is let through: success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, nama: str, threshold: int = LLM_BREAKER_THRESHOLD, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.nama = nama
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.gagal_beruntun = 0
+        self.dibuka = None
+        self.menguji = False
+
+    @property
+    def status(self) -> str:
+        if self.dibuka is None:
+            return "closed"
+        return "half_open" if self.menguji or self.sisa_jeda() == 0 else "open"
+
+    def sisa_jeda(self) -> float:
+        return 0.0 if self.dibuka is None else max(0.0, self.cooldown - (time.monotonic() - self.dibuka))
+
+    def izinkan(self) -> bool:
+        if self.dibuka is None:
+            return True
+        if self.menguji or self.sisa_jeda() > 0:
+            return False
+        self.menguji = True
+        return True
+
+    def lepas(self):
+        """Releases the probe slot of an attempt that was cancelled before it finished."""
+        self.menguji = False
+
+    def catat(self, success: bool, upstream_down: bool):
+        menguji, self.menguji = self.menguji, False
+        # Any answer other than a server error means the endpoint itself is up
+        if success or not upstream_down:
+            if self.dibuka is not None:
+                logger.info(f"[LLM] Endpoint {self.nama} recovered; circuit closed.")
+            self.gagal_beruntun = 0
+            self.dibuka = None
+            return
+        self.gagal_beruntun += 1
+        if menguji or self.gagal_beruntun >= self.threshold:
+            if self.dibuka is None or menguji:
+                logger.warning(f"[LLM] ⚠ Endpoint {self.nama} failed {self.gagal_beruntun} times in a row; failing fast for {self.cooldown:.0f}s.")
+            self.dibuka = time.monotonic()
+
+class ModelRouter:
+    """
+    Orders the candidate models of a call by EWMA latency (time to first byte for streams,
+    full response otherwise) weighted by EWMA error rate, keeping the configured order among
+    equals. Failed attempts fail over to the next candidate, unless text was already streamed.
+    With hedging, a non-streamed call starts a second attempt after the first one's p95 latency
+    and keeps whichever valid answer arrives first. When every candidate failed with a retryable
+    error, the round is repeated after a jittered back-off, within the call's deadline.
+    Each endpoint has a CircuitBreaker.
     """
-    Generic function to send requests to an LLM model (OpenRouter).
+
+    def __init__(self, alpha: float = LLM_ROUTER_EWMA_ALPHA, max_error_rate: float = LLM_ROUTER_MAX_ERROR_RATE, cooldown: float = LLM_ROUTER_COOLDOWN):
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self._status = {}
+        self._breaker = {}
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        breaker = self._breaker.get(url)
+        if breaker is None:
+            breaker = self._breaker[url] = CircuitBreaker(httpx.URL(url).host or url)
+        return breaker
+
+    def _status_kandidat(self, kandidat: tuple) -> dict:
+        status = self._status.get(kandidat)
+        if status is None:
+            status = self._status[kandidat] = {"latency": None, "error_rate": 0.0, "last_failure": 0.0, "calls": 0, "failures": 0, "histogram": Histogram()}
+        return status
+
+    def sehat(self, kandidat: tuple) -> bool:
+        status = self._status_kandidat(kandidat)
+        return status["error_rate"] < self.max_error_rate or time.monotonic() - status["last_failure"] >= self.cooldown
+
+    def urutkan(self, kandidat: list) -> list:
+        """Healthy candidates fastest first, then unhealthy ones as a last resort."""
+        diketahui = [self._status_kandidat(k)["latency"] for k in kandidat if self._status_kandidat(k)["latency"] is not None]
+        # Unmeasured candidates tie with the fastest one, so the configured order decides
+        terbaik = min(diketahui) if diketahui else 0.0
+
+        def skor(k):
+            status = self._status_kandidat(k)
+            latency = status["latency"] if status["latency"] is not None else terbaik
+            return latency * (1 + 2 * status["error_rate"])
+
+        sehat = sorted((k for k in kandidat if self.sehat(k) and self.breaker(k[1]).status != "open"), key=skor)
+        return sehat + [k for k in kandidat if k not in sehat]
+
+    def catat(self, kandidat: tuple, latency: float | None, success: bool):
+        status = self._status_kandidat(kandidat)
+        status["calls"] += 1
+        status["error_rate"] += self.alpha * ((0.0 if success else 1.0) - status["error_rate"])
+        if success and latency is not None:
+            status["latency"] = latency if status["latency"] is None else status["latency"] + self.alpha * (latency - status["latency"])
+            status["histogram"].observe(latency)
+        if not success:
+            status["failures"] += 1
+            status["last_failure"] = time.monotonic()
+
+    def tunda_hedge(self, kandidat: tuple) -> float:
+        histogram = self._status_kandidat(kandidat)["histogram"]
+        if histogram.count < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_DELAY
+        return histogram.kuantil(0.95)
+
+    async def _coba(self, kandidat: tuple, payload: dict, headers: dict, on_delta, timeout: float | None, batas_waktu: float = None) -> tuple:
+        """
+        One attempt against one candidate. Returns (success, result, waktu).
+        An attempt cancelled at or after the call's monotonic `batas_waktu` counts as an upstream failure.
+        """
+        model, url = kandidat
+        waktu = {"model": model}
+        breaker = self.breaker(url)
+        if not breaker.izinkan():
+            METRICS.tambah("llm_circuit_rejected_total", endpoint=breaker.nama)
+            return False, f"LLM endpoint {breaker.nama} is unavailable; try again in {breaker.sisa_jeda():.0f}s.", waktu
+        mulai = time.perf_counter()
+        tugas = asyncio.ensure_future(_kirim_permintaan_llm_async(dict(payload, model=model), headers, on_delta, waktu, url))
+        try:
+            if timeout:
+                await asyncio.wait({tugas}, timeout=timeout)
+                if not tugas.done() and "first" not in waktu:
+                    tugas.cancel()
+                    await asyncio.gather(tugas, return_exceptions=True)
+                    self.catat(kandidat, None, False)
+                    breaker.catat(False, upstream_down=True)
+                    waktu.update(retryable=True, upstream_down=True)
+                    logger.warning(f"[LLM] ⚠ {model} sent nothing within {timeout:.0f}s.")
+                    return False, f"No response from {model} within {timeout:.0f}s.", waktu
+            success, result = await tugas
+        except asyncio.CancelledError:
+            tugas.cancel()
+            if batas_waktu is not None and time.monotonic() >= batas_waktu:
+                # Cut off by the deadline: a hung endpoint must still open its circuit
+                self.catat(kandidat, None, False)
+                breaker.catat(False, upstream_down=True)
+            else:
+                breaker.lepas()
+            raise
+        breaker.catat(success, waktu.get("upstream_down", False))
+        self.catat(kandidat, waktu["first"] - mulai if "first" in waktu else None, success)
+        waktu["streamed"] = on_delta is not None and "first" in waktu
+        return success, result, waktu
+
+    async def _dengan_hedge(self, utama: tuple, cadangan: tuple, payload: dict, headers: dict, task: str, batas_waktu: float = None) -> tuple:
+        tugas_utama = asyncio.ensure_future(self._coba(utama, payload, headers, None, None, batas_waktu))
+        tertunda = {tugas_utama}
+        try:
+            await asyncio.wait(tertunda, timeout=self.tunda_hedge(utama))
+            if tugas_utama.done():
+                return tugas_utama.result()
+            METRICS.tambah("llm_hedged_total", task=task or "default")
+            logger.info(f"[LLM] {utama[0]} is slower than its p95; hedging with {cadangan[0]}.")
+            tugas_cadangan = asyncio.ensure_future(self._coba(cadangan, payload, headers, None, None, batas_waktu))
+            tertunda.add(tugas_cadangan)
+            hasil = None
+            while tertunda:
+                selesai, tertunda = await asyncio.wait(tertunda, return_when=asyncio.FIRST_COMPLETED)
+                for tugas in selesai:
+                    hasil = tugas.result()
+                    if hasil[0]:
+                        if tugas is tugas_cadangan:
+                            METRICS.tambah("llm_hedge_wins_total", task=task or "default")
+                        return hasil
+            return hasil
+        finally:
+            for tugas in tertunda:
+                tugas.cancel()
+
+    async def jalankan(self, model: str, payload: dict, headers: dict, on_delta=None, task: str = None, batas_waktu: float = None) -> tuple:
+        """
+        Runs a call over the candidates of `model`, retrying retryable failures until
+        LLM_RETRY_MAX_ATTEMPTS rounds or the monotonic `batas_waktu` is reached.
+        Returns (success, result, waktu of the last attempt).
+        """
+        kandidat = daftar_kandidat(model)
+        for percobaan in range(1, LLM_RETRY_MAX_ATTEMPTS + 1):
+            hasil, retry_after = await self._satu_putaran(self.urutkan(kandidat), payload, headers, on_delta, task, batas_waktu)
+            success, _, waktu = hasil
+            if success or waktu.get("streamed") or retry_after is None or percobaan == LLM_RETRY_MAX_ATTEMPTS:
+                return hasil
+            # Full jitter spreads retries of many chats; the server's Retry-After is a lower bound
+            jeda = max(retry_after, random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** (percobaan - 1))))
+            if batas_waktu is not None and time.monotonic() + jeda >= batas_waktu:
+                logger.warning(f"[LLM] ⚠ Not retrying {task or 'LLM call'}: a {jeda:.1f}s back-off would pass its deadline.")
+                return hasil
+            METRICS.tambah("llm_retries_total", task=task or "default")
+            logger.warning(f"[LLM] ⚠ Retrying {task or 'LLM call'} in {jeda:.1f}s (attempt {percobaan + 1}/{LLM_RETRY_MAX_ATTEMPTS}).")
+            await asyncio.sleep(jeda)
+        return hasil
+
+    async def _satu_putaran(self, kandidat: list, payload: dict, headers: dict, on_delta, task: str, batas_waktu: float = None) -> tuple:
+        """
+        One pass over the ordered candidates with failover. Returns (hasil, retry_after), where
+        retry_after is None unless a failed attempt may be retried (0.0 without a Retry-After).
+        """
+        hasil = (False, "No LLM model configured.", {})
+        retry_after = None
+        dicoba = set()
+        for i, k in enumerate(kandidat):
+            if k in dicoba:
+                continue
+            sisa = [c for c in kandidat[i + 1:] if c not in dicoba]
+            if LLM_HEDGE_ENABLED and on_delta is None:
+                cadangan = sisa[0] if sisa else k
+                dicoba.update((k, cadangan))
+                hasil = await self._dengan_hedge(k, cadangan, payload, headers, task, batas_waktu)
+            else:
+                dicoba.add(k)
+                hasil = await self._coba(k, payload, headers, on_delta, LLM_ATTEMPT_TIMEOUT if sisa else None, batas_waktu)
+            success, _, waktu = hasil
+            if success or waktu.get("streamed"):
+                return hasil, None
+            if waktu.get("retryable"):
+                retry_after = max(retry_after or 0.0, waktu.get("retry_after") or 0.0)
+            sisa = [c for c in kandidat[i + 1:] if c not in dicoba]
+            if sisa:
+                METRICS.tambah("llm_failover_total", task=task or "default")
+                logger.warning(f"[LLM] ⚠ {k[0]} failed; failing over to {sisa[0][0]}.")
+        return hasil, retry_after
+
+    def ringkasan(self) -> list:
+        """Per-candidate state for /stats: (model, EWMA latency, error rate, calls, failures, status)."""
+        def status(k):
+            if self.breaker(k[1]).status != "closed":
+                return f"circuit {self.breaker(k[1]).status.replace('_', '-')}"
+            return "ok" if self.sehat(k) else "cooling down"
+        return [(k[0], s["latency"], s["error_rate"], s["calls"], s["failures"], status(k)) for k, s in self._status.items()]
+
+LLM_ROUTER = ModelRouter()
+
+# === Single-flight coalescing of identical LLM calls ===
+class _Penerbangan:
+    """One shared upstream call: its task, the streaming waiters and the fragments so far."""
+
+    __slots__ = ("tugas", "penunggu", "potongan", "pendengar")
+
+    def __init__(self):
+        self.tugas = None
+        self.penunggu = 0
+        self.potongan = []
+        self.pendengar = {}
+
+    async def kirim_ke(self, waiter):
+        # Each waiter receives every fragment exactly once and in order, including those streamed before it joined
+        pendengar = self.pendengar.get(waiter)
+        if pendengar is None:
+            return
+        async with pendengar["lock"]:
+            teks = "".join(self.potongan[pendengar["posisi"]:])
+            pendengar["posisi"] = len(self.potongan)
+            if teks:
+                try:
+                    await pendengar["on_delta"](teks)
+                except Exception as e:
+                    logger.warning(f"[LLM] Stream callback failed: {e}")
+
+    async def siarkan(self, delta: str):
+        self.potongan.append(delta)
+        for waiter in list(self.pendengar):
+            await self.kirim_ke(waiter)
+
+class SingleFlight:
+    """
+    Lets concurrent calls with the same key share one task. Every caller awaits the shared
+    task through asyncio.shield, so a caller that is cancelled only leaves; the task itself
+    is cancelled once its last waiter is gone. Streamed fragments are fanned out to every
+    waiter, late joiners first receive what was streamed before they arrived.
+    """
+
+    def __init__(self):
+        self._penerbangan = {}
+
+    def __len__(self) -> int:
+        return len(self._penerbangan)
+
+    async def jalankan(self, kunci: str, buat: Callable, on_delta: Callable[[str], Awaitable[None]] = None, task: str = None):
+        """`buat(on_delta)` starts the shared call; it receives the fan-out callback when streaming."""
+        label = task or "default"
+        flight = self._penerbangan.get(kunci)
+        if flight is None:
+            flight = self._penerbangan[kunci] = _Penerbangan()
+            flight.tugas = asyncio.ensure_future(buat(flight.siarkan if on_delta is not None else None))
+            flight.tugas.add_done_callback(lambda _: self._lupakan(kunci, flight))
+        else:
+            METRICS.tambah("llm_coalesced_total", task=label)
+            logger.info(f"[LLM] Identical {label} request already in flight; sharing its answer.")
+        flight.penunggu += 1
+        # Keyed per waiter, not per callback: two waiters may pass the same (bound) method
+        waiter = object()
+        if on_delta is not None:
+            flight.pendengar[waiter] = {"on_delta": on_delta, "posisi": 0, "lock": asyncio.Lock()}
+        try:
+            await flight.kirim_ke(waiter)
+            hasil = await asyncio.shield(flight.tugas)
+            await flight.kirim_ke(waiter)
+            return hasil
+        except asyncio.CancelledError:
+            if flight.penunggu == 1 and not flight.tugas.done():
+                METRICS.tambah("llm_singleflight_cancelled_total", task=label)
+                self._lupakan(kunci, flight)
+                flight.tugas.cancel()
+            raise
+        finally:
+            flight.penunggu -= 1
+            flight.pendengar.pop(waiter, None)
+
+    def _lupakan(self, kunci: str, flight: _Penerbangan):
+        if self._penerbangan.get(kunci) is flight:
+            del self._penerbangan[kunci]
+
+LLM_SINGLE_FLIGHT_GROUP = SingleFlight()
+
+async def call_llm_async(messages: list, model: str, api_key: str, max_tokens: int = 512, temperature: float = 0.7, extra_headers: dict = None, on_delta: Callable[[str], Awaitable[None]] = None, task: str = None, use_cache: bool = True) -> tuple[bool, str]:
+    """
+    Sends a request to an LLM model (OpenRouter) without blocking the event loop.
+    Uses the pooled HTTP client and respects LLM_MAX_CONCURRENT_REQUESTS. `model` may list
+    several candidates; LLM_ROUTER picks, fails over, hedges and retries between them,
+    all within the task's LLM_TASK_DEADLINES entry.
+    If on_delta is given, the answer is requested with `stream: true` and on_delta
+    is awaited with every text fragment as it arrives.
+    Non-streamed calls with temperature <= LLM_CACHE_MAX_TEMPERATURE are answered from
+    LLM_CACHE when possible; `task` selects the TTL from LLM_CACHE_TTLS. Identical calls
+    already in flight are joined instead of sent again (LLM_SINGLE_FLIGHT).
     Returns a tuple: (True, result) on success, (False, error_message) on failure.
     """
     if not api_key or not LLM_BASE_URL:
         logger.error("[LLM ERROR] API Key or LLM Base URL not set.")
         return False, "API Key or LLM Base URL not set. Please check configuration."
 
+    cache_key = None
+    if LLM_CACHE_ENABLED and use_cache and on_delta is None and temperature <= LLM_CACHE_MAX_TEMPERATURE:
+        cache_key = kunci_cache_llm(messages, model, max_tokens, temperature)
+        cached = LLM_CACHE.get(cache_key)
+        if cached is not None:
+            logger.info(f"{COLOR_GREEN}[Cache] ✔ LLM answer for task '{task or 'default'}' served from cache.{COLOR_RESET}")
+            return True, cached
+
     payload = {
         "model": model,
         "messages": messages,
         "max_tokens": max_tokens,
         "temperature": temperature
     }
+    if on_delta is not None:
+        payload["stream"] = True
 
     headers = {
         "Authorization": f"Bearer {api_key}",
@@ -134,27 +1573,77 @@ def call_llm(messages: list, model: str, api_key: str, max_tokens: int = 512, te
     if extra_headers:
         headers.update(extra_headers)
 
+    async def panggil(on_delta_bersama):
+        return await _panggil_llm_async(messages, payload, headers, model, on_delta_bersama, task, cache_key)
+
+    if not LLM_SINGLE_FLIGHT:
+        return await panggil(on_delta)
+    # Same answer-relevant inputs as the cache key, plus everything else that changes the request
+    kunci = hashlib.sha256(json.dumps(
+        [kunci_cache_llm(messages, model, max_tokens, temperature), on_delta is not None, headers], sort_keys=True
+    ).encode("utf-8")).hexdigest()
+    return await LLM_SINGLE_FLIGHT_GROUP.jalankan(kunci, panggil, on_delta, task)
+
+async def _panggil_llm_async(messages: list, payload: dict, headers: dict, model: str, on_delta, task: str, cache_key: str | None) -> tuple[bool, str]:
+    """
+    The upstream part of call_llm_async: routing within the task deadline, metrics and caching.
+    The deadline bounds the wait for an answer to start; an answer that is already streaming
+    is not cut off (LLM_READ_TIMEOUT still ends a stalled stream).
+    """
+    mulai = time.perf_counter()
+    deadline = LLM_TASK_DEADLINES.get(task or "default", LLM_TASK_DEADLINES["default"])
+    mengalir = False
+    if on_delta is not None:
+        on_delta_asli = on_delta
+
+        async def on_delta(teks: str):
+            nonlocal mengalir
+            mengalir = True
+            await on_delta_asli(teks)
+
+    tugas = asyncio.ensure_future(LLM_ROUTER.jalankan(model, payload, headers, on_delta, task, time.monotonic() + deadline))
     try:
-        res = requests.post(LLM_BASE_URL, json=payload, headers=headers, timeout=300)
-        res.raise_for_status()
-        data = res.json()
-        if "choices" in data and data["choices"]:
-            return True, data["choices"][0]["message"]["content"]
-        else:
-            logger.error(f"[LLM] LLM response does not contain 'choices'. Debug response: {data}")
-            return False, f"LLM response not in expected format. Debug response: {data}"
-    except requests.exceptions.Timeout:
-        logger.error(f"[LLM] LLM API request timed out ({LLM_BASE_URL}).")
-        return False, f"LLM API request timed out. Please try again."
-    except requests.exceptions.RequestException as e:
-        logger.error(f"[LLM] Failed to connect to LLM API ({LLM_BASE_URL}): {e}")
-        return False, f"Failed to connect to LLM API: {e}"
-    except KeyError as e:
-        logger.error(f"[LLM] LLM response not in expected format (no 'choices' or 'message'): {e}. Debug response: {data}")
-        return False, f"LLM response not in expected format: {e}. Debug response: {data}"
-    except Exception as e:
-        logger.error(f"[LLM] An unexpected error occurred while calling LLM: {e}")
-        return False, f"An unexpected error occurred while calling LLM: {e}"
+        await asyncio.wait({tugas}, timeout=deadline)
+        if not tugas.done() and not mengalir:
+            tugas.cancel()
+            await asyncio.gather(tugas, return_exceptions=True)
+            raise asyncio.TimeoutError
+        success, result, waktu = await tugas
+    except asyncio.CancelledError:
+        tugas.cancel()
+        raise
+    except asyncio.TimeoutError:
+        METRICS.tambah("llm_deadline_exceeded_total", task=task or "default")
+        logger.error(f"[LLM] {task or 'LLM call'} exceeded its {deadline:.0f}s deadline.")
+        success, result, waktu = False, f"LLM did not answer within {deadline:.0f}s. Please try again.", {}
+    catat_metrik_llm(task, messages, mulai, waktu, success, result)
+    if success and cache_key:
+        LLM_CACHE.set(cache_key, result, LLM_CACHE_TTLS.get(task, LLM_CACHE_TTLS["default"]), task)
+    return success, result
+
+def catat_metrik_llm(task: str, messages: list, mulai: float, waktu: dict, success: bool, result: str):
+    """Records queue wait, time to first byte, total time and token counts of one LLM call."""
+    if not METRICS.enabled:
+        return
+    selesai = time.perf_counter()
+    label = {"task": task or "default"}
+    METRICS.amati("llm_total_seconds", selesai - mulai, **label)
+    if "slot" in waktu:
+        METRICS.amati("llm_queue_wait_seconds", waktu["slot"] - waktu["queued"], **label)
+        if "first" in waktu:
+            METRICS.amati("llm_ttfb_seconds", waktu["first"] - waktu["slot"], **label)
+    if not success:
+        METRICS.tambah("llm_errors_total", **label)
+        return
+    METRICS.amati("llm_tokens_in", sum(hitung_token(str(m.get("content", ""))) + _TOKEN_PER_PESAN for m in messages), batas=_BUCKET_TOKEN, **label)
+    METRICS.amati("llm_tokens_out", waktu.get("tokens_out") or hitung_token(result), batas=_BUCKET_TOKEN, **label)
+
+def call_llm(messages: list, model: str, api_key: str, max_tokens: int = 512, temperature: float = 0.7, extra_headers: dict = None) -> tuple[bool, str]:
+    """
+    Synchronous wrapper around call_llm_async for non-async callers.
+    Returns a tuple: (True, result) on success, (False, error_message) on failure.
+    """
+    return _jalankan_sync(call_llm_async(messages, model, api_key, max_tokens, temperature, extra_headers))
 
 # === Function: Extract Code from LLM Response ===
 def ekstrak_kode_dari_llm(text_response: str, target_language: str = None) -> tuple[str, str]:
@@ -246,10 +1735,136 @@ def deteksi_bahasa_pemrograman_dari_konten(code_content: str) -> str:
     return "txt"
 
 
+# === Local Intent Classifier (tier 1, no network) ===
+# Shell builtins are not on $PATH but are still literal commands
+_SHELL_BUILTINS = {"cd", "export", "echo", "source", "alias", "unset", "pwd", "type", "ulimit", "umask", "jobs", "history"}
+
+# Binaries whose names are also everyday words ("find me a song", "make a function")
+_KATA_AMBIGU = {
+    "find", "make", "time", "test", "top", "who", "write", "sort", "help", "yes", "kill", "more", "less",
+    "watch", "host", "look", "date", "which", "man", "join", "split", "cut", "file", "script", "install",
+    "open", "run", "show", "list", "hello", "touch", "tree", "last", "free", "at", "w", "bc",
+}
+
+# Tools whose first arguments are subcommands or package names (`git status`, `pip install numpy`)
+_PERINTAH_SUBCOMMAND = {
+    "git", "pip", "pip3", "npm", "npx", "yarn", "pnpm", "docker", "apt", "apt-get", "pkg", "dpkg", "pacman", "dnf", "yum",
+    "brew", "systemctl", "service", "kubectl", "cargo", "go", "conda", "gem", "composer", "termux-setup-storage",
+}
+
+_ARGUMEN_SHELL = re.compile(r"""^(
+    -{1,2}[\w-]+(=.*)?        # flags: -la, --help, --name=x
+    | [\w.~*-]*[/.*][\w./~*-]* # paths, globs and file names: foo.py, ./run.sh, /tmp, *.log
+    | \d+                      # numbers
+    | [|&;<>]+ | 2>&1 | \$\w+  # pipes, redirections and variables
+)$""", re.VERBOSE)
+
+_ATURAN_NIAT = [
+    # (rule name, intent, confidence, compiled pattern)
+    ("greeting", "conversation", 0.95, re.compile(
+        r"^\s*(hi|hai|hello|halo|hey|hei|thanks|thank you|terima ?kasih|makasih|good (morning|night|evening)|selamat (pagi|siang|sore|malam))\b[\s!.?]*\S{0,20}$", re.IGNORECASE)),
+    ("program_request", "program", 0.9, re.compile(
+        r"\b(write|create|make|generate|build|code|implement|buat(kan|in)?|bikin(in|kan)?|tulis(kan|in)?)\b.{0,60}?"
+        r"\b(function|script|program|code|class|module|app|application|kode|fungsi|skrip|aplikasi|kalkulator|calculator|bot|"
+        r"game|permainan|website|web ?page|halaman|api|server|scraper)\b",
+        re.IGNORECASE)),
+    ("program_language", "program", 0.85, re.compile(
+        r"\b(python|bash|javascript|nodejs|typescript|php|java|golang|rust|kotlin|swift|ruby|c\+\+|html|css)\b.{0,40}?"
+        r"\b(function|script|program|code|class|kode|fungsi|skrip)\b",
+        re.IGNORECASE)),
+    ("program_fix", "program", 0.8, re.compile(
+        r"\b(fix|debug|refactor|perbaiki|betulkan)\b.{0,30}?\b(code|kode|function|fungsi|script|skrip|bug|program)\b", re.IGNORECASE)),
+    ("shell_action", "shell", 0.85, re.compile(
+        r"^\s*(please\s+|tolong\s+)?(list|show|display|delete|remove|hapus|tampilkan|lihat|install|pasang|uninstall|compress|extract|"
+        r"ekstrak|zip|unzip|copy|move|rename|salin|pindahkan|jalankan|run|open|buka|cek|check|kill|matikan|download|unduh|update|upgrade|create|buat|bikin)\b"
+        r".{0,60}?\b(files?|folders?|director(y|ies)|direktori|dir|packages?|paket|disk|storage|memory|memori|ram|process(es)?|proses|ports?|"
+        r"zip|tar|archive|arsip|isi|\S+\.(py|sh|js|txt|zip|tar|gz|log|json|md))\b",
+        re.IGNORECASE)),
+    ("question", "conversation", 0.8, re.compile(
+        r"^\s*(what|why|how|who|when|where|which|is|are|can|could|should|do|does|explain|tell me|apa|apakah|kenapa|mengapa|bagaimana|gimana|siapa|kapan|"
+        r"di ?mana|jelaskan|ceritakan)\b", re.IGNORECASE)),
+]
+
+# Tiny bag-of-words model used when no rule fires; weights are log-odds style scores per token
+_INTENT_BOW_WEIGHTS = {
+    "program": {"function": 2.0, "fungsi": 2.0, "code": 1.5, "kode": 1.5, "script": 1.5, "skrip": 1.5, "program": 1.5, "class": 1.2,
+                "python": 1.0, "javascript": 1.0, "bash": 0.6, "algorithm": 1.2, "algoritma": 1.2, "loop": 0.8, "bug": 1.0, "error": 0.5},
+    "shell": {"file": 1.2, "folder": 1.2, "directory": 1.2, "direktori": 1.2, "install": 1.5, "delete": 1.2, "hapus": 1.2, "list": 0.8,
+              "run": 0.8, "jalankan": 1.0, "disk": 1.2, "process": 1.0, "proses": 1.0, "package": 1.2, "paket": 1.2, "zip": 1.0, "tar": 1.0},
+    "conversation": {"what": 1.0, "why": 1.2, "how": 0.8, "apa": 1.0, "kenapa": 1.2, "mengapa": 1.2, "bagaimana": 0.8, "explain": 1.2,
+                     "jelaskan": 1.2, "difference": 1.0, "perbedaan": 1.0, "think": 1.0, "opinion": 1.0, "you": 0.6, "kamu": 0.6},
+}
+
+# Decision counters and a short window of recent decisions, for tuning the threshold and rules
+INTENT_STATS: Counter = Counter()
+INTENT_RECENT_DECISIONS: deque = deque(maxlen=50)
+
+def _klasifikasi_perintah_literal(pesan: str) -> tuple[float, str | None]:
+    """
+    Scores whether a message is a literal shell command (e.g. `ls -la`, `python foo.py`).
+    Returns (confidence, None) or (0.0, reason) when it clearly is not one.
+    """
+    try:
+        tokens = shlex.split(pesan)
+    except ValueError:
+        return 0.0, "unparsable"
+    if not tokens:
+        return 0.0, "empty"
+    program = tokens[0]
+    if not (program in _SHELL_BUILTINS or program.startswith(("./", "/", "~/")) or shutil.which(program)):
+        return 0.0, "not_on_path"
+
+    args = tokens[1:]
+    if not args:
+        return (0.4 if program in _KATA_AMBIGU else 0.9), None
+    if program in _PERINTAH_SUBCOMMAND:
+        shell_like = sum(1 for arg in args if _ARGUMEN_SHELL.match(arg) or re.match(r"^[\w.+@=:-]+$", arg))
+    else:
+        shell_like = sum(1 for arg in args if _ARGUMEN_SHELL.match(arg))
+    ratio = shell_like / len(args)
+    if ratio == 1.0:
+        return 0.95, None
+    if "?" in pesan or program in _KATA_AMBIGU:
+        return 0.3 * ratio, None
+    return 0.3 + 0.6 * ratio, None
+
+def _klasifikasi_bow(pesan: str) -> tuple[str, float]:
+    """Scores the message with the bag-of-words weights and returns (intent, softmax confidence)."""
+    kata = re.findall(r"[a-z]+", pesan.lower())
+    skor = {niat: sum(bobot.get(k, 0.0) for k in kata) for niat, bobot in _INTENT_BOW_WEIGHTS.items()}
+    # Subtracting the maximum keeps exp() finite for long messages without changing the softmax
+    tertinggi = max(skor.values())
+    eksponen = {niat: math.exp(nilai - tertinggi) for niat, nilai in skor.items()}
+    total = sum(eksponen.values())
+    niat_terbaik = max(eksponen, key=eksponen.get)
+    # Scale down: the model is tiny, so it may only win outright on strong evidence
+    return niat_terbaik, 0.85 * eksponen[niat_terbaik] / total
+
+def klasifikasi_niat_lokal(pesan_pengguna: str) -> dict:
+    """
+    Tier-1 intent classifier that runs locally in microseconds.
+    Returns a decision dict: {"intent", "confidence", "rule", "literal_command"}.
+    """
+    pesan = pesan_pengguna.strip()
+    kandidat = []
+
+    confidence, _ = _klasifikasi_perintah_literal(pesan)
+    if confidence:
+        kandidat.append({"intent": "shell", "confidence": confidence, "rule": "literal_command", "literal_command": True})
+
+    for nama, niat, confidence, pola in _ATURAN_NIAT:
+        if pola.search(pesan):
+            kandidat.append({"intent": niat, "confidence": confidence, "rule": nama, "literal_command": False})
+
+    niat_bow, confidence_bow = _klasifikasi_bow(pesan)
+    kandidat.append({"intent": niat_bow, "confidence": confidence_bow, "rule": "bag_of_words", "literal_command": False})
+
+    return max(kandidat, key=lambda k: k["confidence"])
+
 # === Function: Detect User Intent ===
-def deteksi_niat_pengguna(pesan_pengguna: str) -> str:
+async def _deteksi_niat_llm_async(pesan_pengguna: str) -> str:
     """
-    Detects user intent (run shell command, create program, or general conversation).
+    Tier-2 intent detection through INTENT_DETECTION_MODEL.
     Returns string: "shell", "program", or "conversation".
     """
     messages = [
@@ -264,7 +1879,7 @@ Return only one word from the categories above. Do not provide additional explan
     ]
     logger.info(f"{COLOR_BLUE}[AI] Detecting user intent for '{pesan_pengguna}' ({INTENT_DETECTION_MODEL})...{COLOR_RESET}\n")
     
-    success, niat = call_llm(messages, INTENT_DETECTION_MODEL, OPENROUTER_API_KEY, max_tokens=10, temperature=0.0)
+    success, niat = await call_llm_async(messages, INTENT_DETECTION_MODEL, OPENROUTER_API_KEY, max_tokens=10, temperature=0.0, task="intent")
     
     if success:
         niat_cleaned = niat.strip().lower()
@@ -280,6 +1895,46 @@ Return only one word from the categories above. Do not provide additional explan
         logger.error(f"[AI] Failed to detect intent: {niat}. Defaulting to 'conversation'.")
         return "conversation"
 
+async def deteksi_niat_pengguna_detail_async(pesan_pengguna: str) -> dict:
+    """
+    Detects user intent with the local classifier first and falls back to the LLM
+    when the local confidence is below INTENT_LOCAL_CONFIDENCE_THRESHOLD.
+    Returns a decision dict: {"intent", "confidence", "rule", "literal_command", "source"}.
+    """
+    mulai = time.perf_counter()
+    keputusan_lokal = klasifikasi_niat_lokal(pesan_pengguna) if INTENT_LOCAL_ENABLED else None
+
+    if keputusan_lokal and keputusan_lokal["confidence"] >= INTENT_LOCAL_CONFIDENCE_THRESHOLD:
+        keputusan = dict(keputusan_lokal, source="local")
+        INTENT_STATS[f"rule:{keputusan['rule']}"] += 1
+    else:
+        niat = await _deteksi_niat_llm_async(pesan_pengguna)
+        keputusan = {"intent": niat, "confidence": None, "rule": None, "literal_command": False, "source": "llm"}
+        if keputusan_lokal:
+            # Record what the local tier would have said, to tune rules against the LLM
+            keputusan["local_guess"] = keputusan_lokal["intent"]
+            keputusan["local_confidence"] = keputusan_lokal["confidence"]
+            INTENT_STATS["local_agrees_with_llm" if keputusan_lokal["intent"] == niat else "local_disagrees_with_llm"] += 1
+
+    INTENT_STATS[keputusan["source"]] += 1
+    METRICS.amati("intent_detection_seconds", time.perf_counter() - mulai, source=keputusan["source"])
+    INTENT_RECENT_DECISIONS.append(dict(keputusan, message=pesan_pengguna[:80]))
+    logger.info(f"[Intent] '{pesan_pengguna[:60]}' -> {keputusan['intent']} (source={keputusan['source']}, rule={keputusan['rule']}, confidence={keputusan['confidence']})")
+    return keputusan
+
+async def deteksi_niat_pengguna_async(pesan_pengguna: str) -> str:
+    """
+    Detects user intent (run shell command, create program, or general conversation).
+    Returns string: "shell", "program", or "conversation".
+    """
+    keputusan = await deteksi_niat_pengguna_detail_async(pesan_pengguna)
+    return keputusan["intent"]
+
+def deteksi_niat_pengguna(pesan_pengguna: str) -> str:
+    """Synchronous wrapper around deteksi_niat_pengguna_async for non-async callers."""
+    return _jalankan_sync(deteksi_niat_pengguna_async(pesan_pengguna))
+
+
 # === Function: Detect Programming Language requested in Prompt ===
 def deteksi_bahasa_dari_prompt(prompt: str) -> str | None:
     """
@@ -318,25 +1973,89 @@ def deteksi_bahasa_dari_prompt(prompt: str) -> str | None:
     return None
 
 
+# === Token-budgeted Prompt Builder ===
+_POLA_TOKEN = re.compile(r"\w+|[^\w\s]")
+# Chat formats add a few tokens of framing per message
+_TOKEN_PER_PESAN = 4
+
+def hitung_token(teks: str) -> int:
+    """
+    Approximates the token count of a text without a model tokenizer: every punctuation
+    mark is one token and words cost one token per ~4 characters, which tracks BPE
+    tokenizers closely for English, Indonesian, code and logs.
+    """
+    return sum(math.ceil(len(t) / 4) for t in _POLA_TOKEN.findall(teks))
+
+def _potong_ekor_token(teks: str, anggaran: int) -> str:
+    """Keeps the last lines of a text that fit into `anggaran` tokens (errors are usually at the end)."""
+    if hitung_token(teks) <= anggaran:
+        return teks
+    baris = teks.splitlines()
+    terpilih = []
+    terpakai = hitung_token("[... earlier lines trimmed]")
+    for b in reversed(baris):
+        biaya = hitung_token(b) + 1
+        if terpakai + biaya > anggaran:
+            break
+        terpilih.append(b)
+        terpakai += biaya
+    if not terpilih and len(baris) == 1 and anggaran > terpakai:
+        # A single huge line: keep its tail by characters
+        return "[... trimmed]" + baris[0][-(anggaran - terpakai) * 4:]
+    return f"[... {len(baris) - len(terpilih)} earlier lines trimmed]\n" + "\n".join(reversed(terpilih))
+
+def bangun_pesan_llm(task: str, system: str, user: str, history: list = None, error_log: str = None, konteks_tambahan: list = None) -> list:
+    """
+    Assembles the messages of an LLM request within PROMPT_TOKEN_BUDGETS[task].
+    Priority: the system prompt and the current input are always kept, then the tail of
+    `error_log` (substituted for "{error}" in `user`), then `konteks_tambahan` (extra system
+    notes, in order), then the most recent `history` messages. Lower priority parts are
+    trimmed or dropped first.
+    """
+    anggaran = int(PROMPT_TOKEN_BUDGETS.get(task, PROMPT_TOKEN_BUDGETS["default"]))
+    terpakai = hitung_token(system) + hitung_token(user.replace("{error}", "")) + 2 * _TOKEN_PER_PESAN
+
+    if error_log is not None:
+        sisa = max(0, anggaran - terpakai)
+        error_slice = _potong_ekor_token(error_log, sisa)
+        terpakai += hitung_token(error_slice)
+        user = user.replace("{error}", error_slice)
+
+    pesan_sistem = [{"role": "system", "content": system}]
+    for catatan in konteks_tambahan or []:
+        sisa = anggaran - terpakai - _TOKEN_PER_PESAN
+        if sisa <= 0:
+            break
+        catatan = _potong_ekor_token(catatan, sisa)
+        pesan_sistem.append({"role": "system", "content": catatan})
+        terpakai += hitung_token(catatan) + _TOKEN_PER_PESAN
+
+    riwayat = []
+    for msg in reversed((history or [])[-PROMPT_MAX_HISTORY_MESSAGES:]):
+        biaya = hitung_token(str(msg.get("content", ""))) + _TOKEN_PER_PESAN
+        if terpakai + biaya > anggaran:
+            break
+        riwayat.append(msg)
+        terpakai += biaya
+    riwayat.reverse()
+
+    logger.info(f"[Context] task={task} ~{terpakai}/{anggaran} tokens, history {len(riwayat)}/{len(history or [])} messages.")
+    return pesan_sistem + riwayat + [{"role": "user", "content": user}]
+
 # === Function: Request Code from LLM ===
-def minta_kode(prompt: str, error_context: str = None, chat_id: int = None, target_language: str = None) -> tuple[bool, str, str | None]:
+async def minta_kode_async(prompt: str, error_context: str = None, chat_id: int = None, target_language: str = None, on_delta: Callable[[str], Awaitable[None]] = None) -> tuple[bool, str, str | None]:
     """
     Requests LLM to generate code based on prompt in a specific language.
     If error_context is provided, this is a debugging request.
     Includes recent conversation context if available.
+    If on_delta is given, the raw LLM output is streamed to it while it is generated.
     """
-    messages = []
-    
     history = get_chat_history(chat_id) if chat_id else []
-    recent_history = history[-10:]
-    for msg in recent_history:
-        messages.append(msg)
 
     # Add system information to the system message
     system_info_message = (
         f"You are an AI coding assistant proficient in various programming languages. "
-        f"The system runs on OS: {SYSTEM_INFO['os']}, Shell: {SYSTEM_INFO['shell']}. "
-        f"Neofetch output: \n```\n{SYSTEM_INFO['neofetch_output']}\n```\n"
+        f"{info_sistem_untuk_prompt(prompt or '')}\n"
         f"Code results *must* be Markdown code blocks with appropriate language tags "
         f"(e.g., ```python, ```bash, ```javascript, ```html, ```css, ```php, ```java, etc.). "
         f"DO NOT add explanations, intros, conclusions, or extra text outside the Markdown code block. "
@@ -345,185 +2064,350 @@ def minta_kode(prompt: str, error_context: str = None, chat_id: int = None, targ
     )
 
     if error_context:
-        messages.append({
-                "role": "system", 
-                "content": system_info_message + " You are fixing code. Based on the error log and provided conversation history, provide *only* the complete fixed code or new code. Ensure the code is directly runnable."
-            })
-        messages.append({
-                "role": "user",
-                "content": f"There was an error running the code/command:\n\n{error_context}\n\nFix it or provide complete new code. Focus on {target_language if target_language else 'relevant'} language."
-            })
+        messages = bangun_pesan_llm(
+            "code",
+            system_info_message + " You are fixing code. Based on the error log and provided conversation history, provide *only* the complete fixed code or new code. Ensure the code is directly runnable.",
+            f"There was an error running the code/command:\n\n{{error}}\n\nFix it or provide complete new code. Focus on {target_language if target_language else 'relevant'} language.",
+            history=history,
+            error_log=error_context,
+        )
         logger.info(f"{COLOR_BLUE}[AI] Requesting fix/new code ({target_language if target_language else 'universal'}) from AI model ({CODE_GEN_MODEL}) based on error...{COLOR_RESET}\n")
     else:
-        messages.append({
-                "role": "system", 
-                "content": system_info_message
-            })
         prompt_with_lang = f"Instruction: {prompt}"
         if target_language:
             prompt_with_lang += f" (in {target_language} language)"
-        messages.append({
-                "role": "user",
-                "content": prompt_with_lang
-            })
+        messages = bangun_pesan_llm("code", system_info_message, prompt_with_lang, history=history)
         logger.info(f"{COLOR_BLUE}[AI] Requesting code ({target_language if target_language else 'universal'}) from AI model ({CODE_GEN_MODEL})...{COLOR_RESET}\n")
     
-    success, response_content = call_llm(messages, CODE_GEN_MODEL, OPENROUTER_API_KEY, max_tokens=2048, temperature=0.7)
+    kunci_fix = None
+    if error_context and ERROR_CACHE_ENABLED:
+        # A fix is only reusable for the same error on the same code
+        kode_terakhir = get_user_context(chat_id)["last_generated_code"] if chat_id else None
+        kode_hash = hashlib.sha256((kode_terakhir or "").encode("utf-8")).hexdigest()[:12]
+        fingerprint, signature = sidik_jari_error(error_context)
+        kunci_fix = (fingerprint, f"fix:{target_language or 'any'}:{kode_hash}", signature)
+        fix_cache = ERROR_SUGGESTION_CACHE.get(kunci_fix[0], kunci_fix[1])
+        if fix_cache is not None:
+            logger.info(f"{COLOR_GREEN}[ErrorCache] ✔ Known error {fingerprint}. Reusing previous fix.{COLOR_RESET}")
+            if on_delta is not None:
+                await on_delta(fix_cache)
+            cleaned_code, detected_language = ekstrak_kode_dari_llm(fix_cache, target_language)
+            return True, cleaned_code, detected_language
+
+    success, response_content = await call_llm_async(messages, CODE_GEN_MODEL, OPENROUTER_API_KEY, max_tokens=2048, temperature=0.7, on_delta=on_delta, task="code")
 
     if success:
+        if kunci_fix:
+            ERROR_SUGGESTION_CACHE.set(kunci_fix[0], kunci_fix[1], kunci_fix[2], response_content)
         cleaned_code, detected_language = ekstrak_kode_dari_llm(response_content, target_language)
         return True, cleaned_code, detected_language
     else:
         return False, response_content, None
 
+def minta_kode(prompt: str, error_context: str = None, chat_id: int = None, target_language: str = None) -> tuple[bool, str, str | None]:
+    """Synchronous wrapper around minta_kode_async for non-async callers."""
+    return _jalankan_sync(minta_kode_async(prompt, error_context, chat_id, target_language))
+
+
 # === Function: Generate Filename ===
-def generate_filename(prompt: str, detected_language: str = "txt") -> str:
+EKSTENSI_BAHASA = {
+    "python": ".py", "bash": ".sh", "javascript": ".js", "html": ".html",
+    "css": ".css", "php": ".php", "java": ".java", "c": ".c",
+    "cpp": ".cpp", "csharp": ".cs", "ruby": ".rb", "go": ".go",
+    "swift": ".swift", "kotlin": ".kt", "rust": ".rs", "txt": ".txt"
+}
+
+def _rapikan_nama_file(filename: str, detected_language: str = "txt") -> str:
     """
-    Generates a relevant filename based on user prompt and detected language.
+    Turns a suggested name into a safe lowercase snake_case filename
+    with the extension of detected_language.
     """
-    extension_map = {
-        "python": ".py", "bash": ".sh", "javascript": ".js", "html": ".html",
-        "css": ".css", "php": ".php", "java": ".java", "c": ".c",
-        "cpp": ".cpp", "csharp": ".cs", "ruby": ".rb", "go": ".go",
-        "swift": ".swift", "kotlin": ".kt", "rust": ".rs", "txt": ".txt"
-    }
+    filename = filename.strip().strip("`'\"").lower().replace(' ', '_')
     
+    for ext in EKSTENSI_BAHASA.values():
+        if filename.endswith(ext):
+            filename = filename[:-len(ext)]
+            break
+
+    filename = re.sub(r'[^\w-]', '', filename)
+            
+    if not filename:
+        filename = "generated_code"
+        
+    return filename + EKSTENSI_BAHASA.get(detected_language, '.txt')
+
+# Words that carry no meaning in a filename: English and Indonesian stop words,
+# request verbs and generic nouns ("buatkan program python untuk ..." -> "...")
+_KATA_ABAIKAN_NAMA_FILE = set("""
+a an the and or of for to in on at by with from into as is are be this that these those it its my me i you your
+please can could would will should just simple simply some any which what how that who using use make create write
+generate build give show need want new small little basic quick code program script function app application
+buat buatkan bikin bikinin tulis tuliskan tolong dong ya yang untuk dan atau dengan dari ke di pada ini itu saya aku
+kamu sebuah suatu satu seperti agar supaya bisa dapat akan harus mau ingin sederhana simpel kode program skrip fungsi
+berfungsi sebagai menggunakan pakai pake bahasa aplikasi
+python py bash sh shell javascript js node nodejs html css php java c cpp csharp ruby go golang swift kotlin rust
+""".split())
+
+def _nama_file_unik(filename: str, direktori: str = ".") -> str:
+    """Appends _2, _3, ... before the extension until the name does not collide with an existing file."""
+    dasar, ext = os.path.splitext(filename)
+    kandidat = filename
+    nomor = 2
+    while os.path.exists(os.path.join(direktori, kandidat)):
+        kandidat = f"{dasar}_{nomor}{ext}"
+        nomor += 1
+    return kandidat
+
+def generate_filename_lokal(prompt: str, detected_language: str = "txt", max_kata: int = 4, max_panjang: int = 40) -> str:
+    """
+    Builds a snake_case filename from the prompt without calling the LLM:
+    transliterates to ASCII, drops stop words, keeps the first meaningful words
+    and appends the extension of detected_language.
+    """
+    ascii_prompt = unicodedata.normalize("NFKD", prompt).encode("ascii", "ignore").decode("ascii").lower()
+    kata = [k for k in re.findall(r"[a-z0-9]+", ascii_prompt) if k not in _KATA_ABAIKAN_NAMA_FILE and not k.isdigit()]
+
+    nama = ""
+    for k in kata[:max_kata]:
+        kandidat = f"{nama}_{k}" if nama else k
+        if len(kandidat) > max_panjang:
+            break
+        nama = kandidat
+    # A single very long word is still better than the generic fallback
+    if not nama and kata:
+        nama = kata[0][:max_panjang]
+
+    return _rapikan_nama_file(nama or "generated_code", detected_language)
+
+async def _generate_filename_llm_async(prompt: str, detected_language: str = "txt") -> str:
+    """
+    Generates a relevant filename with FILENAME_GEN_MODEL (opt-in with FILENAME_GEN_MODE=llm).
+    """
     messages = [
         {"role": "system", "content": f"You are a filename generator. Provide a single short, relevant, and descriptive filename (no spaces, use underscores, all lowercase, no extension) based on the following code description and language '{detected_language}'. Example: 'factorial_function' or 'cli_calculator'. No explanation, just the filename."},
         {"role": "user", "content": f"Code description: {prompt}"}
     ]
     logger.info(f"{COLOR_BLUE}[AI] Generating filename for '{prompt}' ({FILENAME_GEN_MODEL}) with language {detected_language}...{COLOR_RESET}\n")
     
-    success, filename = call_llm(messages, FILENAME_GEN_MODEL, OPENROUTER_API_KEY, max_tokens=20, temperature=0.5)
+    success, filename = await call_llm_async(messages, FILENAME_GEN_MODEL, OPENROUTER_API_KEY, max_tokens=20, temperature=0.5, task="filename")
     
     if not success:
         logger.warning(f"[AI] Failed to generate filename from LLM: {filename}. Using default name.")
-        return f"generated_code{extension_map.get(detected_language, '.txt')}"
+        return f"generated_code{EKSTENSI_BAHASA.get(detected_language, '.txt')}"
 
-    filename = filename.strip()
-    filename = re.sub(r'[^\w-]', '', filename).lower().replace(' ', '_')
-    
-    for ext in extension_map.values():
-        if filename.endswith(ext):
-            filename = filename[:-len(ext)]
-            break
-            
-    if not filename:
-        filename = "generated_code"
-        
-    return filename + extension_map.get(detected_language, '.txt')
+    return _rapikan_nama_file(filename, detected_language)
 
+async def generate_filename_async(prompt: str, detected_language: str = "txt") -> str:
+    """
+    Generates a relevant filename based on user prompt and detected language.
+    Uses the local generator unless FILENAME_GEN_MODE=llm; never returns the name of an existing file.
+    """
+    if FILENAME_GEN_MODE == "llm":
+        filename = await _generate_filename_llm_async(prompt, detected_language)
+    else:
+        filename = generate_filename_lokal(prompt, detected_language)
+    return _nama_file_unik(filename)
+
+def generate_filename(prompt: str, detected_language: str = "txt") -> str:
+    """Synchronous wrapper around generate_filename_async for non-async callers."""
+    return _jalankan_sync(generate_filename_async(prompt, detected_language))
+
+
+# === Function: Single-round-trip structured pipeline (intent + language + filename + code/command) ===
+_SKEMA_RESPONS_TERSTRUKTUR = {
+    "intent": str,
+    "language": (str, type(None)),
+    "filename": (str, type(None)),
+    "code": (str, type(None)),
+    "command": (str, type(None)),
+}
+
+def validasi_respons_terstruktur(teks: str) -> tuple[bool, dict | str]:
+    """
+    Parses and validates the JSON answer of the structured pipeline.
+    Returns (True, data) when it matches the schema, otherwise (False, reason).
+    """
+    teks = teks.strip()
+    # Models often wrap JSON in a ```json fence or add a sentence around it
+    cocok = re.search(r"\{.*\}", teks, re.DOTALL)
+    if not cocok:
+        return False, "no JSON object in response"
+    try:
+        data = json.loads(cocok.group(0))
+    except json.JSONDecodeError as e:
+        return False, f"invalid JSON: {e}"
+    if not isinstance(data, dict):
+        return False, "JSON root is not an object"
+
+    for kunci, tipe in _SKEMA_RESPONS_TERSTRUKTUR.items():
+        if not isinstance(data.get(kunci), tipe):
+            return False, f"field '{kunci}' missing or of wrong type"
+    data = {kunci: data.get(kunci) for kunci in _SKEMA_RESPONS_TERSTRUKTUR}
+
+    data["intent"] = data["intent"].strip().lower()
+    if data["intent"] not in ("shell", "program", "conversation"):
+        return False, f"unknown intent '{data['intent']}'"
+    if data["intent"] == "program":
+        if not (data["code"] or "").strip():
+            return False, "program intent without code"
+        # The code may still be fenced; reuse the normal extractor to clean it
+        kode, bahasa_terdeteksi = ekstrak_kode_dari_llm(data["code"] if "```" in data["code"] else f"```{data['language'] or ''}\n{data['code']}\n```", data["language"])
+        data["code"] = kode
+        data["language"] = (data["language"] or bahasa_terdeteksi or "txt").strip().lower()
+        data["filename"] = _rapikan_nama_file(data["filename"] or "generated_code", data["language"])
+    elif data["intent"] == "shell":
+        if not (data["command"] or "").strip() or "\n" in data["command"].strip():
+            return False, "shell intent without a single-line command"
+        data["command"] = data["command"].strip()
+    return True, data
+
+async def minta_respons_terstruktur_async(prompt: str, chat_id: int = None) -> dict | None:
+    """
+    Asks one model for intent, language, filename and the code or shell command as JSON.
+    Returns the validated dict, or None so the caller can fall back to the multi-call path.
+    """
+    history = get_chat_history(chat_id) if chat_id else []
+
+    system_message_content = (
+        f"You are the request router and coding assistant of a Telegram shell bot. "
+        f"{info_sistem_untuk_prompt(prompt)} "
+        f"Classify the user's message and answer it in ONE JSON object, with no text outside it:\n"
+        f'{{"intent": "shell" | "program" | "conversation", "language": string or null, '
+        f'"filename": short snake_case name without extension or null, "code": complete runnable code or null, '
+        f'"command": single-line shell command or null}}\n'
+        f"- intent \"program\": the user wants code written or fixed; fill language, filename and code.\n"
+        f"- intent \"shell\": the user wants to run a system command or file operation; fill command.\n"
+        f"- intent \"conversation\": anything else; leave the other fields null."
+    )
+    messages = bangun_pesan_llm("structured", system_message_content, prompt, history=history)
+
+    logger.info(f"{COLOR_BLUE}[AI] Requesting structured intent/code answer ({STRUCTURED_PIPELINE_MODEL})...{COLOR_RESET}\n")
+    success, response = await call_llm_async(messages, STRUCTURED_PIPELINE_MODEL, OPENROUTER_API_KEY, max_tokens=2048, temperature=0.3, task="structured", use_cache=False)
+    if not success:
+        logger.warning(f"[AI] Structured pipeline request failed: {response}. Falling back to multi-call path.")
+        return None
+
+    valid, hasil = validasi_respons_terstruktur(response)
+    if not valid:
+        logger.warning(f"[AI] Structured pipeline answer rejected ({hasil}). Falling back to multi-call path.")
+        return None
+    return hasil
 
 # === Function: Convert Natural Language to Shell Command ===
-def konversi_ke_perintah_shell(bahasa_natural: str, chat_id: int = None) -> tuple[bool, str]:
+async def konversi_ke_perintah_shell_async(bahasa_natural: str, chat_id: int = None) -> tuple[bool, str]:
     """
     Converts user's natural language into an executable shell command.
     Includes recent conversation context if available.
     """
-    messages = []
-
     history = get_chat_history(chat_id) if chat_id else []
-    recent_history = history[-10:] 
-    for msg in recent_history:
-        messages.append(msg)
 
     # Add system information to the system message
     system_message_content = (
         f"You are a natural language to shell command translator. "
-        f"The system runs on OS: {SYSTEM_INFO['os']}, Shell: {SYSTEM_INFO['shell']}. "
+        f"{info_sistem_untuk_prompt()} "
         f"Convert the following natural language instruction into the most relevant single-line Linux Termux shell command. "
         f"Do not provide explanations, just the command. "
         f"If the instruction is unclear or cannot be converted into a shell command, respond with 'CANNOT_CONVERT'."
     )
-    messages.append({"role": "system", "content": system_message_content})
-    messages.append({"role": "user", "content": f"Convert this to a shell command: {bahasa_natural}"})
+    messages = bangun_pesan_llm("shell_command", system_message_content, f"Convert this to a shell command: {bahasa_natural}", history=history)
 
     logger.info(f"{COLOR_BLUE}[AI] Converting natural language to shell command ({COMMAND_CONVERSION_MODEL})...{COLOR_RESET}\n")
-    return call_llm(messages, COMMAND_CONVERSION_MODEL, OPENROUTER_API_KEY, max_tokens=128, temperature=0.3)
+    return await call_llm_async(messages, COMMAND_CONVERSION_MODEL, OPENROUTER_API_KEY, max_tokens=128, temperature=0.3, task="shell_command")
+
+def konversi_ke_perintah_shell(bahasa_natural: str, chat_id: int = None) -> tuple[bool, str]:
+    """Synchronous wrapper around konversi_ke_perintah_shell_async for non-async callers."""
+    return _jalankan_sync(konversi_ke_perintah_shell_async(bahasa_natural, chat_id))
 
 
 # === Function: Send Error to LLM for Suggestion ===
-def kirim_error_ke_llm_for_suggestion(log_error: str, chat_id: int = None) -> tuple[bool, str]:
+async def kirim_error_ke_llm_for_suggestion_async(log_error: str, chat_id: int = None, on_delta: Callable[[str], Awaitable[None]] = None) -> tuple[bool, str]:
     """
     Sends error log to LLM to get suggested fixes.
     Includes recent conversation context if available.
+    If on_delta is given, the suggestion is streamed to it while it is generated.
     """
-    messages = []
+    # Known errors are answered before any prompt is built
+    fingerprint, signature = sidik_jari_error(log_error)
+    if ERROR_CACHE_ENABLED:
+        saran_cache = ERROR_SUGGESTION_CACHE.get(fingerprint, "suggestion")
+        if saran_cache is not None:
+            logger.info(f"{COLOR_GREEN}[ErrorCache] ✔ Known error {fingerprint}. Reusing previous suggestion.{COLOR_RESET}")
+            if on_delta is not None:
+                await on_delta(saran_cache)
+            return True, saran_cache
 
     history = get_chat_history(chat_id) if chat_id else []
-    recent_history = history[-10:] 
-    for msg in recent_history:
-        messages.append(msg)
 
     # Add system information to the system message
     system_message_content = (
         f"You are an AI debugger. "
-        f"The system runs on OS: {SYSTEM_INFO['os']}, Shell: {SYSTEM_INFO['shell']}. "
+        f"{info_sistem_untuk_prompt()} "
         f"Consider this system information when analyzing errors and providing suggestions. "
         f"Provide suggestions in a runnable shell format if possible, or in a Markdown code block. "
         f"Otherwise, provide a brief explanation."
     )
 
-    messages.append({"role": "system", "content": system_message_content})
-    messages.append({"role": "user", "content": f"The following error occurred:\n\n{log_error}\n\nWhat is the best suggestion to fix it in a Linux Termux system context? "})
+    messages = bangun_pesan_llm(
+        "error_fix",
+        system_message_content,
+        "The following error occurred:\n\n{error}\n\nWhat is the best suggestion to fix it in a Linux Termux system context? ",
+        history=history,
+        error_log=log_error,
+    )
     
     headers = {"HTTP-Referer": "[https://t.me/dseAI_bot](https://t.me/dseAI_bot)"}
     
     logger.info(f"{COLOR_BLUE}[AI] Sending error to AI model ({ERROR_FIX_MODEL}) for suggestions...{COLOR_RESET}\n")
-    return call_llm(messages, ERROR_FIX_MODEL, OPENROUTER_API_KEY, max_tokens=512, temperature=0.7, extra_headers=headers)
+    success, saran = await call_llm_async(messages, ERROR_FIX_MODEL, OPENROUTER_API_KEY, max_tokens=512, temperature=0.7, extra_headers=headers, on_delta=on_delta, task="error_fix")
+    if success and ERROR_CACHE_ENABLED:
+        ERROR_SUGGESTION_CACHE.set(fingerprint, "suggestion", signature, saran)
+    return success, saran
+
+def kirim_error_ke_llm_for_suggestion(log_error: str, chat_id: int = None) -> tuple[bool, str]:
+    """Synchronous wrapper around kirim_error_ke_llm_for_suggestion_async for non-async callers."""
+    return _jalankan_sync(kirim_error_ke_llm_for_suggestion_async(log_error, chat_id))
+
 
 # === Function: Request General Conversation Answer from LLM ===
-def minta_jawaban_konversasi(chat_id: int, prompt: str) -> tuple[bool, str]:
+async def minta_jawaban_konversasi_async(chat_id: int, prompt: str, on_delta: Callable[[str], Awaitable[None]] = None) -> tuple[bool, str]:
     """
     Requests a general conversational answer from LLM, while maintaining history
     and including references from previous interactions (code, commands).
+    If on_delta is given, the answer is streamed to it while it is generated.
     """
     history = get_chat_history(chat_id)
     user_context = get_user_context(chat_id)
     
-    system_context_messages = []
-
-    # Add system information to the beginning of the system message
-    system_context_messages.append(
-        {"role": "system", "content": f"System runs on OS: {SYSTEM_INFO['os']}, Shell: {SYSTEM_INFO['shell']}. Neofetch information:\n```\n{SYSTEM_INFO['neofetch_output']}\n```"}
-    )
+    # Add system information to the system message
+    system_message_content = info_sistem_untuk_prompt(prompt)
 
+    # Extra context from previous interactions, most relevant first
+    konteks_tambahan = []
     if user_context["last_command_run"] and user_context["last_ai_response_type"] == "shell":
-        system_context_messages.append(
-            {"role": "system", "content": f"User just ran a shell command: `{user_context['last_command_run']}`. Consider this context in your answer."}
-        )
-    if user_context["last_generated_code"] and user_context["last_ai_response_type"] == "program":
-        lang_display = user_context["last_generated_code_language"] if user_context["last_generated_code_language"] else "code"
-        system_context_messages.append(
-            {"role": "system", "content": f"User just received {lang_display} code:\n```{lang_display}\n{user_context['last_generated_code']}\n```. Consider this context in your answer."}
-        )
+        konteks_tambahan.append(f"User just ran a shell command: `{user_context['last_command_run']}`. Consider this context in your answer.")
+    # The output buffer is not persisted, so after a restart only the saved error log is left
+    error_tail = user_context["full_error_output"].tail_chars(500) or (user_context["last_error_log"] or "")[-500:]
     if user_context["last_error_log"] and user_context["last_user_message_intent"] == "shell":
-        system_context_messages.append(
-            {"role": "system", "content": f"User encountered an error after running a command: `{user_context['last_command_run']}` with error log:\n```\n{user_context['full_error_output'][-500:]}\n```. Consider this in your answer."}
-        )
+        konteks_tambahan.append(f"User encountered an error after running a command: `{user_context['last_command_run']}` with error log:\n```\n{error_tail}\n```. Consider this in your answer.")
     elif user_context["last_error_log"] and user_context["last_user_message_intent"] == "program":
-         system_context_messages.append(
-            {"role": "system", "content": f"User encountered an error after interacting with a program:\n```\n{user_context['full_error_output'][-500:]}\n```. Consider this in your answer."}
-        )
-
-    messages_to_send = []
-    messages_to_send.extend(system_context_messages)
+        konteks_tambahan.append(f"User encountered an error after interacting with a program:\n```\n{error_tail}\n```. Consider this in your answer.")
+    if user_context["last_generated_code"] and user_context["last_ai_response_type"] == "program":
+        lang_display = user_context["last_generated_code_language"] if user_context["last_generated_code_language"] else "code"
+        konteks_tambahan.append(f"User just received {lang_display} code:\n```{lang_display}\n{user_context['last_generated_code']}\n```. Consider this context in your answer.")
 
-    max_history_length = 10
-    recent_history = history[-max_history_length:]
-    messages_to_send.extend(recent_history)
-    
-    messages_to_send.append({"role": "user", "content": prompt})
+    messages_to_send = bangun_pesan_llm("conversation", system_message_content, prompt, history=history, konteks_tambahan=konteks_tambahan)
 
     logger.info(f"{COLOR_BLUE}[AI] Requesting conversational answer from AI model ({CONVERSATION_MODEL})...{COLOR_RESET}\n")
-    success, response = call_llm(messages_to_send, CONVERSATION_MODEL, OPENROUTER_API_KEY, max_tokens=256, temperature=0.7)
+    success, response = await call_llm_async(messages_to_send, CONVERSATION_MODEL, OPENROUTER_API_KEY, max_tokens=256, temperature=0.7, on_delta=on_delta, task="conversation")
 
     if success:
-        history.append({"role": "user", "content": prompt})
-        history.append({"role": "assistant", "content": response})
-        chat_histories[chat_id] = history
+        SESSION_STORE.tambah_riwayat(chat_id, {"role": "user", "content": prompt}, {"role": "assistant", "content": response})
     return success, response
 
+def minta_jawaban_konversasi(chat_id: int, prompt: str) -> tuple[bool, str]:
+    """Synchronous wrapper around minta_jawaban_konversasi_async for non-async callers."""
+    return _jalankan_sync(minta_jawaban_konversasi_async(chat_id, prompt))
+
 
 # === Function: Save to file ===
 def simpan_ke_file(nama_file: str, isi: str) -> bool:
@@ -540,46 +2424,585 @@ def simpan_ke_file(nama_file: str, isi: str) -> bool:
         logger.error(f"[FILE] 🔴 Failed to save file {nama_file}: {e}")
         return False
 
+# === Function: Render MarkdownV2 for Telegram ===
+_POLA_ANSI_WARNA = re.compile(r'\033\[[0-9;]*m')
+# Markup handled by the renderer; every other special character is escaped
+_POLA_MARKUP_MARKDOWN_V2 = re.compile(r'```|`|\*\*?|__?')
+_POLA_PAGAR_BAHASA = re.compile(r'(\w+)?\n')
+_KARAKTER_ESCAPE_MARKDOWN_V2 = "\\[]()~>#+-=|{}.!"
+_POLA_ESCAPE_MARKDOWN_V2 = re.compile(r'[\\\[\]()~>#+\-=|{}.!]')
+_TABEL_ESCAPE_LITERAL = str.maketrans({"*": "\\*", "_": "\\_"})
+# `**bold**` as written by most LLMs is Telegram's `*bold*`
+_JENIS_PENANDA = {"*": "*", "**": "*", "_": "_", "__": "__"}
+
+def _teks_polos(pesan_raw: str) -> str:
+    """The message as plain text: ANSI colors removed, no parse mode."""
+    return _POLA_ANSI_WARNA.sub('', pesan_raw)
+
+def _ganti_escape(m: re.Match) -> str:
+    return "\\" + m[0]
+
+def _escape_teks(teks: str) -> str:
+    # A regex callback wins on short fragments, chained C-level replaces on long ones
+    if len(teks) < 64:
+        return _POLA_ESCAPE_MARKDOWN_V2.sub(_ganti_escape, teks)
+    for karakter in _KARAKTER_ESCAPE_MARKDOWN_V2:
+        if karakter in teks:
+            teks = teks.replace(karakter, "\\" + karakter)
+    return teks
+
+def _escape_kode(teks: str) -> str:
+    if "\\" in teks:
+        teks = teks.replace("\\", "\\\\")
+    if "`" in teks:
+        teks = teks.replace("`", "\\`")
+    return teks
+
+def _md_kosong_sejak(keluar: list, indeks: int) -> bool:
+    return not any(keluar[i] for i in range(indeks + 1, len(keluar)))
+
+def _md_tambah_penanda(keluar: list, jenis: str) -> int:
+    keluar.append(jenis)
+    return len(keluar) - 1
+
+def _md_pisah_garis_bawah(keluar: list) -> list:
+    # "___" is ambiguous to Telegram; a carriage return (which Telegram ignores) separates adjacent markers
+    hasil = []
+    sebelumnya = ""
+    for bagian in keluar:
+        if bagian:
+            if bagian in ("_", "__") and sebelumnya in ("_", "__"):
+                hasil.append("\r")
+            hasil.append(bagian)
+            sebelumnya = bagian
+    return hasil
+
+def _md_tutup_entitas(keluar: list, entitas: list):
+    # An entity with nothing inside is rejected by Telegram, so its opening marker is dropped instead
+    if _md_kosong_sejak(keluar, entitas[2][-1]):
+        keluar[entitas[2][-1]] = ""
+    else:
+        entitas[2].append(_md_tambah_penanda(keluar, entitas[0]))
+
+def format_pesan_markdown_v2(pesan_raw: str) -> str:
+    """
+    Renders a raw message as Telegram MarkdownV2 in a single pass over its markup.
+    `*bold*` (or `**bold**`), `_italic_`, `__underline__`, `inline code` and fenced ```lang
+    blocks are kept; every other special character is escaped, and inside code only '`' and
+    '\\' are, as the Bot API requires. Broken markup is repaired instead of being rejected by
+    Telegram: unclosed code is closed, bold/italic are closed around code (which may not be
+    nested in them) and reopened after it, and `*`/`_` that do not pair up (bullets, "2 * 3",
+    snake_case, unmatched or crossing markers) are sent as literal characters.
+    """
+    teks = _POLA_ANSI_WARNA.sub('', pesan_raw) if "\033" in pesan_raw else pesan_raw
+    m = _POLA_MARKUP_MARKDOWN_V2.search(teks)
+    if m is None:
+        return _escape_teks(teks)
+    keluar = []
+    # Open entities, innermost last: [kind, original token, indices in `keluar` of their markers]
+    terbuka = []
+    pos = 0
+    panjang = len(teks)
+    while m is not None:
+        mulai = m.start()
+        if mulai > pos:
+            keluar.append(_escape_teks(teks[pos:mulai]))
+        token = m.group()
+        pos = m.end()
+
+        if token[0] == "`":
+            if token == "`":
+                akhir = teks.find("`", pos)
+                if akhir <= pos:
+                    keluar.append("\\`")  # Unmatched, or "``" which would be an empty entity
+                    m = _POLA_MARKUP_MARKDOWN_V2.search(teks, pos)
+                    continue
+            # Code may not be nested in other entities: close them around it and reopen after it
+            for entitas in reversed(terbuka):
+                _md_tutup_entitas(keluar, entitas)
+            if token == "`":
+                keluar.append(f"`{_escape_kode(teks[pos:akhir])}`")
+                pos = akhir + 1
+            else:
+                bahasa = _POLA_PAGAR_BAHASA.match(teks, pos)
+                if bahasa:
+                    pos = bahasa.end()
+                akhir = teks.find("```", pos)
+                if akhir < 0:
+                    akhir = panjang
+                bahasa = (bahasa.group(1) or "") if bahasa else ""
+                keluar.append(f"```{bahasa}\n{_escape_kode(teks[pos:akhir])}```")
+                pos = akhir + 3
+            for entitas in terbuka:
+                entitas[2].append(_md_tambah_penanda(keluar, entitas[0]))
+        else:
+            # Bold/italic/underline markers pair up like Markdown emphasis: an opener is followed by
+            # a non-space, a closer preceded by one, and '_' inside a word never counts
+            jenis = _JENIS_PENANDA[token]
+            sebelum = teks[mulai - 1] if mulai > 0 else " "
+            sesudah = teks[pos] if pos < panjang else " "
+            bisa_buka = not sesudah.isspace()
+            bisa_tutup = not sebelum.isspace()
+            if jenis[0] == "_" and sebelum.isalnum() and sesudah.isalnum():
+                bisa_buka = bisa_tutup = False
+            posisi = None
+            for i, entitas in enumerate(terbuka):
+                if entitas[0] == jenis:
+                    posisi = i
+                    break
+            if posisi is None and bisa_buka:
+                terbuka.append([jenis, token, [_md_tambah_penanda(keluar, jenis)]])
+            elif posisi == len(terbuka) - 1 and bisa_tutup:
+                _md_tutup_entitas(keluar, terbuka.pop())
+            else:
+                keluar.append(token.translate(_TABEL_ESCAPE_LITERAL))
+        m = _POLA_MARKUP_MARKDOWN_V2.search(teks, pos) if pos < panjang else None
+
+    if pos < panjang:
+        keluar.append(_escape_teks(teks[pos:]))
+    # Markers that were never closed are literal text after all
+    for jenis, token, indeks in terbuka:
+        keluar[indeks[0]] = token.translate(_TABEL_ESCAPE_LITERAL)
+        for i in indeks[1:]:
+            keluar[i] = ""
+    if "_" in teks:
+        keluar = _md_pisah_garis_bawah(keluar)
+    return "".join(keluar)
+
+def render_pesan_telegram(pesan_raw: str) -> tuple[str, str | None]:
+    """Returns (text, parse_mode) for a raw message: MarkdownV2, or plain text if rendering fails."""
+    try:
+        return format_pesan_markdown_v2(pesan_raw), ParseMode.MARKDOWN_V2
+    except Exception as e:
+        logger.warning(f"[Telegram] Could not render MarkdownV2 ({e}); sending as plain text.")
+        METRICS.tambah("telegram_markdown_fallback_total", reason="render")
+        return _teks_polos(pesan_raw), None
+
+# === Function: Split long messages for Telegram ===
+def pisah_pesan_telegram(pesan_raw: str, batas: int = TELEGRAM_MESSAGE_LIMIT, _konservatif: bool = False) -> list[str]:
+    """
+    Splits a raw message into parts whose MarkdownV2 rendering fits within `batas` characters.
+    Splits happen on line boundaries; a code block that spans a split is closed at the end
+    of one part and reopened with the same fence (e.g. ```log) at the start of the next.
+    Only lines that are too long on their own are cut mid-line.
+    """
+    # Escaping at most doubles plain text, so short messages need no further work
+    if len(pesan_raw) * 2 <= batas or (len(pesan_raw) <= batas and len(format_pesan_markdown_v2(pesan_raw)) <= batas):
+        return [pesan_raw]
+
+    bagian = []
+    baris_saat_ini = []
+    panjang = 0
+    pagar = None  # Opening fence of the code block we are in, if any
+
+    def tutup_bagian():
+        nonlocal baris_saat_ini, panjang
+        if pagar:
+            baris_saat_ini.append("```")
+        bagian.append("\n".join(baris_saat_ini))
+        baris_saat_ini = [pagar] if pagar else []
+        panjang = len(pagar) + 1 if pagar else 0
+
+    for baris in pesan_raw.split("\n"):
+        # Rendered cost of the line; text outside code blocks grows when escaped
+        # (code is sent verbatim; in conservative mode everything is costed as escaped text)
+        verbatim = pagar and not _konservatif
+        cadangan_pagar = 2 * len(pagar) + 8 if pagar else 0
+        ruang = batas - cadangan_pagar - 1
+        potongan = [baris]
+        if len(baris) * (1 if verbatim else 2) > ruang:
+            lebar = max(1, ruang if verbatim else ruang // 2)
+            potongan = [baris[i:i + lebar] for i in range(0, len(baris), lebar)] or [""]
+
+        for teks in potongan:
+            biaya = (len(teks) if verbatim else len(_escape_plaintext_markdown_v2(teks))) + 1
+            if baris_saat_ini and panjang + biaya + (8 if pagar else 0) > batas:
+                tutup_bagian()
+            baris_saat_ini.append(teks)
+            panjang += biaya
+
+        if baris.count("```") % 2 == 1:
+            pagar = None if pagar else baris[baris.rfind("```"):].strip()
+
+    if baris_saat_ini:
+        bagian.append("\n".join(baris_saat_ini))
+
+    hasil = []
+    for b in bagian:
+        if not b.strip():
+            continue
+        # Escaped backticks in code or repaired markup can still push a part over the limit; re-split those conservatively
+        if not _konservatif and len(format_pesan_markdown_v2(b)) > batas:
+            hasil.extend(pisah_pesan_telegram(b, batas, _konservatif=True))
+        else:
+            hasil.append(b)
+    return hasil
+
+# === Outbound Telegram send queue ===
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def waktu_tunggu(self) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        tunggu = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            tunggu = max(tunggu, (1 - self.tokens) / self.rate)
+        return tunggu
+
+    def ambil(self):
+        self.tokens -= 1
+
+    def tahan(self, detik: float):
+        """Blocks the bucket for `detik` seconds, e.g. after Telegram answered 429 Retry-After."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + detik)
+        self.tokens = 0.0
+
+def _detik_retry_after(e: RetryAfter) -> float:
+    # python-telegram-bot reports retry_after as int seconds or as a timedelta depending on version
+    retry_after = e.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+class TelegramSendQueue:
+    """
+    Central outbound queue for Telegram messages. Each chat has its own FIFO drained by one
+    worker task, so messages keep their order; every send takes a token from the chat's bucket
+    and from the global bucket. A queued text message is merged into the previous queued one
+    for the same chat when both fit into a single message. 429 answers pause the chat for the
+    advised Retry-After, MarkdownV2 rejections are resent as plain text, network errors are
+    retried TELEGRAM_SEND_MAX_RETRIES times; anything else is dropped and counted.
+    """
+
+    def __init__(self, chat_rate: float = TELEGRAM_CHAT_RATE, chat_burst: int = TELEGRAM_CHAT_BURST,
+                 global_rate: float = TELEGRAM_GLOBAL_RATE, global_burst: int = TELEGRAM_GLOBAL_BURST,
+                 max_depth: int = TELEGRAM_SEND_QUEUE_MAX, max_retries: int = TELEGRAM_SEND_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        # Room for the in-flight head plus at least one pending message
+        self.max_depth = max(2, max_depth)
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self._chat_buckets = {}
+        self._antrean = {}
+        self._pekerja = {}
+        self.stats = Counter()
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def ambil_token(self, chat_id: int):
+        """Waits until both the chat's bucket and the global bucket allow one more request."""
+        buckets = (self._bucket(chat_id), self.global_bucket)
+        while True:
+            tunggu = max(bucket.waktu_tunggu() for bucket in buckets)
+            if tunggu <= 0:
+                for bucket in buckets:
+                    bucket.ambil()
+                return
+            await asyncio.sleep(tunggu)
+
+    def tahan(self, chat_id: int, detik: float):
+        """Pauses all traffic to a chat, including streamed edits, for `detik` seconds."""
+        self.stats["rate_limited"] += 1
+        self._bucket(chat_id).tahan(detik)
+        logger.warning(f"[Telegram] ⚠ Flood limit for {chat_id}; pausing sends for {detik:.1f}s.")
+
+    def kedalaman(self, chat_id: int = None) -> int:
+        """Number of queued messages for one chat, or across all chats."""
+        if chat_id is not None:
+            return len(self._antrean.get(chat_id, ()))
+        return sum(len(antrean) for antrean in self._antrean.values())
+
+    def kirim(self, bot, chat_id: int, pesan_raw: str, reply_markup=None):
+        """Queues a raw (unrendered) message part and returns immediately."""
+        antrean = self._antrean.setdefault(chat_id, deque())
+        self.stats["enqueued"] += 1
+        # The head may already be in flight, so only a later entry can absorb new text;
+        # a message with buttons is never merged, so its buttons stay under its own text
+        if (len(antrean) > 1 and antrean[-1]["bot"] is bot and antrean[-1]["markdown"]
+                and reply_markup is None and antrean[-1]["reply_markup"] is None):
+            gabungan = antrean[-1]["raw"] + "\n" + pesan_raw
+            if len(format_pesan_markdown_v2(gabungan)) <= TELEGRAM_MESSAGE_LIMIT:
+                antrean[-1]["raw"] = gabungan
+                self.stats["coalesced"] += 1
+                self._mulai_pekerja(chat_id)
+                return
+        if len(antrean) >= self.max_depth and len(antrean) > 1:
+            # Keep the newest output; the in-flight head is never dropped
+            del antrean[1]
+            self.stats["dropped"] += 1
+            self.stats["dropped_overflow"] += 1
+            if self.stats["dropped_overflow"] % 100 == 1:
+                logger.warning(f"[Telegram] ⚠ Send queue for {chat_id} is full; dropping the oldest pending messages ({self.stats['dropped_overflow']} so far).")
+        antrean.append({"bot": bot, "raw": pesan_raw, "markdown": True, "reply_markup": reply_markup, "attempts": 0, "queued_at": time.perf_counter()})
+        self.stats["max_depth"] = max(self.stats["max_depth"], len(antrean))
+        self._mulai_pekerja(chat_id)
+
+    def _mulai_pekerja(self, chat_id: int):
+        pekerja = self._pekerja.get(chat_id)
+        loop = asyncio.get_running_loop()
+        if pekerja is None or pekerja.done() or pekerja.get_loop() is not loop:
+            self._pekerja[chat_id] = loop.create_task(self._kuras(chat_id))
+
+    async def _kuras(self, chat_id: int):
+        antrean = self._antrean[chat_id]
+        while antrean:
+            await self.ambil_token(chat_id)
+            if await self._kirim_satu(chat_id, antrean[0]):
+                antrean.popleft()
+
+    async def _kirim_satu(self, chat_id: int, item: dict) -> bool:
+        """Sends one queued message. Returns False if it should be attempted again."""
+        try:
+            with METRICS.span("telegram_send_seconds", kind="send"):
+                if item["markdown"]:
+                    teks, parse_mode = render_pesan_telegram(item["raw"])
+                    await item["bot"].send_message(chat_id=chat_id, text=teks, parse_mode=parse_mode, reply_markup=item["reply_markup"])
+                else:
+                    await item["bot"].send_message(chat_id=chat_id, text=_teks_polos(item["raw"]), reply_markup=item["reply_markup"])
+            METRICS.amati("telegram_queue_wait_seconds", time.perf_counter() - item["queued_at"])
+            self.stats["sent"] += 1
+            logger.info(f"[Telegram] Notification successfully sent to {chat_id}.")
+            return True
+        except RetryAfter as e:
+            self.tahan(chat_id, _detik_retry_after(e))
+            return False
+        except BadRequest as e:
+            if item["markdown"]:
+                logger.warning(f"[Telegram] Message rejected ({e}). Retrying as plain text.")
+                item["markdown"] = False
+                self.stats["plain_fallback"] += 1
+                return False
+            logger.error(f"[Telegram] 🔴 Failed to send message to Telegram: {e}")
+        except NetworkError as e:
+            item["attempts"] += 1
+            if item["attempts"] <= self.max_retries:
+                self.stats["retried"] += 1
+                logger.warning(f"[Telegram] Network error ({e}); retry {item['attempts']}/{self.max_retries}.")
+                await asyncio.sleep(min(2 ** item["attempts"], 30))
+                return False
+            logger.error(f"[Telegram] 🔴 Failed to send message to Telegram after {self.max_retries} retries: {e}")
+        except Exception as e:
+            logger.error(f"[Telegram] 🔴 Failed to send message to Telegram: {e}")
+        self.stats["dropped"] += 1
+        return True
+
+    async def tunggu_kosong(self, chat_id: int = None, timeout: float = None):
+        """Waits until the queue of one chat (or of every chat) has been delivered."""
+        loop = asyncio.get_running_loop()
+        pekerja = [self._pekerja.get(chat_id)] if chat_id is not None else list(self._pekerja.values())
+        pekerja = [p for p in pekerja if p is not None and not p.done() and p.get_loop() is loop]
+        if pekerja:
+            await asyncio.wait(pekerja, timeout=timeout)
+
+    def ringkasan(self) -> dict:
+        """Counters for /queue_stats."""
+        return {
+            "depth": self.kedalaman(),
+            "chats": len(self._antrean),
+            "enqueued": self.stats["enqueued"],
+            "sent": self.stats["sent"],
+            "coalesced": self.stats["coalesced"],
+            "retried": self.stats["retried"],
+            "rate_limited": self.stats["rate_limited"],
+            "plain_fallback": self.stats["plain_fallback"],
+            "dropped": self.stats["dropped"],
+            "dropped_overflow": self.stats["dropped_overflow"],
+            "max_depth": self.stats["max_depth"],
+        }
+
+TELEGRAM_SEND_QUEUE = TelegramSendQueue()
+
 # === Function: Send Telegram notification ===
-async def kirim_ke_telegram(chat_id: int, context: CallbackContext, pesan_raw: str):
+async def kirim_ke_telegram(chat_id: int, context: CallbackContext, pesan_raw: str, reply_markup=None):
     """
-    Sends a message to Telegram. Removes ANSI colors and applies MarkdownV2 escaping
-    to the entire message content, specifically handling code blocks by not escaping their internal content.
+    Queues a message for Telegram, rendered with format_pesan_markdown_v2 when it is sent.
+    Messages longer than Telegram's limit are sent as several parts; `reply_markup` (e.g. an
+    inline keyboard) is attached to the last part. Returns without waiting for delivery;
+    see TelegramSendQueue.
     """
     if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
         logger.warning(f"[Telegram] ⚠ Telegram BOT Token or Chat ID not found. Notification not sent.")
         return
 
-    # Remove ANSI color codes first
-    pesan_bersih_tanpa_ansi = re.sub(r'\033\[[0-9;]*m', '', pesan_raw)
-    
-    final_message_parts = []
-    
-    # 1. Separate by multiline code blocks (```)
-    multiline_split = re.split(r'(```(?:\w+)?\n.*?```)', pesan_bersih_tanpa_ansi, flags=re.DOTALL)
-    
-    for ml_part in multiline_split:
-        if ml_part.startswith('```') and ml_part.endswith('```'):
-            # This is a multiline code block, add as is (content inside is not escaped)
-            final_message_parts.append(ml_part)
-        else:
-            # This is a text part outside multiline code blocks, now check for inline code blocks (`)
-            inline_split = re.split(r'(`[^`]+`)', ml_part) # Capture `...`
-            for il_part in inline_split:
-                if il_part.startswith('`') and il_part.endswith('`'):
-                    # This is an inline code block, add as is (content inside is not escaped)
-                    final_message_parts.append(il_part)
-                else:
-                    # This is plain text, apply MarkdownV2 escaping using the new function
-                    final_message_parts.append(_escape_plaintext_markdown_v2(il_part))
-            
-    pesan_final = "".join(final_message_parts)
+    bagian = pisah_pesan_telegram(pesan_raw)
+    for i, pesan_bagian in enumerate(bagian):
+        TELEGRAM_SEND_QUEUE.kirim(context.bot, chat_id, pesan_bagian, reply_markup if i == len(bagian) - 1 else None)
+
+# === Function: Batch shell output into log messages ===
+class ShellOutputBatcher:
+    """
+    Collects shell output lines and sends them as ```log messages. A batch is flushed
+    by whichever comes first: `max_bytes` of pending output, the oldest pending line
+    being `max_latency` seconds old, or an explicit flush() (e.g. at process exit).
+    Flushes are serialized so batches always arrive in order.
+    When a command prints faster than a chat can receive, size-triggered flushes are held
+    to one per `max_latency` and only the newest two batches' worth of lines is kept; the
+    message says how many lines were skipped (the full tail stays in the output buffer).
+    Trimming keeps one batch, so it runs at most once per `max_bytes` of new output.
+    """
+
+    def __init__(self, chat_id: int, context: CallbackContext, max_bytes: int = SHELL_LOG_BATCH_BYTES, max_latency: float = SHELL_LOG_FLUSH_INTERVAL):
+        self.chat_id = chat_id
+        self.context = context
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+        self._pending = []
+        self._pending_bytes = 0
+        self._skipped = 0
+        self._last_flush = 0.0
+        self._timer = None
+        self._lock = asyncio.Lock()
+
+    async def add(self, lines: list):
+        """Queues lines; flushes right away once the byte budget is reached."""
+        self._pending.extend(lines)
+        gabungan = "\n".join(lines)
+        self._pending_bytes += (len(gabungan) if gabungan.isascii() else len(gabungan.encode("utf-8", "replace"))) + 1
+        if self._pending_bytes > 2 * self.max_bytes:
+            self._potong()
+        if self._pending_bytes >= self.max_bytes and time.monotonic() - self._last_flush >= self.max_latency:
+            await self.flush()
+        elif self._pending and self._timer is None:
+            self._timer = asyncio.create_task(self._flush_setelah_jeda())
+
+    def _potong(self):
+        """Keeps only the newest lines that fit into one batch, walking back from the end."""
+        simpan = []
+        total = 0
+        for line in reversed(self._pending):
+            size = (len(line) if line.isascii() else len(line.encode("utf-8", "replace"))) + 1
+            if total + size > self.max_bytes and simpan:
+                break
+            simpan.append(line)
+            total += size
+        self._skipped += len(self._pending) - len(simpan)
+        simpan.reverse()
+        self._pending = simpan
+        self._pending_bytes = total
+
+    async def _flush_setelah_jeda(self):
+        await asyncio.sleep(self.max_latency)
+        # Cleared before flushing so flush() does not cancel the task that is sending
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        """Sends everything pending as one log message (split by kirim_ke_telegram if needed)."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        async with self._lock:
+            if not self._pending:
+                return
+            isi_log = "\n".join(self._pending)
+            if self._skipped:
+                isi_log = f"[… {self._skipped} lines skipped …]\n{isi_log}"
+            self._pending = []
+            self._pending_bytes = 0
+            self._skipped = 0
+            self._last_flush = time.monotonic()
+            await kirim_ke_telegram(self.chat_id, self.context, f"```log\n{isi_log}\n```")
+
+# === Function: Stream text into a single, progressively edited Telegram message ===
+def _tutup_markdown_parsial(teks: str) -> str:
+    """Closes a code block left open by a partially streamed answer so it renders as code."""
+    if teks.count("```") % 2 == 1:
+        return teks + "\n```"
+    return teks
+
+class TelegramStreamMessage:
+    """
+    Shows an LLM answer while it is being generated. The first fragment creates
+    the message; later fragments edit it at most once per TELEGRAM_STREAM_EDIT_INTERVAL.
+    `formatter` turns the accumulated raw text into the message shown to the user.
+    """
+
+    def __init__(self, chat_id: int, context: CallbackContext, formatter: Callable[[str], str] = None, edit_interval: float = TELEGRAM_STREAM_EDIT_INTERVAL):
+        self.chat_id = chat_id
+        self.context = context
+        self.formatter = formatter or (lambda teks: teks)
+        self.edit_interval = edit_interval
+        self.teks = ""
+        self.message_id = None
+        self._teks_terkirim = None
+        self._last_edit = 0.0
+        self._edit_task = None
+
+    async def on_delta(self, delta: str):
+        """Stream callback for call_llm_async: accumulates text and schedules a throttled edit."""
+        self.teks += delta
+        if self._edit_task is not None and not self._edit_task.done():
+            return
+        if self.message_id is not None and time.monotonic() - self._last_edit < self.edit_interval:
+            return
+        self._edit_task = asyncio.create_task(self._tampilkan(_tutup_markdown_parsial(self.formatter(self.teks))))
+
+    async def _tampilkan(self, pesan_raw: str) -> bool:
+        """Sends or edits the message; falls back to plain text if MarkdownV2 is rejected."""
+        self._last_edit = time.monotonic()
+        # Keep the visible part within Telegram's limit; the full text is delivered by finish()
+        if len(pesan_raw) > TELEGRAM_MESSAGE_LIMIT - 200:
+            pesan_raw = "…" + pesan_raw[-(TELEGRAM_MESSAGE_LIMIT - 200):]
+        if pesan_raw == self._teks_terkirim:
+            return True
+        if self.message_id is None:
+            # Appear after the status messages that were queued before the answer started
+            await TELEGRAM_SEND_QUEUE.tunggu_kosong(self.chat_id)
+        await TELEGRAM_SEND_QUEUE.ambil_token(self.chat_id)
+        for teks, parse_mode in (render_pesan_telegram(pesan_raw), (_teks_polos(pesan_raw), None)):
+            try:
+                with METRICS.span("telegram_send_seconds", kind="stream"):
+                    if self.message_id is None:
+                        message = await self.context.bot.send_message(chat_id=self.chat_id, text=teks, parse_mode=parse_mode)
+                        self.message_id = message.message_id
+                    else:
+                        await self.context.bot.edit_message_text(chat_id=self.chat_id, message_id=self.message_id, text=teks, parse_mode=parse_mode)
+                self._teks_terkirim = pesan_raw
+                return True
+            except RetryAfter as e:
+                # Skip this edit; the next delta or finish() shows the text once the pause is over
+                TELEGRAM_SEND_QUEUE.tahan(self.chat_id, _detik_retry_after(e))
+                return False
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    return True
+                logger.warning(f"[Telegram] Stream edit rejected ({e}). Retrying as plain text.")
+            except TelegramError as e:
+                logger.error(f"[Telegram] 🔴 Failed to update streamed message: {e}")
+                return False
+        return False
 
-    try:
-        await context.bot.send_message(chat_id=chat_id, text=pesan_final, parse_mode=ParseMode.MARKDOWN_V2)
-        logger.info(f"[Telegram] Notification successfully sent to {chat_id}.")
-    except Exception as e:
-        logger.error(f"[Telegram] 🔴 Failed to send message to Telegram: {e}")
+    async def finish(self, pesan_akhir_raw: str = None):
+        """
+        Waits for any in-flight edit and shows the final text. If the final text does not fit
+        into a single message, the streamed message is removed and the text is sent normally.
+        """
+        if self._edit_task is not None:
+            await asyncio.gather(self._edit_task, return_exceptions=True)
+        pesan_akhir_raw = pesan_akhir_raw if pesan_akhir_raw is not None else self.formatter(self.teks)
+        if len(format_pesan_markdown_v2(pesan_akhir_raw)) <= TELEGRAM_MESSAGE_LIMIT and await self._tampilkan(pesan_akhir_raw):
+            return
+        if self.message_id is not None:
+            try:
+                await TELEGRAM_SEND_QUEUE.ambil_token(self.chat_id)
+                await self.context.bot.delete_message(chat_id=self.chat_id, message_id=self.message_id)
+            except TelegramError as e:
+                logger.warning(f"[Telegram] Could not remove streamed message: {e}")
+            self.message_id = None
+        await kirim_ke_telegram(self.chat_id, self.context, pesan_akhir_raw)
 
 # === Function: Detect shell commands in AI suggestions ===
 def deteksi_perintah_shell(saran_ai: str) -> str | None:
@@ -653,243 +3076,1023 @@ def is_command_dangerous(command: str) -> bool:
             return True
     return False
 
+# === Async pty output reader ===
+class PtyLineReader:
+    """
+    Reads a spawned child's pty without a thread hop per line: the fd is registered
+    with the event loop (loop.add_reader) and drained in large chunks. Output is
+    decoded incrementally and split into lines; carriage-return rewrites (progress
+    bars) collapse to the final state of the line. Reading pauses while more than
+    `max_buffer` bytes are waiting, so a fast producer cannot grow memory unbounded.
+    `byte_dibaca` counts the raw bytes read so far, before decoding.
+    """
+
+    def __init__(self, fd: int, chunk_size: int = 65536, max_buffer: int = 1024 * 1024, max_line: int = 64 * 1024):
+        self.fd = fd
+        self.chunk_size = chunk_size
+        self.max_buffer = max_buffer
+        self.max_line = max_line
+        self._loop = asyncio.get_running_loop()
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._buffer = bytearray()
+        self._partial = ""
+        self.byte_dibaca = 0
+        self._eof = False
+        self._reading = False
+        self._data_ready = asyncio.Event()
+        self._mulai_baca()
+
+    def _mulai_baca(self):
+        if not self._reading and not self._eof:
+            self._loop.add_reader(self.fd, self._saat_siap_dibaca)
+            self._reading = True
+
+    def _berhenti_baca(self):
+        if self._reading:
+            self._loop.remove_reader(self.fd)
+            self._reading = False
+
+    def _saat_siap_dibaca(self):
+        try:
+            data = os.read(self.fd, self.chunk_size)
+        except BlockingIOError:
+            return
+        except OSError:
+            # Linux reports EIO on the master side once the child closed the pty
+            data = b""
+        if data:
+            self._buffer += data
+            if len(self._buffer) >= self.max_buffer:
+                self._berhenti_baca()
+        else:
+            self._eof = True
+            self._berhenti_baca()
+        self._data_ready.set()
+
+    @staticmethod
+    def _baris_final(baris: str) -> str:
+        """Keeps what a terminal would show after '\r' rewrites."""
+        if "\r" in baris:
+            segmen = [seg for seg in baris.split("\r") if seg]
+            return segmen[-1] if segmen else ""
+        return baris
+
+    async def read_lines(self) -> list | None:
+        """
+        Waits for output and returns every complete line available (possibly an empty list
+        when only part of a line arrived). Returns None once the child closed its output.
+        """
+        while not self._buffer and not self._eof:
+            self._data_ready.clear()
+            await self._data_ready.wait()
+
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        self._mulai_baca()
+        self.byte_dibaca += len(data)
+
+        teks = self._partial + self._decoder.decode(data, final=self._eof)
+        bagian = teks.replace("\r\n", "\n").split("\n")
+        self._partial = bagian.pop()
+        if self._eof:
+            if self._partial:
+                bagian.append(self._partial)
+            self._partial = ""
+        elif len(self._partial) > self.max_line:
+            # An endless line without newline: emit it rather than buffering forever
+            bagian.append(self._partial)
+            self._partial = ""
+        else:
+            # Drop rewritten progress states early, keeping a trailing '\r' that may start a CRLF
+            potong = self._partial.rfind("\r", 0, len(self._partial) - 1)
+            if potong >= 0:
+                self._partial = self._partial[potong + 1:]
+
+        if self._eof and not bagian:
+            return None
+        return [self._baris_final(b) for b in bagian]
+
+    def close(self):
+        self._berhenti_baca()
+
+# === Error detection engine ===
+# kind:  "start"   opens an error block (e.g. a traceback header)
+#        "end"     closes the open block of the same language, or is a one-line block by itself
+#        "line"    a one-line error, or part of an open block
+#        "context" only extends an open block (stack frames, source excerpts)
+# scope: "any" applies to every command, "program" only to running a script (python x.py, ./x.sh, ...)
+ATURAN_ERROR_BAWAAN = [
+    {"name": "python_traceback", "language": "python", "kind": "start", "pattern": r"^Traceback \(most recent call last\):"},
+    {"name": "python_frame", "language": "python", "kind": "context", "pattern": r'^File ".+", line \d+'},
+    {"name": "python_exception", "language": "python", "kind": "end", "pattern": r"^(?:[A-Za-z_]\w*\.)*[A-Z]\w*(?:Error|Exception|Interrupt|Exit)(?::|$)"},
+    {"name": "pip_error", "language": "python", "kind": "line", "pattern": r"^ERROR: "},
+    {"name": "node_location", "language": "javascript", "kind": "start", "pattern": r"^\S+\.[cm]?[jt]s:\d+$"},
+    {"name": "node_error", "language": "javascript", "kind": "line", "pattern": r"^(?:Uncaught )?(?:[A-Z]\w*)?Error(?: \[\w+\])?: "},
+    {"name": "node_frame", "language": "javascript", "kind": "context", "pattern": r"^at .+:\d+:\d+\)?$"},
+    {"name": "node_version", "language": "javascript", "kind": "end", "pattern": r"^Node\.js v\d+"},
+    {"name": "gcc_diagnostic", "language": "c", "kind": "line", "pattern": r"^[^\s:]+:\d+:\d+: (?:fatal )?error: "},
+    {"name": "gcc_excerpt", "language": "c", "kind": "context", "pattern": r"^\d* *\| "},
+    {"name": "linker_error", "language": "c", "kind": "line", "pattern": r"^collect2: error|undefined reference to [`']"},
+    {"name": "make_error", "language": "c", "kind": "line", "pattern": r"^make(?:\[\d+\])?: \*\*\* "},
+    {"name": "npm_error", "language": "npm", "kind": "line", "pattern": r"^npm (?:ERR!|error) "},
+    {"name": "command_not_found", "language": "shell", "kind": "line", "pattern": r": command not found$"},
+    {"name": "segfault", "language": "shell", "kind": "line", "pattern": r"Segmentation fault|\(core dumped\)"},
+    {"name": "generic_keyword", "language": "generic", "kind": "line", "scope": "program", "ignore_case": True,
+     "pattern": r"error|exception|not found|failed|permission denied|no such file or directory|segmentation fault|fatal"},
+]
+
+def muat_aturan_error(path: str = ERROR_RULES_PATH) -> list:
+    """Built-in rules plus the rules from ERROR_RULES_PATH, if that file exists."""
+    aturan = list(ATURAN_ERROR_BAWAAN)
+    if path and os.path.exists(path):
+        try:
+            with open(path) as f:
+                tambahan = json.load(f)
+            if not isinstance(tambahan, list):
+                raise ValueError("expected a JSON list of rules")
+            aturan.extend(tambahan)
+            logger.info(f"[ErrorRules] Loaded {len(tambahan)} rule(s) from {path}.")
+        except (OSError, ValueError) as e:
+            logger.warning(f"[ErrorRules] ⚠ Could not read {path}: {e}. Using built-in rules only.")
+    return aturan
+
+def _cabang_tingkat_atas(pola: str) -> list:
+    """Splits a pattern on the '|' characters that are outside any group or character class."""
+    cabang = []
+    awal = 0
+    kedalaman = 0
+    dalam_kelas = False
+    i = 0
+    while i < len(pola):
+        ch = pola[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if dalam_kelas:
+            dalam_kelas = ch != "]"
+        elif ch == "[":
+            dalam_kelas = True
+        elif ch == "(":
+            kedalaman += 1
+        elif ch == ")":
+            kedalaman -= 1
+        elif ch == "|" and kedalaman == 0:
+            cabang.append(pola[awal:i])
+            awal = i + 1
+        i += 1
+    cabang.append(pola[awal:])
+    return cabang
+
+def _literal_saja(cabang: list) -> bool:
+    """True if every alternative is a plain word or phrase (e.g. 'error|failed')."""
+    return all(c and all(ch.isalnum() or ch in " _-:'!,/" for ch in c) for c in cabang)
+
+class MesinDeteksiError:
+    """
+    Compiles every error rule once, split into its top-level alternatives and grouped by how
+    each can be searched fastest: plain keyword lists are found with str.find, alternatives
+    anchored at a line start are searched with a leading newline, and the rest as they are.
+    Almost every alternative then starts with a literal ("\nTraceback", "undefined reference")
+    that the regex engine locates with a fast substring search; on multi-MB logs this beats
+    one combined alternation, which has to try every branch at every position.
+    A batch of output is scanned as a whole, never line by line. Invalid rules are logged and skipped.
+    """
+
+    def __init__(self, aturan: list):
+        self.aturan = []
+        for rule in aturan:
+            try:
+                if rule.get("kind", "line") not in ("start", "end", "line", "context"):
+                    raise ValueError(f"unknown kind {rule.get('kind')!r}")
+                re.compile(rule["pattern"])
+            except (KeyError, TypeError, AttributeError, ValueError, re.error) as e:
+                logger.warning(f"[ErrorRules] ⚠ Skipping invalid rule {rule!r}: {e}")
+                continue
+            self.aturan.append({"kind": "line", "scope": "any", "language": "generic", "ignore_case": False, "name": f"rule{len(self.aturan)}", **rule})
+        self._pemindai = {program: self._kompilasi(program) for program in (False, True)}
+
+    def _kompilasi(self, program: bool) -> list:
+        pemindai = []
+        for i, rule in enumerate(self.aturan):
+            if rule["scope"] == "program" and not program:
+                continue
+            huruf_kecil = rule["ignore_case"]
+            cabang = _cabang_tingkat_atas(rule["pattern"])
+            if _literal_saja(cabang):
+                pemindai.append(("literal", i, [c.lower() for c in cabang] if huruf_kecil else cabang))
+                continue
+            flag = re.MULTILINE | (re.IGNORECASE if huruf_kecil else 0)
+            for pola in cabang:
+                if pola.startswith("^"):
+                    pemindai.append(("berjangkar", i, re.compile("\n(?:" + pola[1:] + ")", flag)))
+                else:
+                    pemindai.append(("regex", i, re.compile(pola, flag)))
+        return pemindai
+
+    @staticmethod
+    def _posisi_ke_baris(teks: str, posisi: list) -> list:
+        """Maps ascending character positions to line indexes with one incremental count."""
+        hasil = []
+        baris = 0
+        terakhir = 0
+        for pos in posisi:
+            baris += teks.count("\n", terakhir, pos)
+            terakhir = pos
+            hasil.append(baris)
+        return hasil
+
+    def pindai(self, teks: str, program: bool = False) -> list:
+        """Returns (line index within teks, rule) for the first rule (in rule order) matching each line."""
+        temuan = {}
+        teks_kecil = None
+        sumber_berjangkar = None
+        for jenis, i, data in self._pemindai[program]:
+            if jenis == "literal":
+                if self.aturan[i]["ignore_case"] and teks_kecil is None:
+                    teks_kecil = teks.lower()
+                sumber = teks_kecil if self.aturan[i]["ignore_case"] else teks
+                posisi = []
+                for kata in data:
+                    pos = sumber.find(kata)
+                    while pos != -1:
+                        posisi.append(pos)
+                        # One hit per line is enough
+                        akhir_baris = sumber.find("\n", pos)
+                        if akhir_baris == -1:
+                            break
+                        pos = sumber.find(kata, akhir_baris)
+                posisi.sort()
+            else:
+                if jenis == "berjangkar":
+                    if sumber_berjangkar is None:
+                        sumber_berjangkar = "\n" + teks
+                    sumber = sumber_berjangkar
+                else:
+                    sumber = teks
+                posisi = [m.start() for m in data.finditer(sumber)]
+            for baris in self._posisi_ke_baris(sumber, posisi):
+                if baris not in temuan or i < temuan[baris]:
+                    temuan[baris] = i
+        return [(baris, self.aturan[i]) for baris, i in sorted(temuan.items())]
+
+class DetektorError:
+    """
+    Per-command state on top of MesinDeteksiError: turns rule hits into error blocks with
+    start/end line numbers (counted from the start of the command, like OutputRingBuffer).
+    A block closes on an "end" rule, after `jeda_maks` lines without a matching line, or at EOF.
+    """
+
+    def __init__(self, mesin: MesinDeteksiError, program: bool = False, jeda_maks: int = 4):
+        self.mesin = mesin
+        self.program = program
+        self.jeda_maks = jeda_maks
+        self.baris_ke = 0
+        self._terbuka = None
+
+    def _blok(self, rule: dict, start: int, end: int) -> dict:
+        return {"rule": rule["name"], "language": rule["language"], "start": start, "end": end}
+
+    def feed(self, lines: list) -> list:
+        """Scans a batch of lines; returns the blocks completed within it."""
+        selesai = []
+        awal = self.baris_ke
+        for indeks, rule in self.mesin.pindai("\n".join(lines), self.program):
+            nomor = awal + indeks
+            terbuka = self._terbuka
+            if terbuka and nomor - terbuka["end"] > self.jeda_maks:
+                selesai.append(terbuka)
+                terbuka = self._terbuka = None
+            kind = rule["kind"]
+            if terbuka:
+                if kind == "start" and rule["language"] != terbuka["language"]:
+                    selesai.append(terbuka)
+                    self._terbuka = self._blok(rule, nomor, nomor)
+                    continue
+                terbuka["end"] = nomor
+                if kind == "end" and rule["language"] == terbuka["language"]:
+                    selesai.append(terbuka)
+                    self._terbuka = None
+            elif kind == "start":
+                self._terbuka = self._blok(rule, nomor, nomor)
+            elif kind in ("end", "line"):
+                selesai.append(self._blok(rule, nomor, nomor))
+        self.baris_ke += len(lines)
+        if self._terbuka and self.baris_ke - 1 - self._terbuka["end"] > self.jeda_maks:
+            selesai.append(self._terbuka)
+            self._terbuka = None
+        return selesai
+
+    def selesai(self) -> list:
+        """Closes a block still open when the command exits."""
+        terbuka, self._terbuka = self._terbuka, None
+        return [terbuka] if terbuka else []
+
+ERROR_DETECTION_ENGINE = MesinDeteksiError(muat_aturan_error())
+
+_POLA_EKSEKUSI_PROGRAM = re.compile(r"^(python|sh|bash|node|\./)\s+\S+\.(py|sh|js|rb|pl|php)", re.IGNORECASE)
+
+# === Resource limits for spawned commands ===
+_RLIMIT_NAMA = {"cpu": "RLIMIT_CPU", "as": "RLIMIT_AS", "data": "RLIMIT_DATA", "nofile": "RLIMIT_NOFILE", "fsize": "RLIMIT_FSIZE"}
+
+def buat_preexec_batas(batas: dict):
+    """
+    Returns a preexec_fn for pexpect.spawn that applies the setrlimit part of `batas` in the
+    child before exec, or None if there is nothing to apply. Limits are clamped to the current
+    hard limits. The CPU hard limit sits a few seconds above the soft one, so the process first
+    gets SIGXCPU and a chance to exit cleanly.
+    """
+    if resource is None:
+        return None
+    rlimits = []
+    for kunci, nama in _RLIMIT_NAMA.items():
+        nilai = int(batas.get(kunci) or 0)
+        if nilai > 0 and hasattr(resource, nama):
+            rlimits.append((getattr(resource, nama), nilai, nilai + 5 if kunci == "cpu" else nilai))
+    if not rlimits:
+        return None
+
+    def preexec():
+        # Runs in the forked child: no logging, no exceptions for limits the system will not take
+        for rlimit, lunak, keras in rlimits:
+            try:
+                _, keras_sekarang = resource.getrlimit(rlimit)
+                if keras_sekarang != resource.RLIM_INFINITY:
+                    keras = min(keras, keras_sekarang)
+                    lunak = min(lunak, keras)
+                resource.setrlimit(rlimit, (lunak, keras))
+            except (ValueError, OSError):
+                pass
+    return preexec
+
+def _grup_hidup(child) -> bool:
+    """True while the child or anything left in its process group is still running."""
+    child.isalive()  # Reaps the group leader once it has exited
+    try:
+        os.killpg(child.pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+async def hentikan_grup_proses(child, grace: float = SHELL_KILL_GRACE):
+    """
+    Stops a spawned command and everything it started: SIGTERM to its process group (the pty
+    makes the child a session leader), then SIGKILL if anything is left after `grace` seconds.
+    Never blocks the event loop.
+    """
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(child.pid, sig)
+        except ProcessLookupError:
+            return
+        except PermissionError:
+            child.kill(sig)
+        batas_waktu = time.monotonic() + grace
+        while time.monotonic() < batas_waktu:
+            if not _grup_hidup(child):
+                return
+            await asyncio.sleep(0.1)
+        if sig == signal.SIGTERM:
+            logger.warning(f"[Shell] ⚠ Process group {child.pid} ignored SIGTERM for {grace:.0f}s; sending SIGKILL.")
+
+def _format_byte(n: float) -> str:
+    for satuan in ("B", "KiB", "MiB", "GiB"):
+        if n < 1024 or satuan == "GiB":
+            return f"{n:.0f} {satuan}"
+        n /= 1024
+
+def alasan_dari_sinyal(signalstatus: int | None, batas: dict) -> str | None:
+    """Explains a signal death that was caused by a resource limit."""
+    if signalstatus == signal.SIGXCPU:
+        return f"CPU time limit of {batas.get('cpu', 0):.0f}s exceeded"
+    if signalstatus == signal.SIGXFSZ:
+        return f"file size limit of {_format_byte(batas.get('fsize', 0))} exceeded"
+    if signalstatus == signal.SIGKILL and batas.get("cpu"):
+        return f"killed (SIGKILL), possibly after exceeding the CPU time limit of {batas['cpu']:.0f}s or running out of memory"
+    return None
+
 # === Mode Function: Shell Observation and Error Correction (for Telegram) ===
-async def run_shell_observer_telegram(command_to_run: str, update: Update, context: CallbackContext):
+async def run_shell_observer_telegram(command_to_run: str, update: Update, context: CallbackContext, job: "ShellJob" = None):
     """
     Runs a shell command, monitors output, and sends logs/error suggestions to Telegram.
-    Non-interactive.
+    Non-interactive. When run as a background `job`, output is kept in the job's own buffer
+    and only published to the chat context when an error is found or the command ends; a failed
+    program run then asks whether to debug it (tanya_debug_job).
     """
     chat_id = update.effective_chat.id
     user_context = get_user_context(chat_id)
-    user_context["last_command_run"] = command_to_run
-    user_context["full_error_output"] = []
-    
-    telegram_log_buffer = [] 
-    async def send_telegram_chunk():
-        nonlocal telegram_log_buffer
-        if telegram_log_buffer:
-            # This is formatted as a code block with 'log' tag
-            escaped_log_content = "\n".join(telegram_log_buffer)
-            # Since _escape_plaintext_markdown_v2 doesn't escape *, we need to manually
-            # add asterisks for formatting here if desired.
-            # However, for logs, leave it as is and Telegram will display it as a code block.
-            message = f"```log\n{escaped_log_content}\n```" 
-            await kirim_ke_telegram(chat_id, context, message)
-            telegram_log_buffer = []
+    output = job.output if job else OutputRingBuffer()
+    label = f"[job #{job.id}] " if job else ""
+
+    def publikasikan_konteks():
+        # Several jobs may run in one chat; the most recent error/exit owns the debug context
+        user_context["last_command_run"] = command_to_run
+        user_context["full_error_output"] = output
+
+    publikasikan_konteks()
+    user_context["last_error_log"] = None
+    log_batcher = ShellOutputBatcher(chat_id, context)
 
     # Initial message when running the command. Command_to_run is inserted directly into backticks.
-    await kirim_ke_telegram(chat_id, context, f"*⚙️ SHELL* Starting command: `{command_to_run}`")
+    await kirim_ke_telegram(chat_id, context, f"*⚙️ SHELL* {label}Starting command: `{command_to_run}`")
     logger.info(f"\n{COLOR_BLUE}[Shell] 🟢 Running command: `{command_to_run}`{COLOR_RESET}\n")
 
     # shlex.quote is only used to safely run the command in the shell, not for Markdown display.
     safe_command_to_run = shlex.quote(command_to_run)
 
+    batas = SHELL_LIMITS
+    mulai_perintah = time.perf_counter()
     try:
-        child = pexpect.spawn(f"bash -c {safe_command_to_run}", encoding='utf-8', timeout=None)
+        with METRICS.span("shell_spawn_seconds"):
+            child = pexpect.spawn(f"bash -c {safe_command_to_run}", encoding='utf-8', timeout=None, preexec_fn=buat_preexec_batas(batas))
     except pexpect.exceptions.ExceptionPexpect as e:
         error_msg = f"*❗ SHELL ERROR* Failed to run command: `{str(e)}`. Ensure the command is valid, bash is available, and pexpect is installed correctly."
         await kirim_ke_telegram(chat_id, context, error_msg)
         logger.error(f"[Shell] 🔴 Failed to run command: {e}")
-        return ConversationHandler.END
+        return
+    if job:
+        job.child = child
 
     error_detected_in_stream = False
-    error_line_buffer = []
-    user_context["last_error_log"] = None
+    last_error_log = None
+    # The command never changes, so classify it once instead of once per line
+    is_program_execution_command = bool(_POLA_EKSEKUSI_PROGRAM.match(command_to_run))
+    detektor = DetektorError(ERROR_DETECTION_ENGINE, program=is_program_execution_command)
+    reader = PtyLineReader(child.child_fd)
+    alasan_berhenti = None
+    tugas_henti = None
+    byte_output = 0
+
+    def hentikan(alasan: str):
+        """Stops the command in the background; the read loop keeps draining until EOF."""
+        nonlocal alasan_berhenti, tugas_henti
+        if tugas_henti is None:
+            alasan_berhenti = alasan
+            logger.warning(f"[Shell] ⏱ Stopping `{command_to_run}`: {alasan}.")
+            tugas_henti = asyncio.create_task(hentikan_grup_proses(child))
+
+    pengawas = None
+    if batas.get("wall"):
+        pengawas = asyncio.get_running_loop().call_later(batas["wall"], hentikan, f"wall-clock limit of {batas['wall']:.0f}s reached")
+
+    async def tanggapi_error(blok: dict):
+        """Shows the detected error block and streams an AI suggestion for it."""
+        nonlocal last_error_log
+        await log_batcher.flush()
+        last_error_log = output.text()
+        publikasikan_konteks()
+        user_context["last_error_log"] = last_error_log
+
+        await kirim_ke_telegram(chat_id, context, f"*🧠 AI DEBUGGING* Error detected. Requesting AI suggestions...")
+        logger.info(f"{COLOR_RED}[AI] Error detected ({blok['rule']}, lines {blok['start'] + 1}-{blok['end'] + 1}). Sending context to model...{COLOR_RESET}\n")
+
+        # The error block with a few lines of lead-in, rather than whatever the output ended with
+        cuplikan = "\n".join(output.window(max(blok["start"] - 5, 0), blok["end"] + 1))[-2000:] or output.tail_chars(2000)
+        await kirim_ke_telegram(chat_id, context, f"*❗ ERROR DETECTED*\n*Latest Error Log:*\n```log\n{cuplikan}\n```")
+
+        # Detect language from suggestion for proper syntax highlighting
+        format_saran = lambda saran: f"*💡 AI SUGGESTION*\n```{deteksi_bahasa_pemrograman_dari_konten(saran)}\n{saran}\n```"
+        stream_saran = TelegramStreamMessage(chat_id, context, formatter=format_saran) if LLM_STREAMING_ENABLED else None
+        success_saran, saran = await kirim_error_ke_llm_for_suggestion_async(last_error_log, chat_id, on_delta=stream_saran.on_delta if stream_saran else None)
+
+        if success_saran:
+            if stream_saran:
+                await stream_saran.finish(format_saran(saran))
+            else:
+                await kirim_ke_telegram(chat_id, context, format_saran(saran))
+        else:
+            if stream_saran and stream_saran.teks:
+                await stream_saran.finish()
+            await kirim_ke_telegram(chat_id, context, f"*🔴 AI ERROR* Failed to get AI suggestion: {saran}")
 
-    while True:
-        try:
-            line = await asyncio.to_thread(child.readline)
-
-            if not line:
-                if child.eof():
-                    logger.info(f"{COLOR_GREEN}[Shell] ✅ Shell process finished.{COLOR_RESET}")
-                    await send_telegram_chunk()
-                    await kirim_ke_telegram(chat_id, context, f"*⚙️ SHELL* Shell command finished.")
-                    
-                    if user_context["last_error_log"]:
-                        await kirim_ke_telegram(chat_id, context, f"*❗ ERROR* Error detected in last execution. Do you want to debug this program with AI assistance? (Yes/No)")
-                        user_context["awaiting_debug_response"] = True
-                        return DEBUGGING_STATE
-                    break
+    try:
+        while True:
+            lines = await reader.read_lines()
+            if lines is None:
+                break
+            if not lines:
                 continue
+            mulai_batch = time.perf_counter()
+
+            byte_output = reader.byte_dibaca
+            if batas.get("output") and byte_output > batas["output"]:
+                hentikan(f"output limit of {_format_byte(batas['output'])} exceeded")
+
+            lines = [line.strip() for line in lines]
+            # One log call per batch instead of one per line
+            logger.info(f"{COLOR_YELLOW}[Shell Log] " + "\n".join(lines) + COLOR_RESET)
+
+            await log_batcher.add(lines)
+
+            output.extend(lines)
+
+            blok_error = detektor.feed(lines)
+            # Time spent on a batch without the AI suggestion round trip
+            METRICS.amati("shell_batch_seconds", time.perf_counter() - mulai_batch)
+            METRICS.tambah("shell_output_lines_total", len(lines))
+            if blok_error and not error_detected_in_stream:
+                error_detected_in_stream = True
+                await tanggapi_error(blok_error[0])
+
+        # A traceback still open at exit (e.g. the process died mid-trace) is reported too
+        blok_error = detektor.selesai()
+        if blok_error and not error_detected_in_stream:
+            error_detected_in_stream = True
+            await tanggapi_error(blok_error[0])
+
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        logger.warning(f"\n{COLOR_YELLOW}[Shell] ✋ Interrupted by Termux user.{COLOR_RESET}")
+        if pengawas:
+            pengawas.cancel()
+        reader.close()
+        await hentikan_grup_proses(child)
+        await asyncio.to_thread(child.close)
+        await log_batcher.flush()
+        await kirim_ke_telegram(chat_id, context, f"*⚙️ SHELL* {label}Shell process manually stopped.")
+        return
+    except Exception as e:
+        error_msg = f"*🔴 INTERNAL ERROR* An unexpected error occurred in `shell_observer`: `{str(e)}`"
+        await log_batcher.flush()
+        await kirim_ke_telegram(chat_id, context, error_msg)
+        logger.error(f"[Shell] 🔴 Unexpected error: {e}")
+        if pengawas:
+            pengawas.cancel()
+        reader.close()
+        await hentikan_grup_proses(child)
+        await asyncio.to_thread(child.close)
+        return
 
-            cleaned_line = line.strip()
-            logger.info(f"{COLOR_YELLOW}[Shell Log] {cleaned_line}{COLOR_RESET}")
-            
-            telegram_log_buffer.append(cleaned_line)
-            if len(telegram_log_buffer) >= 10:
-                await send_telegram_chunk()
+    if pengawas:
+        pengawas.cancel()
+    reader.close()
+    if tugas_henti:
+        await tugas_henti
+    # Reap the child without blocking the event loop
+    await asyncio.to_thread(child.close)
+    alasan_berhenti = alasan_berhenti or alasan_dari_sinyal(child.signalstatus, batas)
+    METRICS.amati("shell_command_seconds", time.perf_counter() - mulai_perintah, outcome="limited" if alasan_berhenti else "error" if last_error_log else "ok")
+    METRICS.tambah("shell_output_bytes_total", byte_output)
+    if job:
+        # A signal is stored negated, as subprocess does, so "exit 9" and "killed by SIGKILL" differ
+        job.exit_status = child.exitstatus if child.exitstatus is not None else -child.signalstatus if child.signalstatus else None
+        job.alasan = alasan_berhenti
+    logger.info(f"{COLOR_GREEN}[Shell] ✅ Shell process finished.{COLOR_RESET}")
+    await log_batcher.flush()
+    if alasan_berhenti:
+        await kirim_ke_telegram(chat_id, context, f"*⏱️ LIMIT* {label}Command stopped: {alasan_berhenti}.")
+    else:
+        await kirim_ke_telegram(chat_id, context, f"*⚙️ SHELL* {label}Shell command finished.")
+    if last_error_log:
+        # The error may have been spotted mid-batch; debug with the complete output
+        publikasikan_konteks()
+        user_context["last_error_log"] = output.text()
+    # Only a script run can be fixed by rewriting its source; other commands get the suggestion only
+    # A job finishes at an arbitrary later time, so its question is answered with buttons
+    # bound to this job rather than by whatever text the user sends next
+    if last_error_log and is_program_execution_command and job:
+        await tanya_debug_job(chat_id, context, job, output.text())
+
+async def tanya_debug_job(chat_id: int, context: CallbackContext, job: "ShellJob", error_log: str):
+    """Asks whether to debug a failed job, with Yes/No buttons whose callback data carries the job's key."""
+    # Job ids restart with the bot; the start time keeps an old button from matching a new job
+    kunci = f"{job.id}-{int(job.created)}"
+    tertunda = get_user_context(chat_id).setdefault("pending_debug", {})
+    tertunda[kunci] = {"job": job.id, "command": job.command, "error_log": error_log}
+    while len(tertunda) > DEBUG_PENDING_MAX:
+        del tertunda[next(iter(tertunda))]
+    tombol = InlineKeyboardMarkup([[
+        InlineKeyboardButton("Yes", callback_data=f"debug:{kunci}:yes"),
+        InlineKeyboardButton("No", callback_data=f"debug:{kunci}:no"),
+    ]])
+    await kirim_ke_telegram(chat_id, context, f"*❗ ERROR* [job #{job.id}] Error detected in `{job.command}`. Do you want to debug this program with AI assistance?", reply_markup=tombol)
+
+# === Background shell jobs ===
+class ShellJob:
+    """One shell command run in the background, with its own bounded output buffer."""
+
+    def __init__(self, job_id: int, chat_id: int, command: str):
+        self.id = job_id
+        self.chat_id = chat_id
+        self.command = command
+        self.status = "queued"
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.exit_status = None  # Exit code, or the negated signal number that ended the command
+        self.alasan = None
+        self.output = OutputRingBuffer()
+        self.child = None
+        self.task = None
+
+    @property
+    def aktif(self) -> bool:
+        return self.status in ("queued", "running")
+
+    def durasi(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def keterangan_exit(self) -> str:
+        """"exit=1", "signal=SIGKILL", or "" while the job has not finished."""
+        if self.exit_status is None:
+            return ""
+        if self.exit_status >= 0:
+            return f"exit={self.exit_status}"
+        try:
+            return f"signal={signal.Signals(-self.exit_status).name}"
+        except ValueError:
+            return f"signal={-self.exit_status}"
 
-            error_line_buffer.append(cleaned_line)
-            if len(error_line_buffer) > 10:
-                error_line_buffer.pop(0)
-            
-            user_context["full_error_output"].append(cleaned_line)
+class ShellJobManager:
+    """
+    Runs shell commands as background tasks so a long command (e.g. `apt upgrade`) does not
+    block the chat. At most `max_concurrent` jobs run at once overall and `max_per_chat` per chat;
+    further jobs wait in FIFO order for a slot, up to `max_queued` waiting jobs.
+    Finished jobs are kept (up to `history`) for /jobs and /tail.
+    """
 
-            is_program_execution_command = bool(re.match(r"^(python|sh|bash|node|\./)\s+\S+\.(py|sh|js|rb|pl|php)", command_to_run, re.IGNORECASE))
-            
-            if is_program_execution_command and any(keyword in cleaned_line.lower() for keyword in ["error", "exception", "not found", "failed", "permission denied", "command not found", "no such file or directory", "segmentation fault", "fatal"]):
-                if not error_detected_in_stream:
-                    error_detected_in_stream = True
-                    await send_telegram_chunk()
-                    
-                    user_context["last_error_log"] = "\n".join(user_context["full_error_output"])
-                    
-                    await kirim_ke_telegram(chat_id, context, f"*🧠 AI DEBUGGING* Error detected. Requesting AI suggestions...")
-                    logger.info(f"{COLOR_RED}[AI] Error detected. Sending context to model...{COLOR_RESET}\n")
-                    
-                    success_saran, saran = kirim_error_ke_llm_for_suggestion(user_context["last_error_log"], chat_id)
-
-                    # Detect language from suggestion for proper syntax highlighting
-                    saran_lang = deteksi_bahasa_pemrograman_dari_konten(saran) if success_saran else "text"
-
-                    if success_saran:
-                        telegram_msg = f"""*❗ ERROR DETECTED*
-*Latest Error Log:*
-```log
-{user_context["full_error_output"][-2000:]}
-```
+    def __init__(self, max_concurrent: int = SHELL_JOBS_MAX_CONCURRENT, max_per_chat: int = SHELL_JOBS_MAX_PER_CHAT,
+                 max_queued: int = SHELL_JOBS_MAX_QUEUED, history: int = SHELL_JOBS_HISTORY):
+        self.max_concurrent = max_concurrent
+        self.max_per_chat = max_per_chat
+        self.max_queued = max_queued
+        self.history = history
+        self.jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._berjalan = Counter()
+        self._penunggu = deque()
+
+    def _slot_bebas(self, chat_id: int) -> bool:
+        return sum(self._berjalan.values()) < self.max_concurrent and self._berjalan[chat_id] < self.max_per_chat
+
+    async def _ambil_slot(self, chat_id: int):
+        """
+        Waits until both a global and a per-chat slot are free and takes them together, so a
+        waiting job never holds one slot while queued for the other. Waiters re-check in FIFO order.
+        """
+        while not self._slot_bebas(chat_id):
+            giliran = asyncio.get_running_loop().create_future()
+            self._penunggu.append(giliran)
+            try:
+                await giliran
+            finally:
+                if giliran in self._penunggu:
+                    self._penunggu.remove(giliran)
+        self._berjalan[chat_id] += 1
+
+    def _lepas_slot(self, chat_id: int):
+        self._berjalan[chat_id] -= 1
+        if not self._berjalan[chat_id]:
+            del self._berjalan[chat_id]
+        while self._penunggu:
+            giliran = self._penunggu.popleft()
+            if not giliran.done():
+                giliran.set_result(None)
+
+    def akan_menunggu(self, chat_id: int) -> bool:
+        """True if a job submitted now would have to wait for a free slot."""
+        berjalan = [job for job in self.jobs.values() if job.aktif]
+        return (len(berjalan) >= self.max_concurrent
+                or sum(1 for job in berjalan if job.chat_id == chat_id) >= self.max_per_chat)
+
+    def daftar(self, chat_id: int) -> list:
+        return [job for job in self.jobs.values() if job.chat_id == chat_id]
+
+    def ambil(self, chat_id: int, job_id: int) -> ShellJob | None:
+        job = self.jobs.get(job_id)
+        return job if job and job.chat_id == chat_id else None
+
+    def submit(self, command: str, update: Update, context: CallbackContext) -> ShellJob | None:
+        """Starts a job (or queues it for a free slot). Returns None if too many jobs are waiting."""
+        menunggu = sum(1 for job in self.jobs.values() if job.status == "queued")
+        if menunggu >= self.max_queued:
+            return None
+        job = ShellJob(next(self._ids), update.effective_chat.id, command)
+        self.jobs[job.id] = job
+        job.task = asyncio.get_running_loop().create_task(self._jalankan(job, update, context))
+        self._pangkas()
+        return job
+
+    async def _jalankan(self, job: ShellJob, update: Update, context: CallbackContext):
+        try:
+            await self._ambil_slot(job.chat_id)
+            try:
+                job.status = "running"
+                job.started = time.time()
+                logger.info(f"[Jobs] ▶ Job #{job.id} started for {job.chat_id}: {job.command}")
+                await run_shell_observer_telegram(job.command, update, context, job=job)
+                if job.status == "running":
+                    job.status = "limited" if job.alasan else "done" if not job.exit_status else "failed"
+            finally:
+                self._lepas_slot(job.chat_id)
+        except asyncio.CancelledError:
+            job.status = "killed"
+        except Exception as e:
+            job.status = "failed"
+            logger.error(f"[Jobs] 🔴 Job #{job.id} crashed: {e}")
+        finally:
+            job.finished = time.time()
+            job.child = None
+            logger.info(f"[Jobs] ■ Job #{job.id} {job.status} after {job.durasi():.1f}s.")
+            self._pangkas()
+
+    def kill(self, job: ShellJob) -> bool:
+        """Stops a queued or running job. The observer reports the stop in the chat."""
+        if not job.aktif or job.task is None:
+            return False
+        job.status = "killed"
+        job.task.cancel()
+        return True
 
----
+    def _pangkas(self):
+        """Forgets the oldest finished jobs beyond `history`."""
+        selesai = [job_id for job_id, job in self.jobs.items() if not job.aktif]
+        for job_id in selesai[:max(0, len(selesai) - self.history)]:
+            del self.jobs[job_id]
+
+    async def hentikan_semua(self):
+        """Stops every job, e.g. when the bot shuts down."""
+        tugas = [job.task for job in self.jobs.values() if job.aktif and job.task is not None]
+        for job in list(self.jobs.values()):
+            self.kill(job)
+        if tugas:
+            await asyncio.wait(tugas, timeout=10)
+
+SHELL_JOB_MANAGER = ShellJobManager()
+METRICS.gauge("telegram_queue_depth", TELEGRAM_SEND_QUEUE.kedalaman)
+METRICS.gauge("shell_jobs_active", lambda: sum(1 for job in SHELL_JOB_MANAGER.jobs.values() if job.aktif))
+METRICS.gauge("llm_calls_in_flight", lambda: len(LLM_SINGLE_FLIGHT_GROUP))
+
+# === Compact System Profile ===
+# Package managers in order of preference (Termux's pkg wraps apt, so it comes first)
+_PACKAGE_MANAGERS = ["pkg", "apt", "dnf", "yum", "pacman", "apk", "zypper", "brew"]
+
+# Interpreter/compiler name -> (candidate binaries, version arguments)
+_INTERPRETERS = {
+    "python": (["python3", "python"], ["--version"]),
+    "node": (["node"], ["--version"]),
+    "php": (["php"], ["--version"]),
+    "ruby": (["ruby"], ["--version"]),
+    "java": (["java"], ["-version"]),
+    "go": (["go"], ["version"]),
+    "gcc": (["gcc", "clang"], ["--version"]),
+    "rustc": (["rustc"], ["--version"]),
+    "perl": (["perl"], ["--version"]),
+}
 
-*💡 AI SUGGESTION*
-```{saran_lang}
-{saran}
-```
-"""
-                    else:
-                        telegram_msg = f"*❗ ERROR DETECTED*\n*Latest Error Log:*\n```log\n{user_context['full_error_output'][-2000:]}\n```\n\n*🔴 AI ERROR* Failed to get AI suggestion: {saran}"
-                    
-                    await kirim_ke_telegram(chat_id, context, telegram_msg)
-
-        except pexpect.exceptions.EOF:
-            logger.info(f"{COLOR_GREEN}[Shell] ✅ Shell process finished.{COLOR_RESET}")
-            await send_telegram_chunk()
-            await kirim_ke_telegram(chat_id, context, f"*⚙️ SHELL* Shell command finished.")
-            if user_context["last_error_log"]:
-                await kirim_ke_telegram(chat_id, context, f"*❗ ERROR* Error detected in last execution. Do you want to debug this program with AI assistance? (Yes/No)")
-                user_context["awaiting_debug_response"] = True
-                return DEBUGGING_STATE
-            break
-        except KeyboardInterrupt:
-            logger.warning(f"\n{COLOR_YELLOW}[Shell] ✋ Interrupted by Termux user.{COLOR_RESET}")
-            child.sendline('\x03')
-            child.close()
-            await kirim_ke_telegram(chat_id, context, f"*⚙️ SHELL* Shell process manually stopped.")
-            break
-        except Exception as e:
-            error_msg = f"*🔴 INTERNAL ERROR* An unexpected error occurred in `shell_observer`: `{str(e)}`"
-            await kirim_ke_telegram(chat_id, context, error_msg)
-            logger.error(f"[Shell] 🔴 Unexpected error: {e}")
-            if child.isalive():
-                child.close()
-            break
-    
-    return ConversationHandler.END
+# Requests that actually need the full system details text (hardware, kernel, resources)
+_POLA_BUTUH_NEOFETCH = re.compile(
+    r"\b(neofetch|spec(s|ification)?|spesifikasi|hardware|perangkat keras|cpu|gpu|processor|prosesor|ram|memory|memori|kernel|"
+    r"uptime|resolution|resolusi|disk|storage|penyimpanan|system info|info sistem|device|perangkat)\b",
+    re.IGNORECASE,
+)
+
+def _versi_interpreter(nama: str) -> tuple[str, str | None]:
+    """Returns (name, version) of an interpreter on $PATH, or (name, None) if it is not installed."""
+    binaries, args = _INTERPRETERS[nama]
+    for binary in binaries:
+        path = shutil.which(binary)
+        if not path:
+            continue
+        try:
+            result = subprocess.run([path] + args, capture_output=True, text=True, timeout=3)
+        except (subprocess.SubprocessError, OSError):
+            continue
+        cocok = re.search(r"\d+(\.\d+)+", result.stdout + result.stderr)
+        return nama, cocok.group(0) if cocok else "unknown"
+    return nama, None
 
-# === Function to check system info with neofetch ===
-def check_system_info():
+def probe_interpreter() -> dict:
+    """
+    Returns {name: version} of installed interpreters. Only names found on $PATH
+    are spawned, all of them in parallel.
+    """
+    terpasang = [nama for nama, (binaries, _) in _INTERPRETERS.items() if any(shutil.which(b) for b in binaries)]
+    if not terpasang:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(terpasang)) as executor:
+        versi = dict(executor.map(_versi_interpreter, terpasang))
+    return {nama: v for nama, v in versi.items() if v}
+
+def bangun_profil_sistem(interpreters: dict = None) -> dict:
     """
-    Checks for neofetch availability and retrieves system information.
-    If neofetch is not available, it attempts to install it based on the OS.
+    Collects the compact system profile: OS, shell, architecture, package manager
+    and installed interpreters with their versions (probed in parallel unless given).
     """
-    global SYSTEM_INFO
+    return {
+        "os": SYSTEM_INFO["os"],
+        "shell": SYSTEM_INFO["shell"],
+        "arch": platform.machine() or "unknown",
+        "package_manager": next((pm for pm in _PACKAGE_MANAGERS if shutil.which(pm)), "unknown"),
+        "interpreters": probe_interpreter() if interpreters is None else interpreters,
+    }
 
-    def install_neofetch(install_command):
-        """Attempts to install neofetch using the given command."""
-        logger.info(f"{COLOR_YELLOW}[INFO SISTEM] Neofetch tidak ditemukan. Mencoba menginstal dengan: '{' '.join(install_command)}'...{COLOR_RESET}")
+def kunci_profil_sistem() -> str:
+    """
+    Returns the invalidation key of the cached profile: a hash of /etc/os-release
+    (or the Termux prefix) and the login shell. Reading them costs well under a millisecond.
+    """
+    h = hashlib.sha256()
+    for path in ("/etc/os-release", "/usr/lib/os-release"):
         try:
-            # Try to install silently
-            subprocess.run(install_command, check=True, capture_output=True)
-            logger.info(f"{COLOR_GREEN}[INFO SISTEM] Neofetch berhasil diinstal.{COLOR_RESET}")
-            return True
-        except subprocess.CalledProcessError as e:
-            logger.error(f"{COLOR_RED}🔴 ERROR: Gagal menginstal neofetch. Output error:\n{e.stderr.strip()}{COLOR_RESET}")
-            return False
-        except FileNotFoundError:
-            logger.error(f"{COLOR_RED}🔴 ERROR: Perintah instalasi '{install_command[0]}' tidak ditemukan.{COLOR_RESET}")
-            return False
+            with open(path, "rb") as f:
+                h.update(f.read())
+            break
+        except OSError:
+            continue
+    shell = os.getenv("SHELL", "")
+    h.update(f"\0{os.getenv('PREFIX', '')}\0{shell}\0{os.path.realpath(shell) if shell else ''}".encode())
+    return h.hexdigest()[:16]
 
-    # First, try to detect the OS
-    detected_os = "Unknown"
+def simpan_profil_sistem():
+    """Persists SYSTEM_INFO (profile and system details text) with its invalidation key."""
     try:
-        if os.path.exists("/data/data/com.termux/files/usr/bin/pkg"):
-            detected_os = "Termux"
-        elif os.path.exists("/etc/os-release"):
-            with open("/etc/os-release", "r") as f:
-                os_release_content = f.read()
-                if "ID=debian" in os_release_content or "ID=ubuntu" in os_release_content:
-                    detected_os = "Debian/Ubuntu"
-                elif "ID_LIKE=arch" in os_release_content:
-                    detected_os = "Arch Linux"
-                elif "ID=fedora" in os_release_content:
-                    detected_os = "Fedora"
-                # Add more OS detection as needed
-    except Exception as e:
-        logger.warning(f"[INFO SISTEM] Gagal mendeteksi OS secara detail: {e}. Menggunakan deteksi default.")
-    
-    SYSTEM_INFO["os"] = detected_os
-    logger.info(f"[INFO SISTEM] OS yang terdeteksi: {SYSTEM_INFO['os']}")
+        os.makedirs(os.path.dirname(SYSTEM_PROFILE_PATH) or ".", exist_ok=True)
+        sementara = f"{SYSTEM_PROFILE_PATH}.{os.getpid()}.tmp"
+        with open(sementara, "w") as f:
+            json.dump(dict(SYSTEM_INFO, key=kunci_profil_sistem(), detected_at=time.time()), f, indent=2)
+        os.replace(sementara, SYSTEM_PROFILE_PATH)
+        logger.info(f"[INFO SISTEM] System profile saved to {SYSTEM_PROFILE_PATH}.")
+    except OSError as e:
+        logger.warning(f"[INFO SISTEM] Could not save system profile: {e}")
+
+def muat_profil_sistem() -> bool:
+    """
+    Loads a previously saved SYSTEM_INFO. Returns True only if a complete profile was
+    loaded whose key still matches this system and which is not older than SYSTEM_PROFILE_MAX_AGE.
+    """
+    try:
+        with open(SYSTEM_PROFILE_PATH, "r") as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return False
+    if not isinstance(data, dict) or not data.get("profile"):
+        return False
+    SYSTEM_INFO.update({k: data[k] for k in SYSTEM_INFO if k in data})
+    if data.get("key") != kunci_profil_sistem() or time.time() - data.get("detected_at", 0) > SYSTEM_PROFILE_MAX_AGE:
+        # Still better than nothing while detection runs again
+        logger.info(f"[INFO SISTEM] Saved system profile is stale; detecting again.")
+        return False
+    logger.info(f"[INFO SISTEM] System profile loaded from {SYSTEM_PROFILE_PATH}.")
+    return True
+
+def render_profil_sistem() -> str:
+    """Renders the profile as one short, stable line for system prompts."""
+    profil = SYSTEM_INFO["profile"] or {"os": SYSTEM_INFO["os"], "shell": SYSTEM_INFO["shell"]}
+    bagian = [f"OS: {profil.get('os', 'Unknown')}", f"Shell: {profil.get('shell', 'Unknown')}"]
+    if profil.get("arch"):
+        bagian.append(f"Arch: {profil['arch']}")
+    if profil.get("package_manager"):
+        bagian.append(f"Package manager: {profil['package_manager']}")
+    if profil.get("interpreters"):
+        bagian.append("Interpreters: " + ", ".join(f"{nama} {versi}" for nama, versi in sorted(profil["interpreters"].items())))
+    return ", ".join(bagian)
+
+def info_sistem_untuk_prompt(permintaan: str = "") -> str:
+    """
+    Returns the system description for a prompt: the compact profile, plus the full
+    system details (hardware, kernel, memory) only when the request is about the machine itself.
+    """
+    info = f"The system runs on {render_profil_sistem()}."
+    if permintaan and _POLA_BUTUH_NEOFETCH.search(permintaan) and SYSTEM_INFO["neofetch_output"] != "Not available":
+        info += f" System details:\n```\n{SYSTEM_INFO['neofetch_output']}\n```"
+    return info
 
-    # Check if neofetch is installed
+# === Native system information collector ===
+def _baca_file(path: str) -> str:
     try:
-        subprocess.run(["which", "neofetch"], check=True, capture_output=True)
-        neofetch_installed = True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        neofetch_installed = False
-
-    if not neofetch_installed:
-        if detected_os == "Termux":
-            success_install = install_neofetch(["pkg", "install", "-y", "neofetch"])
-        elif detected_os == "Debian/Ubuntu":
-            success_install = install_neofetch(["sudo", "apt", "install", "-y", "neofetch"])
-            if not success_install: # Fallback if sudo isn't configured for current user
-                 success_install = install_neofetch(["apt", "install", "-y", "neofetch"])
-        elif detected_os == "Arch Linux":
-            success_install = install_neofetch(["sudo", "pacman", "-S", "--noconfirm", "neofetch"])
-        elif detected_os == "Fedora":
-            success_install = install_neofetch(["sudo", "dnf", "install", "-y", "neofetch"])
-        else:
-            logger.warning(f"{COLOR_YELLOW}[INFO SISTEM] Neofetch tidak ditemukan dan OS tidak dikenal untuk instalasi otomatis. Coba instal neofetch secara manual.{COLOR_RESET}")
-            success_install = False
-        
-        if not success_install:
-            logger.error(f"{COLOR_RED}🔴 ERROR: Neofetch tidak terinstal dan gagal menginstalnya secara otomatis. Tidak dapat melanjutkan tanpa neofetch.{COLOR_RESET}")
-            exit(1) # Exit if installation fails
+        with open(path, "r", errors="replace") as f:
+            return f.read()
+    except OSError:
+        return ""
+
+def _baca_os_release() -> dict:
+    """Parses /etc/os-release (or /usr/lib/os-release) into a dict."""
+    teks = _baca_file("/etc/os-release") or _baca_file("/usr/lib/os-release")
+    hasil = {}
+    for baris in teks.splitlines():
+        kunci, sep, nilai = baris.partition("=")
+        if sep and kunci and not kunci.startswith("#"):
+            hasil[kunci.strip()] = nilai.strip().strip("\"'")
+    return hasil
+
+def _is_termux() -> bool:
+    return "com.termux" in os.getenv("PREFIX", "") or bool(os.getenv("TERMUX_VERSION")) or os.path.isdir("/data/data/com.termux/files/usr")
+
+def _format_uptime(detik: float) -> str:
+    menit = int(detik // 60)
+    hari, menit = divmod(menit, 1440)
+    jam, menit = divmod(menit, 60)
+    bagian = [f"{n} {satuan}{'s' if n != 1 else ''}" for n, satuan in ((hari, "day"), (jam, "hour"), (menit, "min")) if n]
+    return ", ".join(bagian) or "0 mins"
+
+def kumpulkan_info_sistem() -> dict:
+    """
+    Collects OS, shell and a neofetch-like details text in-process from os-release,
+    platform, /proc and the environment. Takes milliseconds and never raises.
+    Returns the SYSTEM_INFO fields "os", "shell" and "neofetch_output".
+    """
+    arch = platform.machine() or "unknown"
+    if _is_termux():
+        android = _baca_file("/system/build.prop")
+        versi = re.search(r"^ro\.build\.version\.release=(.+)$", android, re.MULTILINE)
+        nama_os = f"Android {versi.group(1).strip()} (Termux)" if versi else "Android (Termux)"
+    else:
+        release = _baca_os_release()
+        nama_os = release.get("PRETTY_NAME") or " ".join(filter(None, (release.get("NAME"), release.get("VERSION")))) or platform.system() or "Unknown"
+    nama_os = f"{nama_os} {arch}"
 
+    shell = os.getenv("SHELL", "")
+    if not shell:
+        try:
+            import pwd
+            shell = pwd.getpwuid(os.getuid()).pw_shell
+        except (ImportError, KeyError, OSError):
+            shell = ""
+    shell = os.path.basename(shell) or "Unknown"
+
+    baris = [f"OS: {nama_os}"]
+    host = _baca_file("/sys/devices/virtual/dmi/id/product_name").strip()
+    if host:
+        baris.append(f"Host: {host}")
+    baris.append(f"Kernel: {platform.release() or 'unknown'}")
+    uptime = _baca_file("/proc/uptime").split()
+    if uptime:
+        try:
+            baris.append(f"Uptime: {_format_uptime(float(uptime[0]))}")
+        except ValueError:
+            pass
+    baris.append(f"Shell: {shell}")
+
+    cpuinfo = _baca_file("/proc/cpuinfo")
+    model = re.search(r"^(?:model name|Hardware|Processor|cpu model)\s*:\s*(.+)$", cpuinfo, re.MULTILINE)
+    jumlah = len(re.findall(r"^processor\s*:", cpuinfo, re.MULTILINE)) or os.cpu_count() or 1
+    baris.append(f"CPU: {model.group(1).strip() if model else platform.processor() or arch} ({jumlah})")
+
+    meminfo = dict(re.findall(r"^(\w+):\s+(\d+) kB", _baca_file("/proc/meminfo"), re.MULTILINE))
+    if "MemTotal" in meminfo:
+        total = int(meminfo["MemTotal"]) // 1024
+        tersedia = int(meminfo.get("MemAvailable", meminfo.get("MemFree", 0))) // 1024
+        baris.append(f"Memory: {total - tersedia}MiB / {total}MiB")
+
+    return {"os": nama_os, "shell": shell, "neofetch_output": "\n".join(baris)}
+
+def _info_neofetch() -> str | None:
+    """Runs neofetch for richer details if it is installed and allowed. Returns its text or None."""
+    if SYSTEM_INFO_NEOFETCH in ("0", "false", "no", "off"):
+        return None
+    neofetch = shutil.which("neofetch")
+    if not neofetch:
+        return None
     try:
-        # Run neofetch and capture its output
-        result = subprocess.run(["neofetch", "--off", "--config", "none", "--stdout"], capture_output=True, text=True, check=True)
-        neofetch_output = result.stdout.strip()
-        SYSTEM_INFO["neofetch_output"] = neofetch_output
-        logger.info(f"{COLOR_GREEN}[INFO SISTEM] Neofetch successfully executed.{COLOR_RESET}")
-
-        # Parse neofetch output to get OS and Shell
-        os_match = re.search(r"OS:\s*(.*?)\n", neofetch_output)
-        shell_match = re.search(r"Shell:\s*(.*?)\n", neofetch_output)
-
-        if os_match:
-            SYSTEM_INFO["os"] = os_match.group(1).strip()
-        if shell_match:
-            SYSTEM_INFO["shell"] = shell_match.group(1).strip()
-        
-        logger.info(f"[INFO SISTEM] Detected OS: {SYSTEM_INFO['os']}")
-        logger.info(f"[INFO SISTEM] Detected Shell: {SYSTEM_INFO['shell']}")
-
-    except subprocess.CalledProcessError as e:
-        logger.error(f"{COLOR_RED}🔴 ERROR: Failed to run neofetch even after installation attempt. Error output:\n{e.stderr.strip()}{COLOR_RESET}")
-        logger.error(f"{COLOR_RED}Please check neofetch installation and your PATH manually.{COLOR_RESET}")
-        logger.error(f"{COLOR_RED}Program will stop. Please fix neofetch installation to continue.{COLOR_RESET}")
-        exit(1)
-    except FileNotFoundError:
-        # This case should ideally not happen if install_neofetch worked
-        logger.error(f"{COLOR_RED}🔴 ERROR: 'neofetch' command not found after installation attempt.{COLOR_RESET}")
-        logger.error(f"{COLOR_RED}Program will stop. Please fix neofetch installation to continue.{COLOR_RESET}")
-        exit(1)
+        result = subprocess.run([neofetch, "--off", "--config", "none", "--stdout"], capture_output=True, text=True, timeout=15)
+    except (subprocess.SubprocessError, OSError) as e:
+        logger.warning(f"[INFO SISTEM] Neofetch failed: {e}")
+        return None
+    return result.stdout.strip() or None
+
+# === Function to check system info ===
+def lengkapi_profil_sistem():
+    """
+    Slow part of detection: probes interpreter versions, optionally enriches the
+    details with neofetch, and saves the profile. Never installs anything and never raises.
+    """
+    mulai = time.perf_counter()
+    try:
+        SYSTEM_INFO["profile"] = bangun_profil_sistem()
+        teks_neofetch = _info_neofetch()
+        if teks_neofetch:
+            SYSTEM_INFO["neofetch_output"] = teks_neofetch
+        logger.info(f"[INFO SISTEM] {render_profil_sistem()}")
+        simpan_profil_sistem()
     except Exception as e:
-        logger.error(f"{COLOR_RED}🔴 ERROR: An unexpected error occurred while checking system information: {e}{COLOR_RESET}")
-        logger.error(f"{COLOR_RED}Program will stop.{COLOR_RESET}")
-        exit(1)
+        logger.error(f"{COLOR_RED}🔴 ERROR: System detection failed: {e}. Continuing with a partial profile.{COLOR_RESET}")
+    STARTUP_TIMINGS["system_detection"] = time.perf_counter() - mulai
+    logger.info(f"[Startup] System detection finished in {STARTUP_TIMINGS['system_detection']:.2f}s.")
+
+def check_system_info(background: bool = True) -> bool:
+    """
+    Uses the saved system profile when its key still matches this system. Otherwise OS,
+    shell and details are collected natively right away, and interpreter probing (plus
+    optional neofetch) continues in a daemon thread unless background is False.
+    Returns True if the cached profile was used.
+    """
+    if muat_profil_sistem():
+        logger.info(f"[INFO SISTEM] {render_profil_sistem()}")
+        return True
+    mulai = time.perf_counter()
+    SYSTEM_INFO.update(kumpulkan_info_sistem())
+    # Interpreters from a stale profile stand in until the probes finish
+    SYSTEM_INFO["profile"] = bangun_profil_sistem((SYSTEM_INFO["profile"] or {}).get("interpreters", {}))
+    STARTUP_TIMINGS["native_system_info"] = time.perf_counter() - mulai
+    logger.info(f"[INFO SISTEM] Detected OS: {SYSTEM_INFO['os']}, Shell: {SYSTEM_INFO['shell']} ({STARTUP_TIMINGS['native_system_info'] * 1000:.1f} ms)")
+    if background:
+        threading.Thread(target=lengkapi_profil_sistem, name="system-detection", daemon=True).start()
+    else:
+        lengkapi_profil_sistem()
+    return False
 
 # === Telegram Command Handlers ===
 
@@ -920,6 +4123,14 @@ Saya bisa membantu Anda dengan beberapa hal:
 * `/listfiles` - Melihat daftar file yang dihasilkan.
 * `/deletefile <nama_file>` - Menghapus file yang dihasilkan.
 * `/clear_chat` - Menghapus riwayat percakapan.
+* `/intent_stats` - Statistik deteksi niat (aturan lokal vs LLM).
+* `/cache_stats` - Statistik cache jawaban LLM (`/cache_stats clear` untuk mengosongkan).
+* `/error_cache` - Daftar error yang dikenali (`/error_cache forget <id>` atau `/error_cache clear`).
+* `/jobs` - Daftar perintah shell yang berjalan di latar belakang.
+* `/tail <id>` - Melihat output terakhir sebuah job.
+* `/kill <id>` - Menghentikan sebuah job.
+* `/queue_stats` - Statistik antrean pesan keluar Telegram.
+* `/stats` - Latensi per tahap: deteksi niat, LLM, Telegram, shell (`/stats reset` untuk mengosongkan).
 
 *Penting:* Pastikan bot saya berjalan di Termux dan semua variabel lingkungan sudah diatur!
     """
@@ -995,13 +4206,176 @@ async def handle_clear_chat_command(update: Update, context: CallbackContext):
         logger.warning(f"[Auth] ⚠ Unauthorized access attempt /clear_chat from {chat_id}.")
         return
 
-    if chat_id in chat_histories:
-        del chat_histories[chat_id]
+    if SESSION_STORE.hapus_riwayat(chat_id):
         await kirim_ke_telegram(chat_id, context, f"*✅ SUCCESS* Your conversation history has been cleared.")
         logger.info(f"[Chat] Chat history for {chat_id} cleared.")
     else:
         await kirim_ke_telegram(chat_id, context, f"*💬 INFO* No conversation history to clear.")
 
+async def handle_intent_stats_command(update: Update, context: CallbackContext):
+    """Handles the /intent_stats command to show how intents were decided (local rules vs LLM)."""
+    chat_id = update.effective_chat.id
+    if str(chat_id) != TELEGRAM_CHAT_ID:
+        await kirim_ke_telegram(chat_id, context, f"*❗ ACCESS DENIED* You are not authorized to use this feature. Contact the bot admin.")
+        logger.warning(f"[Auth] ⚠ Unauthorized access attempt /intent_stats from {chat_id}.")
+        return
+
+    total = INTENT_STATS["local"] + INTENT_STATS["llm"]
+    if not total:
+        await kirim_ke_telegram(chat_id, context, f"*💬 INFO* No intent decisions recorded yet.")
+        return
+
+    counters = "\n".join(f"{nama}: {jumlah}" for nama, jumlah in sorted(INTENT_STATS.items()))
+    recent = "\n".join(
+        f"{k['source']:5} {k['intent']:12} {k['confidence'] if k['confidence'] is not None else k.get('local_confidence', 0):.2f} {k['message']}"
+        for k in list(INTENT_RECENT_DECISIONS)[-10:]
+    )
+    await kirim_ke_telegram(chat_id, context, f"*🧭 INTENT STATS* Local: {INTENT_STATS['local']}/{total} (threshold {INTENT_LOCAL_CONFIDENCE_THRESHOLD})\n```\n{counters}\n```\n*Recent decisions:*\n```\n{recent}\n```")
+
+async def handle_cache_stats_command(update: Update, context: CallbackContext):
+    """Handles the /cache_stats command to show LLM cache counters. `/cache_stats clear` empties the cache."""
+    chat_id = update.effective_chat.id
+    if str(chat_id) != TELEGRAM_CHAT_ID:
+        await kirim_ke_telegram(chat_id, context, f"*❗ ACCESS DENIED* You are not authorized to use this feature. Contact the bot admin.")
+        logger.warning(f"[Auth] ⚠ Unauthorized access attempt /cache_stats from {chat_id}.")
+        return
+
+    if context.args and context.args[0].lower() == "clear":
+        LLM_CACHE.clear()
+        await kirim_ke_telegram(chat_id, context, f"*✅ SUCCESS* LLM response cache cleared.")
+        logger.info(f"[Cache] LLM cache cleared by {chat_id}.")
+        return
+
+    counters = "\n".join(f"{nama}: {nilai}" for nama, nilai in sorted(LLM_CACHE.ringkasan().items()))
+    await kirim_ke_telegram(chat_id, context, f"*🗄️ LLM CACHE*\n```\n{counters}\n```")
+
+async def handle_jobs_command(update: Update, context: CallbackContext):
+    """Handles the /jobs command to list running, queued and recently finished shell jobs."""
+    chat_id = update.effective_chat.id
+    if str(chat_id) != TELEGRAM_CHAT_ID:
+        await kirim_ke_telegram(chat_id, context, f"*❗ ACCESS DENIED* You are not authorized to use this feature. Contact the bot admin.")
+        logger.warning(f"[Auth] ⚠ Unauthorized access attempt /jobs from {chat_id}.")
+        return
+
+    jobs = SHELL_JOB_MANAGER.daftar(chat_id)
+    if not jobs:
+        await kirim_ke_telegram(chat_id, context, f"*💬 INFO* No shell jobs yet.")
+        return
+    daftar = "\n".join(
+        f"#{job.id:<4} {job.status:8} {job.durasi():7.1f}s {job.keterangan_exit() + ' ' if job.exit_status is not None else ''}{job.command[:60]}"
+        + (f"\n      {job.alasan}" if job.alasan else "")
+        for job in jobs
+    )
+    await kirim_ke_telegram(chat_id, context, f"*🗂️ JOBS*\n```\n{daftar}\n```\nUse `/tail <id>` to see output or `/kill <id>` to stop a job.")
+
+async def handle_kill_command(update: Update, context: CallbackContext):
+    """Handles the /kill <id> command to stop a queued or running shell job."""
+    chat_id = update.effective_chat.id
+    if str(chat_id) != TELEGRAM_CHAT_ID:
+        await kirim_ke_telegram(chat_id, context, f"*❗ ACCESS DENIED* You are not authorized to use this feature. Contact the bot admin.")
+        logger.warning(f"[Auth] ⚠ Unauthorized access attempt /kill from {chat_id}.")
+        return
+
+    if not context.args or not context.args[0].lstrip("#").isdigit():
+        await kirim_ke_telegram(chat_id, context, f"*❓ COMMAND* Please provide the job id. Example: `/kill 3`")
+        return
+    job = SHELL_JOB_MANAGER.ambil(chat_id, int(context.args[0].lstrip("#")))
+    if job is None:
+        await kirim_ke_telegram(chat_id, context, f"*❌ FAILED* Job `{context.args[0]}` not found.")
+    elif SHELL_JOB_MANAGER.kill(job):
+        await kirim_ke_telegram(chat_id, context, f"*✅ SUCCESS* Stopping job #{job.id}: `{job.command}`")
+        logger.info(f"[Jobs] Job #{job.id} killed by {chat_id}.")
+    else:
+        await kirim_ke_telegram(chat_id, context, f"*💬 INFO* Job #{job.id} is not running (status: {job.status}).")
+
+async def handle_tail_command(update: Update, context: CallbackContext):
+    """Handles the /tail <id> [lines] command to show the latest output of a shell job."""
+    chat_id = update.effective_chat.id
+    if str(chat_id) != TELEGRAM_CHAT_ID:
+        await kirim_ke_telegram(chat_id, context, f"*❗ ACCESS DENIED* You are not authorized to use this feature. Contact the bot admin.")
+        logger.warning(f"[Auth] ⚠ Unauthorized access attempt /tail from {chat_id}.")
+        return
+
+    args = context.args or []
+    if not args or not args[0].lstrip("#").isdigit():
+        await kirim_ke_telegram(chat_id, context, f"*❓ COMMAND* Please provide the job id. Example: `/tail 3` or `/tail 3 50`")
+        return
+    job = SHELL_JOB_MANAGER.ambil(chat_id, int(args[0].lstrip("#")))
+    if job is None:
+        await kirim_ke_telegram(chat_id, context, f"*❌ FAILED* Job `{args[0]}` not found.")
+        return
+    jumlah = int(args[1]) if len(args) > 1 and args[1].isdigit() else 20
+    isi = "\n".join(job.output.tail_lines(jumlah)) or "(no output yet)"
+    await kirim_ke_telegram(chat_id, context, f"*📜 JOB #{job.id}* {job.status} `{job.command}`\n```log\n{isi}\n```")
+
+async def handle_queue_stats_command(update: Update, context: CallbackContext):
+    """Handles the /queue_stats command to show outbound Telegram queue depth and delivery counters."""
+    chat_id = update.effective_chat.id
+    if str(chat_id) != TELEGRAM_CHAT_ID:
+        await kirim_ke_telegram(chat_id, context, f"*❗ ACCESS DENIED* You are not authorized to use this feature. Contact the bot admin.")
+        logger.warning(f"[Auth] ⚠ Unauthorized access attempt /queue_stats from {chat_id}.")
+        return
+
+    counters = "\n".join(f"{nama}: {nilai}" for nama, nilai in TELEGRAM_SEND_QUEUE.ringkasan().items())
+    await kirim_ke_telegram(chat_id, context, f"*📤 SEND QUEUE*\n```\n{counters}\n```")
+
+async def handle_stats_command(update: Update, context: CallbackContext):
+    """Handles the /stats command: per-stage latency histograms and counters. `/stats reset` clears them."""
+    chat_id = update.effective_chat.id
+    if str(chat_id) != TELEGRAM_CHAT_ID:
+        await kirim_ke_telegram(chat_id, context, f"*❗ ACCESS DENIED* You are not authorized to use this feature. Contact the bot admin.")
+        logger.warning(f"[Auth] ⚠ Unauthorized access attempt /stats from {chat_id}.")
+        return
+
+    if context.args and context.args[0].lower() == "reset":
+        METRICS.reset()
+        await kirim_ke_telegram(chat_id, context, f"*✅ SUCCESS* Metrics have been reset.")
+        return
+    if not METRICS.enabled:
+        await kirim_ke_telegram(chat_id, context, f"*💬 INFO* Metrics are disabled (METRICS_ENABLED=false).")
+        return
+    menit = int((time.time() - METRICS.mulai) // 60)
+    model = "\n".join(
+        f"{nama[:38]:<38} {'-' if latency is None else _format_durasi(latency):>8} err {error_rate:.0%} n={calls}{'' if status == 'ok' else f' ({status})'}"
+        for nama, latency, error_rate, calls, _, status in LLM_ROUTER.ringkasan()
+    )
+    pesan = f"*📈 STATS* Since {menit // 60}h {menit % 60}m ago\n```\n{ringkasan_metrik() or 'No data yet.'}\n```"
+    if model:
+        pesan += f"\n*Models* (EWMA latency, error rate)\n```\n{model}\n```"
+    await kirim_ke_telegram(chat_id, context, pesan)
+
+async def handle_error_cache_command(update: Update, context: CallbackContext):
+    """
+    Handles the /error_cache command: lists known error fingerprints with their hit counts.
+    `/error_cache forget <fingerprint>` forgets one error, `/error_cache clear` forgets all.
+    """
+    chat_id = update.effective_chat.id
+    if str(chat_id) != TELEGRAM_CHAT_ID:
+        await kirim_ke_telegram(chat_id, context, f"*❗ ACCESS DENIED* You are not authorized to use this feature. Contact the bot admin.")
+        logger.warning(f"[Auth] ⚠ Unauthorized access attempt /error_cache from {chat_id}.")
+        return
+
+    args = context.args or []
+    if args and args[0].lower() == "clear":
+        jumlah = ERROR_SUGGESTION_CACHE.invalidate()
+        await kirim_ke_telegram(chat_id, context, f"*✅ SUCCESS* Forgot {jumlah} cached error answer(s).")
+        return
+    if args and args[0].lower() == "forget":
+        if len(args) < 2:
+            await kirim_ke_telegram(chat_id, context, f"*❓ COMMAND* Please provide the fingerprint. Example: `/error_cache forget 1a2b3c4d5e6f7a8b`")
+            return
+        jumlah = ERROR_SUGGESTION_CACHE.invalidate(args[1])
+        await kirim_ke_telegram(chat_id, context, f"*✅ SUCCESS* Forgot {jumlah} cached answer(s) for `{args[1]}`.")
+        return
+
+    entri = ERROR_SUGGESTION_CACHE.teratas()
+    if not entri:
+        await kirim_ke_telegram(chat_id, context, f"*💬 INFO* No known errors cached yet.")
+        return
+    daftar = "\n\n".join(f"{fingerprint} [{kind.split(':')[0]}] hits={hits}\n{signature[:150]}" for fingerprint, kind, hits, signature in entri)
+    stats = ERROR_SUGGESTION_CACHE.stats
+    await kirim_ke_telegram(chat_id, context, f"*🧩 KNOWN ERRORS* hits: {stats['hits']}, misses: {stats['misses']}\n```\n{daftar}\n```")
+
 
 async def handle_text_message(update: Update, context: CallbackContext):
     """
@@ -1019,13 +4393,34 @@ async def handle_text_message(update: Update, context: CallbackContext):
 
     await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
     
-    niat = deteksi_niat_pengguna(user_message)
+    respons_terstruktur = None
+    if PROGRAM_PIPELINE_MODE == "combined":
+        # One structured call replaces intent -> code -> filename, unless the local
+        # classifier is already sure this is a plain shell command or a conversation
+        keputusan_lokal = klasifikasi_niat_lokal(user_message) if INTENT_LOCAL_ENABLED else None
+        if not keputusan_lokal or keputusan_lokal["confidence"] < INTENT_LOCAL_CONFIDENCE_THRESHOLD or keputusan_lokal["intent"] == "program":
+            respons_terstruktur = await minta_respons_terstruktur_async(user_message, chat_id)
+
+    if respons_terstruktur:
+        keputusan_niat = {"intent": respons_terstruktur["intent"], "confidence": None, "rule": None, "literal_command": False, "source": "structured"}
+        INTENT_STATS["structured"] += 1
+    else:
+        keputusan_niat = await deteksi_niat_pengguna_detail_async(user_message)
+    niat = keputusan_niat["intent"]
     user_context["last_user_message_intent"] = niat
     logger.info(f"[Intent] User {chat_id} -> Intent: {niat}")
 
     if niat == "shell":
-        await kirim_ke_telegram(chat_id, context, f"*⚙️ SHELL* Intent detected: Shell Command. Translating instruction: `{user_message}`")
-        success_konversi, perintah_shell = konversi_ke_perintah_shell(user_message, chat_id)
+        if keputusan_niat["literal_command"]:
+            # The message already is a shell command; no need to ask the LLM to translate it
+            await kirim_ke_telegram(chat_id, context, f"*⚙️ SHELL* Intent detected: Shell Command. Running literal command: `{user_message}`")
+            success_konversi, perintah_shell = True, user_message
+        elif respons_terstruktur:
+            await kirim_ke_telegram(chat_id, context, f"*⚙️ SHELL* Intent detected: Shell Command. Translated instruction: `{user_message}`")
+            success_konversi, perintah_shell = True, respons_terstruktur["command"]
+        else:
+            await kirim_ke_telegram(chat_id, context, f"*⚙️ SHELL* Intent detected: Shell Command. Translating instruction: `{user_message}`")
+            success_konversi, perintah_shell = await konversi_ke_perintah_shell_async(user_message, chat_id)
         perintah_shell = perintah_shell.strip()
 
         if not success_konversi:
@@ -1050,20 +4445,36 @@ async def handle_text_message(update: Update, context: CallbackContext):
             user_context["last_generated_code_language"] = None
             return
         
-        await kirim_ke_telegram(chat_id, context, f"*⚙️ SHELL* Translated shell command: `{perintah_shell}`")
+        if not keputusan_niat["literal_command"]:
+            await kirim_ke_telegram(chat_id, context, f"*⚙️ SHELL* Translated shell command: `{perintah_shell}`")
         user_context["last_ai_response_type"] = "shell"
         user_context["last_command_run"] = perintah_shell
         user_context["last_generated_code"] = None
         user_context["last_generated_code_language"] = None
-        # Call run_shell_observer_telegram and handle return value for ConversationHandler
-        return await run_shell_observer_telegram(perintah_shell, update, context)
+        # Run in the background so the chat stays responsive while the command runs
+        akan_menunggu = SHELL_JOB_MANAGER.akan_menunggu(chat_id)
+        job = SHELL_JOB_MANAGER.submit(perintah_shell, update, context)
+        if job is None:
+            await kirim_ke_telegram(chat_id, context, f"*❗ BUSY* Too many jobs are waiting. Check `/jobs` or stop one with `/kill <id>`.")
+            return
+        if akan_menunggu:
+            await kirim_ke_telegram(chat_id, context, f"*⏳ JOB* Job #{job.id} queued; it starts when a running job finishes. See `/jobs`.")
+        return
 
     elif niat == "program":
         await kirim_ke_telegram(chat_id, context, f"*✨ PROGRAM* Intent detected: Program Creation. Starting code generation for: `{user_message}`")
         
         target_lang_from_prompt = deteksi_bahasa_dari_prompt(user_message)
 
-        success_code, kode_tergenerasi, detected_language = minta_kode(user_message, chat_id=chat_id, target_language=target_lang_from_prompt)
+        stream_kode = None
+        if respons_terstruktur:
+            success_code, kode_tergenerasi, detected_language = True, respons_terstruktur["code"], respons_terstruktur["language"]
+        else:
+            stream_kode = TelegramStreamMessage(chat_id, context, formatter=lambda teks: f"*📋 GENERATED CODE*\n{teks}") if LLM_STREAMING_ENABLED else None
+            success_code, kode_tergenerasi, detected_language = await minta_kode_async(user_message, chat_id=chat_id, target_language=target_lang_from_prompt, on_delta=stream_kode.on_delta if stream_kode else None)
+            if stream_kode and stream_kode.teks:
+                # Replace the streamed raw answer with the extracted code block
+                await stream_kode.finish(f"*📋 GENERATED CODE*\n```{detected_language}\n{kode_tergenerasi}\n```" if success_code else None)
 
         if not success_code:
             await kirim_ke_telegram(chat_id, context, f"*🔴 CODE GENERATION ERROR* An issue occurred while generating code:\n```\n{kode_tergenerasi}\n```")
@@ -1073,7 +4484,10 @@ async def handle_text_message(update: Update, context: CallbackContext):
             user_context["last_generated_code_language"] = None
             return
         
-        generated_file_name = generate_filename(user_message, detected_language)
+        if respons_terstruktur:
+            generated_file_name = _nama_file_unik(respons_terstruktur["filename"])
+        else:
+            generated_file_name = await generate_filename_async(user_message, detected_language)
         simpan_ok = simpan_ke_file(generated_file_name, kode_tergenerasi)
 
         if simpan_ok:
@@ -1104,29 +4518,33 @@ async def handle_text_message(update: Update, context: CallbackContext):
             if run_command_suggestion:
                 await kirim_ke_telegram(chat_id, context, f"*And run with:* {run_command_suggestion}")
 
-            await kirim_ke_telegram(chat_id, context, f"*📋 GENERATED CODE*\n```{detected_language}\n{kode_tergenerasi}\n```")
+            if not stream_kode:
+                await kirim_ke_telegram(chat_id, context, f"*📋 GENERATED CODE*\n```{detected_language}\n{kode_tergenerasi}\n```")
         else:
             await kirim_ke_telegram(chat_id, context, f"*🔴 FILE ERROR* Failed to save generated code to file.")
             user_context["last_ai_response_type"] = None
             user_context["last_generated_code"] = None
             user_context["last_generated_code_language"] = None
-        return ConversationHandler.END
+        return
             
 
     else: # niat == "conversation"
         await kirim_ke_telegram(chat_id, context, f"*💬 GENERAL CONVERSATION* Intent detected: General Conversation. Requesting AI answer...")
-        success_response, jawaban_llm = minta_jawaban_konversasi(chat_id, user_message)
+        stream_jawaban = TelegramStreamMessage(chat_id, context, formatter=lambda teks: f"*💬 AI RESPONSE*\n{teks}") if LLM_STREAMING_ENABLED else None
+        success_response, jawaban_llm = await minta_jawaban_konversasi_async(chat_id, user_message, on_delta=stream_jawaban.on_delta if stream_jawaban else None)
         user_context["last_ai_response_type"] = "conversation"
         user_context["last_command_run"] = None
         user_context["last_generated_code"] = None
         user_context["last_generated_code_language"] = None
         
+        if stream_jawaban and stream_jawaban.teks:
+            await stream_jawaban.finish()
         if not success_response:
             await kirim_ke_telegram(chat_id, context, f"*🔴 AI ERROR* An issue occurred while processing the conversation:\n```\n{jawaban_llm}\n```")
             logger.error(f"[Error] Conversation Failed: {jawaban_llm}")
-        else:
+        elif not stream_jawaban:
             await kirim_ke_telegram(chat_id, context, f"*💬 AI RESPONSE*\n{jawaban_llm}")
-        return ConversationHandler.END
+        return
 
 
 async def handle_unknown_command(update: Update, context: CallbackContext):
@@ -1136,103 +4554,167 @@ async def handle_unknown_command(update: Update, context: CallbackContext):
     logger.warning(f"[Command] ⚠ Unknown command from {chat_id}: {update.message.text}")
 
 # === Debugging Conversation Handler ===
-async def ask_for_debug_response(update: Update, context: CallbackContext):
-    """Asks for a Yes/No response from the user for debugging."""
-    chat_id = update.effective_chat.id
-    user_context = get_user_context(chat_id)
-    
-    if user_context["awaiting_debug_response"]:
-        user_response = update.message.text.strip().lower()
-        if user_response in ["ya", "yes"]:
-            await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
-            await kirim_ke_telegram(chat_id, context, f"*🧠 AI DEBUGGING* Starting debugging session...")
-            logger.info(f"{COLOR_BLUE}[Debug] Starting debugging for {chat_id}{COLOR_RESET}")
-            
-            error_log = user_context["last_error_log"]
-            last_command = user_context["last_command_run"]
-            last_generated_code_lang = user_context["last_generated_code_language"]
+async def debug_dengan_ai(chat_id: int, context: CallbackContext, error_log: str, last_command: str):
+    """Asks the LLM to fix the program that produced `error_log` and saves the fix to a file."""
+    await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
+    await kirim_ke_telegram(chat_id, context, f"*🧠 AI DEBUGGING* Starting debugging session...")
+    logger.info(f"{COLOR_BLUE}[Debug] Starting debugging for {chat_id}{COLOR_RESET}")
 
-            if error_log:
-                await kirim_ke_telegram(chat_id, context, f"*🧠 AI DEBUGGING* Requesting LLM to analyze error and provide fix/new code...")
-                success_debug, debug_saran, debug_lang = minta_kode(prompt="", error_context=error_log, chat_id=chat_id, target_language=last_generated_code_lang)
-                
-                if not success_debug:
-                    await kirim_ke_telegram(chat_id, context, f"*🔴 DEBUGGING ERROR* An issue occurred during debugging:\n```\n{debug_saran}\n```")
-                    logger.error(f"[Debug] Debug Failed: {debug_saran}")
+    user_context = get_user_context(chat_id)
+    last_generated_code_lang = user_context["last_generated_code_language"]
+
+    if error_log:
+        await kirim_ke_telegram(chat_id, context, f"*🧠 AI DEBUGGING* Requesting LLM to analyze error and provide fix/new code...")
+        stream_debug = TelegramStreamMessage(chat_id, context, formatter=lambda teks: f"*📋 FIX CODE*\n{teks}") if LLM_STREAMING_ENABLED else None
+        success_debug, debug_saran, debug_lang = await minta_kode_async(prompt="", error_context=error_log, chat_id=chat_id, target_language=last_generated_code_lang, on_delta=stream_debug.on_delta if stream_debug else None)
+        if stream_debug and stream_debug.teks:
+            await stream_debug.finish(f"*📋 FIX CODE*\n```{debug_lang}\n{debug_saran}\n```" if success_debug else None)
+
+        if not success_debug:
+            await kirim_ke_telegram(chat_id, context, f"*🔴 DEBUGGING ERROR* An issue occurred during debugging:\n```\n{debug_saran}\n```")
+            logger.error(f"[Debug] Debug Failed: {debug_saran}")
+        else:
+            # Try to extract filename from the last executed command
+            debug_file_name = None
+            if last_command:
+                match = re.search(r"^(python|sh|bash|node|php|\./)\s+(\S+\.(py|sh|js|rb|pl|php|java|c|cpp|html|css|txt))", last_command, re.IGNORECASE)
+                if match:
+                    debug_file_name = match.group(2)
+
+            if not debug_file_name:
+                # If unable to extract from command, create a new filename
+                debug_file_name = await generate_filename_async("bug_fix", debug_lang)
+
+
+            simpan_ok = simpan_ke_file(debug_file_name, debug_saran)
+            if simpan_ok:
+                user_context["last_generated_code"] = debug_saran
+                user_context["last_generated_code_language"] = debug_lang
+                user_context["last_ai_response_type"] = "program"
+                await kirim_ke_telegram(chat_id, context, f"*✅ SUCCESS* AI has generated a fix/new code to `{debug_file_name}`.")
+
+                run_command_suggestion = ""
+                if debug_lang == "python":
+                    run_command_suggestion = f"`python {debug_file_name}`"
+                elif debug_lang == "bash":
+                    run_command_suggestion = f"`bash {debug_file_name}` or `chmod +x {debug_file_name} && ./{debug_file_name}`"
+                elif debug_lang == "javascript":
+                    run_command_suggestion = f"`node {debug_file_name}` (ensure Node.js is installed)"
+                elif debug_lang == "html":
+                    run_command_suggestion = f"Open this file in your web browser."
+                elif debug_lang == "php":
+                    run_command_suggestion = f"`php {debug_file_name}` (ensure PHP is installed)"
+                elif debug_lang == "java":
+                    run_command_suggestion = f"Compile with `javac {debug_file_name}` then run with `java {debug_file_name.replace('.java', '')}`"
+                elif debug_lang in ["c", "cpp"]:
+                    run_command_suggestion = f"Compile with `gcc {debug_file_name} -o a.out` then run with `./a.out`"
+
+                fix_code_block = "" if stream_debug else f"\n\n*📋 FIX CODE*\n```{debug_lang}\n{debug_saran}\n```"
+                if run_command_suggestion:
+                    await kirim_ke_telegram(chat_id, context, f"*Please review and try running again with:* {run_command_suggestion}{fix_code_block}")
                 else:
-                    # Try to extract filename from the last executed command
-                    debug_file_name = None
-                    if last_command:
-                        match = re.search(r"^(python|sh|bash|node|php|\./)\s+(\S+\.(py|sh|js|rb|pl|php|java|c|cpp|html|css|txt))", last_command, re.IGNORECASE)
-                        if match:
-                            debug_file_name = match.group(2)
-                    
-                    if not debug_file_name:
-                        # If unable to extract from command, create a new filename
-                        debug_file_name = generate_filename("bug_fix", debug_lang)
-
-
-                    simpan_ok = simpan_ke_file(debug_file_name, debug_saran)
-                    if simpan_ok:
-                        user_context["last_generated_code"] = debug_saran
-                        user_context["last_generated_code_language"] = debug_lang
-                        user_context["last_ai_response_type"] = "program"
-                        await kirim_ke_telegram(chat_id, context, f"*✅ SUCCESS* AI has generated a fix/new code to `{debug_file_name}`.")
-                        
-                        run_command_suggestion = ""
-                        if debug_lang == "python":
-                            run_command_suggestion = f"`python {debug_file_name}`"
-                        elif debug_lang == "bash":
-                            run_command_suggestion = f"`bash {debug_file_name}` or `chmod +x {debug_file_name} && ./{debug_file_name}`"
-                        elif debug_lang == "javascript":
-                            run_command_suggestion = f"`node {debug_file_name}` (ensure Node.js is installed)"
-                        elif debug_lang == "html":
-                            run_command_suggestion = f"Open this file in your web browser."
-                        elif debug_lang == "php":
-                            run_command_suggestion = f"`php {debug_file_name}` (ensure PHP is installed)"
-                        elif debug_lang == "java":
-                            run_command_suggestion = f"Compile with `javac {debug_file_name}` then run with `java {debug_file_name.replace('.java', '')}`"
-                        elif debug_lang in ["c", "cpp"]:
-                            run_command_suggestion = f"Compile with `gcc {debug_file_name} -o a.out` then run with `./a.out`"
-
-                        if run_command_suggestion:
-                            await kirim_ke_telegram(chat_id, context, f"*Please review and try running again with:* {run_command_suggestion}\n\n*📋 FIX CODE*\n```{debug_lang}\n{debug_saran}\n```")
-                        else:
-                            await kirim_ke_telegram(chat_id, context, f"*Please review and try running again. *\n\n*📋 FIX CODE*\n```{debug_lang}\n{debug_saran}\n```")
+                    await kirim_ke_telegram(chat_id, context, f"*Please review and try running again. *{fix_code_block}")
 
-                    else:
-                        await kirim_ke_telegram(chat_id, context, f"*🔴 FILE ERROR* Failed to save generated fix code to file.")
-                        user_context["last_generated_code"] = None
-                        user_context["last_ai_response_type"] = None
-                        user_context["last_generated_code_language"] = None
             else:
-                await kirim_ke_telegram(chat_id, context, f"*💬 INFO* No error log available for debugging.")
-            
-            user_context["last_error_log"] = None
-            user_context["last_command_run"] = None
-            user_context["awaiting_debug_response"] = False
-            user_context["full_error_output"] = []
-            return ConversationHandler.END
-        elif user_response in ["tidak", "no"]:
-            await kirim_ke_telegram(chat_id, context, f"*💬 INFO* Debugging canceled.")
-            logger.info(f"{COLOR_GREEN}[Debug] Debugging canceled by {chat_id}{COLOR_RESET}")
-            user_context["last_error_log"] = None
-            user_context["last_command_run"] = None
-            user_context["awaiting_debug_response"] = False
-            user_context["full_error_output"] = []
-            return ConversationHandler.END
-        else:
-            await kirim_ke_telegram(chat_id, context, f"*❓ INVALID RESPONSE* Please answer 'Yes' or 'No'.")
-            return DEBUGGING_STATE
+                await kirim_ke_telegram(chat_id, context, f"*🔴 FILE ERROR* Failed to save generated fix code to file.")
+                user_context["last_generated_code"] = None
+                user_context["last_ai_response_type"] = None
+                user_context["last_generated_code_language"] = None
+    else:
+        await kirim_ke_telegram(chat_id, context, f"*💬 INFO* No error log available for debugging.")
+
+async def handle_debug_callback(update: Update, context: CallbackContext):
+    """Handles the Yes/No buttons of a failed job's debug question (callback data `debug:<key>:yes|no`)."""
+    query = update.callback_query
+    chat_id = update.effective_chat.id
+    await query.answer()
+    if str(chat_id) != TELEGRAM_CHAT_ID:
+        await kirim_ke_telegram(chat_id, context, f"*❗ ACCESS DENIED* You are not authorized to use this feature. Contact the bot admin.")
+        logger.warning(f"[Auth] ⚠ Unauthorized access attempt debug callback from {chat_id}.")
+        return
+
+    _, kunci, jawaban = query.data.split(":", 2)
+    tertunda = get_user_context(chat_id).setdefault("pending_debug", {}).pop(kunci, None)
+    try:
+        # Each question is answered once; drop its buttons
+        await query.edit_message_reply_markup(reply_markup=None)
+    except TelegramError as e:
+        logger.warning(f"[Debug] Could not remove the debug buttons: {e}")
+    if tertunda is None:
+        await kirim_ke_telegram(chat_id, context, f"*💬 INFO* This debug question has already been answered or has expired.")
+    elif jawaban == "yes":
+        await debug_dengan_ai(chat_id, context, tertunda["error_log"], tertunda["command"])
     else:
-        # If not in debugging state, proceed to regular handle_text_message
-        return await handle_text_message(update, context)
+        await kirim_ke_telegram(chat_id, context, f"*💬 INFO* Debugging canceled for job #{tertunda['job']}.")
+        logger.info(f"{COLOR_GREEN}[Debug] Debugging of job #{tertunda['job']} canceled by {chat_id}{COLOR_RESET}")
+
+
+async def post_stop(application: Application):
+    """Stops background shell jobs, writes pending sessions and delivers queued Telegram messages while the bot can still send them."""
+    await SHELL_JOB_MANAGER.hentikan_semua()
+    await asyncio.to_thread(SESSION_STORE.flush)
+    await TELEGRAM_SEND_QUEUE.tunggu_kosong(timeout=10)
+    if TELEGRAM_SEND_QUEUE.kedalaman():
+        logger.warning(f"[Telegram] ⚠ {TELEGRAM_SEND_QUEUE.kedalaman()} queued message(s) not delivered before shutdown.")
+
+async def post_shutdown(application: Application):
+    """Releases pooled resources once the bot has stopped polling."""
+    if _SERVER_METRIK is not None:
+        _SERVER_METRIK.close()
+    await close_llm_http_client()
+    logger.info(f"[LLM] HTTP connection pool closed.")
+
+
+_SERVER_METRIK = None
+
+def laporan_startup() -> str:
+    """Formats STARTUP_TIMINGS as one line, e.g. "ready in 0.41s (system_info 0.002s, build 0.120s, ...)"."""
+    tahap = ", ".join(f"{nama} {detik:.3f}s" for nama, detik in STARTUP_TIMINGS.items() if nama != "ready")
+    return f"ready in {STARTUP_TIMINGS.get('ready', 0.0):.2f}s ({tahap})"
+
+async def post_init(application: Application):
+    """Starts the optional metrics endpoint and reports the startup timings once the bot is about to poll."""
+    global _SERVER_METRIK
+    _SERVER_METRIK = await mulai_server_metrik()
+    STARTUP_TIMINGS["initialize"] = time.perf_counter() - STARTUP_TIMINGS.pop("_initialize_start", time.perf_counter())
+    STARTUP_TIMINGS["ready"] = time.perf_counter() - STARTUP_TIMINGS.pop("_main_start", time.perf_counter())
+    logger.info(f"{COLOR_GREEN}[Startup] Bot {laporan_startup()}{COLOR_RESET}")
+
+
+def bangun_aplikasi(builder) -> Application:
+    """Builds the Application from an ApplicationBuilder that already has its token, and registers every handler."""
+    # Build Application with JobQueue without explicit tzinfo in its constructor. Updates are
+    # handled concurrently (up to TELEGRAM_CONCURRENT_UPDATES); per-chat state lives in
+    # SESSION_STORE and per-job state in ShellJobManager, so no handler relies on update order
+    application = (builder.concurrent_updates(TELEGRAM_CONCURRENT_UPDATES).job_queue(JobQueue())
+                   .post_init(post_init).post_stop(post_stop).post_shutdown(post_shutdown).build())
+
+    # Write-behind for the session store
+    application.job_queue.run_repeating(simpan_sesi_berkala, interval=SESSION_FLUSH_INTERVAL, first=SESSION_FLUSH_INTERVAL, name="session_flush")
+
+    application.add_handler(CommandHandler("start", start_command))
+    application.add_handler(CommandHandler("listfiles", handle_listfiles_command))
+    application.add_handler(CommandHandler("deletefile", handle_deletefile_command))
+    application.add_handler(CommandHandler("clear_chat", handle_clear_chat_command))
+    application.add_handler(CommandHandler("intent_stats", handle_intent_stats_command))
+    application.add_handler(CommandHandler("cache_stats", handle_cache_stats_command))
+    application.add_handler(CommandHandler("error_cache", handle_error_cache_command))
+    application.add_handler(CommandHandler("queue_stats", handle_queue_stats_command))
+    application.add_handler(CommandHandler("stats", handle_stats_command))
+    application.add_handler(CommandHandler("jobs", handle_jobs_command))
+    application.add_handler(CommandHandler("kill", handle_kill_command))
+    application.add_handler(CommandHandler("tail", handle_tail_command))
+    application.add_handler(CallbackQueryHandler(handle_debug_callback, pattern=r"^debug:"))
+
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
+
+    application.add_handler(MessageHandler(filters.COMMAND, handle_unknown_command))
+    return application
 
 
 def main():
     """Main function to start the Telegram bot."""
-    # Call function to check system information at startup
-    check_system_info()
+    STARTUP_TIMINGS["_main_start"] = time.perf_counter()
 
     if not TELEGRAM_BOT_TOKEN:
         logger.error(f"ERROR: TELEGRAM_BOT_TOKEN is not set. Please set the environment variable or enter it directly.")
@@ -1248,28 +4730,16 @@ def main():
     logger.info(f"Using TOKEN: {'*' * (len(TELEGRAM_BOT_TOKEN) - 5) + TELEGRAM_BOT_TOKEN[-5:] if len(TELEGRAM_BOT_TOKEN) > 5 else TELEGRAM_BOT_TOKEN}")
     logger.info(f"Allowed Chat ID: {TELEGRAM_CHAT_ID}")
 
-    # Build Application with JobQueue without explicit tzinfo in its constructor
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).job_queue(JobQueue()).build()
+    # Cached system profile, or detection in the background; never blocks or installs anything
+    mulai = time.perf_counter()
+    profil_tersimpan = check_system_info()
+    STARTUP_TIMINGS["system_info" if profil_tersimpan else "system_info_started"] = time.perf_counter() - mulai
 
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CommandHandler("listfiles", handle_listfiles_command))
-    application.add_handler(CommandHandler("deletefile", handle_deletefile_command))
-    application.add_handler(CommandHandler("clear_chat", handle_clear_chat_command))
-    
-    conv_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.TEXT & ~filters.COMMAND, ask_for_debug_response)],
-        states={
-            DEBUGGING_STATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_for_debug_response)],
-        },
-        fallbacks=[CommandHandler('cancel', lambda update, context: ConversationHandler.END)]
-    )
-    application.add_handler(conv_handler)
-    
-    # Text message handler must be placed after ConversationHandler so ConversationHandler has priority
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
-    
-    application.add_handler(MessageHandler(filters.COMMAND, handle_unknown_command))
+    mulai = time.perf_counter()
+    application = bangun_aplikasi(Application.builder().token(TELEGRAM_BOT_TOKEN))
 
+    STARTUP_TIMINGS["build"] = time.perf_counter() - mulai
+    STARTUP_TIMINGS["_initialize_start"] = time.perf_counter()
     logger.info(f"{COLOR_GREEN}Bot is running. Press Ctrl+C to stop.{COLOR_RESET}")
     # Use run_polling directly, as it manages its own event loop
     application.run_polling(allowed_updates=Update.ALL_TYPES)
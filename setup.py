@@ -5,12 +5,12 @@ long_description = (Path(__file__).parent / "README.md").read_text(encoding="utf
 setup(
     name='neuronet-ai-cognitiveshell',
     version='0.2.6',
-    packages=find_packages(),
+    packages=find_packages(exclude=("tests", "tests.*")),
     install_requires=[
     "python-telegram-bot>=20.0",
     "python-dotenv>=0.21.0",
     "pexpect>=4.8",
-    "requests>=2.25",
+    "httpx>=0.23",
     "pytz>=2022.1"
     ],
     entry_points={
@@ -0,0 +1,41 @@
+"""
+Shared fixtures. The bot reads its configuration at import time, so the environment is pointed
+at a scratch directory (and away from any real bot, API key or session database) before
+cognitive_shell.cognitveshell is imported.
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from tests.support import siapkan_lingkungan
+
+_DIREKTORI = tempfile.mkdtemp(prefix="cognitiveshell-test-")
+siapkan_lingkungan(_DIREKTORI, "http://127.0.0.1:9/v1/chat/completions")
+# Short back-offs keep the retry tests fast; Retry-After still sets the lower bound
+os.environ.update({"LLM_RETRY_BASE_DELAY": "0.05", "LLM_RETRY_MAX_DELAY": "0.2"})
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_DIREKTORI, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def cs():
+    from cognitive_shell import cognitveshell
+    return cognitveshell
+
+
+@pytest.fixture
+def jalankan(cs):
+    """Runs a coroutine on a fresh event loop and closes that loop's pooled HTTP client afterwards."""
+    def _jalankan(coro):
+        async def utama():
+            try:
+                return await coro
+            finally:
+                await cs.close_llm_http_client()
+        return asyncio.run(utama())
+    return _jalankan
@@ -0,0 +1,308 @@
+"""
+Test doubles shared by the test suite and the offline benchmark (benchmark.py): a local
+OpenAI-compatible LLM server with scripted failures, an in-process fake Telegram bot, and a
+MarkdownV2 validator that parses messages the way the Bot API does. Not part of the
+installed package.
+"""
+import asyncio
+import itertools
+import json
+import os
+import re
+import time
+
+CHAT_ID = 1000001
+
+_KATA_ISI = ("the quick brown fox jumps over a lazy dog while processes and threads share memory "
+             "differently so each answer explains scheduling context switches and isolation").split()
+
+
+# === Stub LLM server (OpenAI-compatible) ===
+class StubLLMServer:
+    """
+    Minimal HTTP/1.1 server answering POST /v1/chat/completions like OpenRouter does,
+    plain or as an SSE stream. `latency` is the time to the first byte and `token_rate`
+    the number of tokens per second after it. Answers depend on the system prompt so every
+    pipeline step (intent, translation, code, debugging, conversation) gets a usable reply.
+
+    `kegagalan` scripts failures for the next requests, one item per request: an HTTP status,
+    a (status, retry_after) pair, "hang" (never answers) or "reset" (drops the connection).
+    Once it is exhausted the server answers normally; itertools.repeat(503) keeps it down.
+    """
+
+    def __init__(self, latency: float = 0.3, token_rate: float = 80.0, response_tokens: int = 60, host: str = "127.0.0.1", port: int = 0, kegagalan=()):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.response_tokens = response_tokens
+        self.host = host
+        self.port = port
+        self.kegagalan = iter(kegagalan)
+        self.requests = 0
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1/chat/completions"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._layani, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def jawaban(self, body: dict) -> str:
+        """Picks a plausible answer for the pipeline step the request belongs to."""
+        messages = body.get("messages") or [{}]
+        sistem = str(messages[0].get("content", ""))
+        pengguna = str(messages[-1].get("content", "")).lower()
+        if "intent detector" in sistem:
+            if any(k in pengguna for k in ("function", "code", "script", "program")):
+                return "program"
+            if any(k in pengguna for k in ("folder", "file", "list", "tampilkan", "delete")):
+                return "shell"
+            return "conversation"
+        if "shell command translator" in sistem:
+            return "ls -la"
+        if "filename generator" in sistem:
+            return "add_numbers"
+        if "request router" in sistem:
+            return json.dumps({"intent": "program", "language": "python", "filename": "add_numbers",
+                               "code": "def add(a, b):\n    return a + b\n", "command": None})
+        if "coding assistant" in sistem or "debugger" in sistem:
+            badan = "\n".join(f"    # step {i}" for i in range(max(1, self.response_tokens // 4)))
+            return f"```python\ndef add(a, b):\n{badan}\n    return a + b\n```"
+        return " ".join(itertools.islice(itertools.cycle(_KATA_ISI), self.response_tokens))
+
+    async def _layani(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    kepala = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                panjang = 0
+                for baris in kepala.decode("latin-1").split("\r\n"):
+                    nama, _, nilai = baris.partition(":")
+                    if nama.lower() == "content-length":
+                        panjang = int(nilai.strip())
+                body = json.loads(await reader.readexactly(panjang)) if panjang else {}
+                self.requests += 1
+                gagal = next(self.kegagalan, None)
+                if gagal is None:
+                    await self._jawab(writer, body)
+                elif not await self._gagal(writer, gagal):
+                    return
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _gagal(self, writer: asyncio.StreamWriter, gagal) -> bool:
+        """Plays one scripted failure. Returns False when the connection must be dropped."""
+        if gagal == "reset":
+            return False
+        if gagal == "hang":
+            await asyncio.sleep(3600)
+            return False
+        status, retry_after = gagal if isinstance(gagal, tuple) else (gagal, None)
+        data = json.dumps({"error": {"code": status, "message": "simulated failure"}}).encode()
+        tambahan = f"Retry-After: {retry_after}\r\n" if retry_after is not None else ""
+        writer.write(f"HTTP/1.1 {status} Error\r\nContent-Type: application/json\r\n{tambahan}Content-Length: {len(data)}\r\n\r\n".encode() + data)
+        await writer.drain()
+        return True
+
+    async def _jawab(self, writer: asyncio.StreamWriter, body: dict):
+        isi = self.jawaban(body)
+        # Whitespace-separated words approximate tokens well enough for pacing
+        token = [t + " " for t in isi.split(" ")]
+        token[-1] = token[-1].rstrip(" ")
+        jeda = 1.0 / self.token_rate if self.token_rate > 0 else 0.0
+        await asyncio.sleep(self.latency)
+        if body.get("stream"):
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+            for t in token:
+                data = f"data: {json.dumps({'choices': [{'delta': {'content': t}}]})}\n\n".encode()
+                writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                await writer.drain()
+                if jeda:
+                    await asyncio.sleep(jeda)
+            data = b"data: [DONE]\n\n"
+            writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n0\r\n\r\n")
+        else:
+            await asyncio.sleep(jeda * len(token))
+            data = json.dumps({"choices": [{"message": {"role": "assistant", "content": isi}}],
+                               "usage": {"prompt_tokens": 0, "completion_tokens": len(token)}}).encode()
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n" % len(data) + data)
+        await writer.drain()
+
+
+# === Fake Telegram bot ===
+class _Pesan:
+    def __init__(self, message_id: int):
+        self.message_id = message_id
+
+class FakeBot:
+    """Records every Bot API call with a timestamp; `latency` simulates the round trip."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = []
+        self._ids = itertools.count(1)
+
+    async def _catat(self, jenis: str, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.calls.append((time.perf_counter(), jenis, kwargs))
+
+    async def send_message(self, chat_id, text, parse_mode=None, **kwargs):
+        await self._catat("send", chat_id=chat_id, size=len(text), reply_markup=kwargs.get("reply_markup"))
+        return _Pesan(next(self._ids))
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, parse_mode=None, **kwargs):
+        await self._catat("edit", chat_id=chat_id, size=len(text))
+
+    async def delete_message(self, chat_id, message_id, **kwargs):
+        await self._catat("delete", chat_id=chat_id)
+        return True
+
+    async def send_chat_action(self, chat_id, action, **kwargs):
+        # Not a message; not counted
+        return True
+
+class _Chat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+
+class _Message:
+    def __init__(self, text: str):
+        self.text = text
+
+class _CallbackQuery:
+    def __init__(self, data: str):
+        self.data = data
+
+    async def answer(self, *args, **kwargs):
+        return True
+
+    async def edit_message_reply_markup(self, reply_markup=None, **kwargs):
+        return True
+
+class FakeUpdate:
+    """A text message, or an inline-button press when `callback_data` is given."""
+
+    def __init__(self, text: str = "", chat_id: int = CHAT_ID, callback_data: str = None):
+        self.effective_chat = _Chat(chat_id)
+        self.message = _Message(text)
+        self.callback_query = _CallbackQuery(callback_data) if callback_data is not None else None
+
+class FakeContext:
+    def __init__(self, bot: FakeBot, args: list = None):
+        self.bot = bot
+        self.args = args or []
+
+
+# === MarkdownV2 validation ===
+def periksa_markdown_v2(teks: str) -> tuple:
+    """
+    Parses `teks` like the Bot API parses MarkdownV2 and returns (error, visible text); error is
+    None if Telegram would accept it. Covers bold, italic, underline, strikethrough, spoiler, code
+    and pre; links and blockquotes are never sent by the bot, so '[' and '>' must be escaped.
+    """
+    terlihat = []
+    terbuka = []  # [marker, visible length when opened]
+    i, n = 0, len(teks)
+    while i < n:
+        c = teks[i]
+        if c == "\\":
+            if i + 1 >= n:
+                return "trailing backslash", ""
+            terlihat.append(teks[i + 1])
+            i += 2
+        elif c == "\r":
+            i += 1
+        elif c == "`":
+            pre = teks.startswith("```", i)
+            if terbuka:
+                return f"{'pre' if pre else 'code'} inside {terbuka[-1][0]}", ""
+            i += 3 if pre else 1
+            if pre:
+                bahasa = re.match(r'\w*\n', teks[i:])
+                if bahasa:
+                    terlihat.append(bahasa.group()[:-1])
+                    i += bahasa.end()
+            awal = len(terlihat)
+            while True:
+                if i >= n:
+                    return f"unclosed {'pre' if pre else 'code'}", ""
+                if teks[i] == "\\" and i + 1 < n:
+                    terlihat.append(teks[i + 1])
+                    i += 2
+                elif teks[i] == "`":
+                    if not pre:
+                        i += 1
+                        break
+                    if teks.startswith("```", i):
+                        i += 3
+                        break
+                    return "unescaped ` in pre", ""
+                else:
+                    terlihat.append(teks[i])
+                    i += 1
+            if len(terlihat) == awal and not pre:
+                return "empty code", ""
+        elif c in "*_~|":
+            penanda = teks[i:i + 2] if c in "_|" and teks.startswith(c * 2, i) else c
+            if penanda == "|":
+                return "unescaped '|'", ""
+            if terbuka and terbuka[-1][0] == penanda:
+                if terbuka.pop()[1] == len(terlihat):
+                    return f"empty {penanda} entity", ""
+            elif any(p == penanda for p, _ in terbuka):
+                return f"crossing {penanda} entities", ""
+            else:
+                terbuka.append((penanda, len(terlihat)))
+            i += len(penanda)
+        elif c in "[]()>#+-=|{}.!":
+            return f"unescaped {c!r}", ""
+        else:
+            terlihat.append(c)
+            i += 1
+    if terbuka:
+        return f"unclosed {terbuka[-1][0]} entity", ""
+    return None, "".join(terlihat)
+
+POTONGAN_FUZZ = ["word", "snake_case_name", " ", " ", "\n", "*", "**", "_", "__", "`", "``", "```", "```python\n", "\\",
+                  ".", "-", "!", "(", ")", "[", "]", "#", "~", "|", ">", "{", "}", "=", "+", "2 * 3", "* item\n",
+                  "\033[31m", "\033[0m", "✅", "C:\\path\\file.py", "x__y", "**bold**", "_it_"]
+
+def tanpa_markup(teks: str) -> str:
+    return re.sub(r'[*_`\n\r]', '', teks)
+
+
+# === Environment ===
+def siapkan_lingkungan(direktori: str, url: str, cache: bool = False, rate_limit: bool = False):
+    """
+    Points the bot at the stub and a scratch directory. Must run before cognitive_shell.cognitveshell
+    is imported, because configuration is read at import time.
+    """
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "benchmark",
+        "TELEGRAM_CHAT_ID": str(CHAT_ID),
+        "OPENROUTER_API_KEY": "benchmark",
+        "LLM_BASE_URL": url,
+        "LLM_CACHE_ENABLED": "true" if cache else "false",
+        "ERROR_CACHE_ENABLED": "true" if cache else "false",
+        "LLM_CACHE_PATH": os.path.join(direktori, "llm_cache.sqlite3"),
+        "SESSION_DB_PATH": os.path.join(direktori, "sessions.sqlite3"),
+        "SYSTEM_PROFILE_PATH": os.path.join(direktori, "system_profile.json"),
+        "ERROR_RULES_PATH": os.path.join(direktori, "error_rules.json"),
+        "SYSTEM_INFO_NEOFETCH": "false",
+    })
+    if not rate_limit:
+        # Measure the bot, not Telegram's flood limits
+        os.environ.update({"TELEGRAM_CHAT_RATE": "10000", "TELEGRAM_CHAT_BURST": "10000",
+                           "TELEGRAM_GLOBAL_RATE": "10000", "TELEGRAM_GLOBAL_BURST": "10000"})
@@ -0,0 +1,74 @@
+"""Updates are handled concurrently: a slow LLM answer in one update does not hold up the next."""
+import asyncio
+import json
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+from tests.support import CHAT_ID, StubLLMServer
+
+
+class BotApiPalsu(BaseRequest):
+    """Answers Bot API calls locally: getMe, and every send with a plausible message."""
+
+    def __init__(self):
+        self.metode = []
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return 5.0
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        nama = url.rsplit("/", 1)[-1]
+        self.metode.append(nama)
+        if nama == "getMe":
+            hasil = {"id": 1, "is_bot": True, "first_name": "test", "username": "test_bot"}
+        elif nama in ("sendMessage", "editMessageText"):
+            hasil = {"message_id": len(self.metode), "date": 0, "chat": {"id": CHAT_ID, "type": "private"}, "text": "ok"}
+        else:
+            hasil = True
+        return 200, json.dumps({"ok": True, "result": hasil}).encode()
+
+
+def pesan(update_id: int, teks: str) -> dict:
+    data = {"message_id": update_id, "date": 0, "text": teks,
+            "chat": {"id": CHAT_ID, "type": "private"}, "from": {"id": CHAT_ID, "is_bot": False, "first_name": "user"}}
+    if teks.startswith("/"):
+        data["entities"] = [{"type": "bot_command", "offset": 0, "length": len(teks.split()[0])}]
+    return {"update_id": update_id, "message": data}
+
+
+def test_command_is_handled_while_an_llm_call_is_pending(cs, jalankan, monkeypatch):
+    api = BotApiPalsu()
+    application = cs.bangun_aplikasi(Application.builder().token("123:test").request(api).get_updates_request(BotApiPalsu()))
+    assert application.update_processor.max_concurrent_updates == cs.TELEGRAM_CONCURRENT_UPDATES > 1
+
+    async def proses(data: dict):
+        update = Update.de_json(data, application.bot)
+        await application.update_processor.process_update(update, application.process_update(update))
+
+    async def skenario():
+        server = await StubLLMServer(latency=1.0, token_rate=0, response_tokens=5).start()
+        monkeypatch.setattr(cs, "LLM_BASE_URL", server.url)
+        await application.initialize()
+        try:
+            lambat = asyncio.ensure_future(proses(pesan(1, "what is the difference between a process and a thread?")))
+            await asyncio.sleep(0.2)
+            assert server.requests == 1
+            # /jobs answers right away although the first update is still waiting for the LLM
+            await asyncio.wait_for(proses(pesan(2, "/jobs")), timeout=0.5)
+            assert not lambat.done()
+            await asyncio.wait_for(lambat, timeout=10)
+        finally:
+            await cs.TELEGRAM_SEND_QUEUE.tunggu_kosong(CHAT_ID)
+            await application.shutdown()
+            await server.close()
+
+    jalankan(skenario())
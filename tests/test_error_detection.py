@@ -0,0 +1,91 @@
+"""
+The error detection engine: rules per language turn output into error blocks, and the batched
+scan finds the same rule on each line as matching every rule line by line would.
+"""
+import random
+import re
+
+import pytest
+
+
+def blok(cs, lines, program=False, mesin=None):
+    detektor = cs.DetektorError(mesin or cs.ERROR_DETECTION_ENGINE, program=program)
+    return [(b["rule"], b["language"], b["start"], b["end"]) for b in detektor.feed(lines) + detektor.selesai()]
+
+
+@pytest.mark.parametrize("lines, diharapkan", [
+    (["starting", "Traceback (most recent call last):", '  File "calc.py", line 3, in <module>', "    1/0",
+      "ZeroDivisionError: division by zero", "bye"],
+     [("python_traceback", "python", 1, 4)]),
+    (["ERROR: Could not find a version that satisfies the requirement nosuchpkg"],
+     [("pip_error", "python", 0, 0)]),
+    (["/app/x.js:3", "  throw new Error('boom')", "  ^", "", "Error: boom", "    at Object.<anonymous> (/app/x.js:3:9)",
+      "    at node:internal/main:1:1", "", "Node.js v20.11.0"],
+     [("node_location", "javascript", 0, 8)]),
+    (["main.c: In function 'main':", "main.c:3:5: error: expected ';' before 'return'", "    3 |   return 0", "      |   ^"],
+     [("gcc_diagnostic", "c", 1, 1)]),
+    (["/usr/bin/ld: main.o: undefined reference to `foo'", "make: *** [Makefile:2: all] Error 1"],
+     [("linker_error", "c", 0, 0), ("make_error", "c", 1, 1)]),
+    (["npm ERR! code ENOENT"], [("npm_error", "npm", 0, 0)]),
+    (["bash: foo: command not found", "Segmentation fault (core dumped)"],
+     [("command_not_found", "shell", 0, 0), ("segfault", "shell", 1, 1)]),
+], ids=["python", "pip", "node", "gcc", "linker", "npm", "shell"])
+def test_rules_per_language(cs, lines, diharapkan):
+    assert blok(cs, lines) == diharapkan
+
+
+def test_generic_keywords_only_apply_to_programs(cs):
+    lines = ["Connection failed, retrying"]
+    assert blok(cs, lines) == []
+    assert blok(cs, lines, program=True) == [("generic_keyword", "generic", 0, 0)]
+
+
+def test_block_spans_batches_and_counts_lines_from_the_start(cs):
+    detektor = cs.DetektorError(cs.ERROR_DETECTION_ENGINE)
+    assert detektor.feed(["ok"] * 10 + ["Traceback (most recent call last):"]) == []
+    selesai = detektor.feed(['  File "a.py", line 1, in <module>', "KeyError: 'x'"])
+    assert [(b["start"], b["end"]) for b in selesai] == [(10, 12)]
+
+
+def test_open_block_closes_after_a_gap_or_at_exit(cs):
+    detektor = cs.DetektorError(cs.ERROR_DETECTION_ENGINE, jeda_maks=2)
+    assert detektor.feed(["Traceback (most recent call last):"]) == []
+    assert [(b["start"], b["end"]) for b in detektor.feed(["quiet"] * 3)] == [(0, 0)]
+    assert detektor.feed(["Traceback (most recent call last):"]) == []
+    assert [(b["start"], b["end"]) for b in detektor.selesai()] == [(4, 4)]
+
+
+def test_invalid_rules_are_skipped(cs):
+    mesin = cs.MesinDeteksiError([
+        {"name": "broken", "pattern": "(unclosed"},
+        {"name": "odd_kind", "kind": "sometimes", "pattern": "x"},
+        {"name": "no_pattern"},
+        {"name": "custom", "language": "go", "pattern": r"^panic: "},
+    ])
+    assert [r["name"] for r in mesin.aturan] == ["custom"]
+    assert blok(cs, ["panic: runtime error: index out of range"], mesin=mesin) == [("custom", "go", 0, 0)]
+
+
+BARIS_FUZZ = [
+    "compiling module", "Traceback (most recent call last):", '  File "x.py", line 3, in f', "ValueError: bad value",
+    "json.decoder.JSONDecodeError: Expecting value", "ERROR: pip failed", "app.js:12", "TypeError: x is not a function",
+    "    at f (/app/app.js:1:2)", "Node.js v18.0.0", "a.c:1:2: error: oops", "  1 | int x", "collect2: error: ld returned 1",
+    "make[2]: *** [all] Error 2", "npm error code E404", "sh: 1: nope: command not found", "Segmentation fault",
+    "PERMISSION DENIED", "no such file or directory", "Fatal: disk full", "all good", "", "error", "an Exception occurred",
+]
+
+
+@pytest.mark.parametrize("program", [False, True])
+def test_batched_scan_matches_line_by_line(cs, program):
+    mesin = cs.ERROR_DETECTION_ENGINE
+    aturan = [(r, re.compile(r["pattern"], re.IGNORECASE if r["ignore_case"] else 0)) for r in mesin.aturan
+              if program or r["scope"] != "program"]
+    acak = random.Random(14)
+    for _ in range(200):
+        lines = [acak.choice(BARIS_FUZZ) for _ in range(acak.randint(1, 30))]
+        diharapkan = []
+        for indeks, line in enumerate(lines):
+            cocok = next((r for r, pola in aturan if pola.search(line)), None)
+            if cocok:
+                diharapkan.append((indeks, cocok["name"]))
+        assert [(i, r["name"]) for i, r in mesin.pindai("\n".join(lines), program)] == diharapkan, lines
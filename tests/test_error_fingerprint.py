@@ -0,0 +1,50 @@
+"""
+sidik_jari_error gives the same fingerprint to the same error seen in another directory, at
+another line, time, PID or address, and a different one to a different error.
+"""
+import pytest
+
+TRACEBACK = 'Traceback (most recent call last):\n  File "{path}/calc.py", line {n}, in <module>\n    main()\n{error}'
+
+
+def sidik(cs, log):
+    return cs.sidik_jari_error(log)[0]
+
+
+def test_traceback_keeps_only_its_error_lines(cs):
+    fingerprint, signature = cs.sidik_jari_error(TRACEBACK.format(path="/home/u/proj", n=12, error="ZeroDivisionError: division by zero"))
+    assert signature == "Traceback (most recent call last):\nZeroDivisionError: division by zero"
+    assert len(fingerprint) == 16 and int(fingerprint, 16) >= 0
+
+
+@pytest.mark.parametrize("a, b, signature", [
+    ("FileNotFoundError: [Errno 2] No such file or directory: '/home/a/data.csv'",
+     "FileNotFoundError: [Errno 2] No such file or directory: '/srv/b/2024/data.csv'",
+     "FileNotFoundError: [Errno 2] No such file or directory: '<path>'"),
+    ("/home/a/main.c:3:5: error: expected ';' before 'return'",
+     "/srv/b/main.c:17:9: error: expected ';' before 'return'",
+     "<path>:<n>: error: expected ';' before 'return'"),
+    ('  File "/home/a/x.py", line 7\nSyntaxError: invalid syntax (x.py, line 7)',
+     '  File "/tmp/x.py", line 70\nSyntaxError: invalid syntax (x.py, line 70)',
+     "SyntaxError: invalid syntax (x.py, line <n>)"),
+    ("2024-05-01 12:00:01 [1234] ERROR worker pid=5678 crashed at 0x7ffde4a0",
+     "2025-01-09T08:30:00Z [99] ERROR worker pid=42 crashed at 0xDEADBEEF",
+     "<time> [<pid>] ERROR worker pid <pid> crashed at <hex>"),
+    ("\033[31mnpm ERR! code E404\033[0m while fetching 10423 bytes", "npm ERR! code E404 while fetching 512 bytes",
+     "npm ERR! code E404 while fetching <num> bytes"),
+], ids=["path", "line_and_column", "line_number", "time_pid_address", "ansi_and_numbers"])
+def test_volatile_parts_are_normalized(cs, a, b, signature):
+    assert cs.sidik_jari_error(a)[1] == signature
+    assert sidik(cs, a) == sidik(cs, b)
+
+
+def test_different_errors_get_different_fingerprints(cs):
+    zero = TRACEBACK.format(path="/p", n=1, error="ZeroDivisionError: division by zero")
+    key = TRACEBACK.format(path="/p", n=1, error="KeyError: 'x'")
+    assert sidik(cs, zero) != sidik(cs, key)
+
+
+def test_repeated_lines_are_kept_once_and_logs_without_errors_use_their_tail(cs):
+    assert cs.sidik_jari_error("warning: x failed\n" * 3)[1] == "warning: x failed"
+    log = "\n".join(f"step {i} ok" for i in range(8))
+    assert cs.sidik_jari_error(log)[1] == "\n".join(f"step {i} ok" for i in range(3, 8))
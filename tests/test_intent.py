@@ -0,0 +1,74 @@
+"""
+The local intent classifier answers clear messages itself and leaves unclear ones to the LLM:
+only decisions at or above INTENT_LOCAL_CONFIDENCE_THRESHOLD skip the LLM call.
+"""
+import pytest
+
+
+@pytest.mark.parametrize("pesan, niat, aturan", [
+    ("ls -la", "shell", "literal_command"),
+    ("cd /tmp", "shell", "literal_command"),
+    ("./run.sh --verbose", "shell", "literal_command"),
+    ("delete all log files in this folder", "shell", "shell_action"),
+    ("write a python function to sort a list", "program", "program_request"),
+    ("buatkan kalkulator sederhana", "program", "program_request"),
+    ("fix the bug in my script", "program", "program_fix"),
+    ("hello!", "conversation", "greeting"),
+    ("terima kasih", "conversation", "greeting"),
+    ("what is a closure?", "conversation", "question"),
+])
+def test_clear_messages_are_decided_locally(cs, pesan, niat, aturan):
+    keputusan = cs.klasifikasi_niat_lokal(pesan)
+    assert (keputusan["intent"], keputusan["rule"]) == (niat, aturan)
+    assert keputusan["literal_command"] == (aturan == "literal_command")
+    assert keputusan["confidence"] >= cs.INTENT_LOCAL_CONFIDENCE_THRESHOLD
+
+
+@pytest.mark.parametrize("pesan", [
+    "find my keys",        # `find` is a binary and an everyday word
+    "make me laugh",
+    "kill",
+    "echo hello world",    # a command whose arguments read like prose
+    "the weather is nice today",
+])
+def test_unclear_messages_stay_below_the_threshold(cs, pesan):
+    assert cs.klasifikasi_niat_lokal(pesan)["confidence"] < cs.INTENT_LOCAL_CONFIDENCE_THRESHOLD
+
+
+def test_bag_of_words_is_capped_and_stable_for_long_messages(cs):
+    niat, confidence = cs._klasifikasi_bow("why " * 5000)
+    assert niat == "conversation"
+    assert 0.8 < confidence <= 0.85
+
+
+@pytest.fixture
+def llm_niat(cs, monkeypatch):
+    """Replaces the LLM tier; returns the list of messages it was asked about."""
+    ditanya = []
+
+    async def _deteksi_niat_llm_async(pesan):
+        ditanya.append(pesan)
+        return "conversation"
+
+    monkeypatch.setattr(cs, "_deteksi_niat_llm_async", _deteksi_niat_llm_async)
+    return ditanya
+
+
+def test_threshold_decides_between_local_and_llm(cs, jalankan, monkeypatch, llm_niat):
+    keputusan = jalankan(cs.deteksi_niat_pengguna_detail_async("what is a closure?"))
+    assert (keputusan["source"], keputusan["confidence"]) == ("local", 0.8)
+    assert llm_niat == []
+
+    monkeypatch.setattr(cs, "INTENT_LOCAL_CONFIDENCE_THRESHOLD", 0.85)
+    keputusan = jalankan(cs.deteksi_niat_pengguna_detail_async("what is a closure?"))
+    assert keputusan["source"] == "llm"
+    assert (keputusan["local_guess"], keputusan["local_confidence"]) == ("conversation", 0.8)
+    assert llm_niat == ["what is a closure?"]
+
+
+def test_disabled_local_tier_always_asks_the_llm(cs, jalankan, monkeypatch, llm_niat):
+    monkeypatch.setattr(cs, "INTENT_LOCAL_ENABLED", False)
+    keputusan = jalankan(cs.deteksi_niat_pengguna_detail_async("ls -la"))
+    assert keputusan["source"] == "llm"
+    assert "local_guess" not in keputusan
+    assert llm_niat == ["ls -la"]
@@ -0,0 +1,102 @@
+"""
+Retry, deadline and circuit-breaker behaviour of call_llm_async against a local StubLLMServer
+with scripted failures (the same scenarios bench_ketahanan measures).
+"""
+import itertools
+import time
+
+from tests.support import StubLLMServer
+
+PESAN = [{"role": "system", "content": "You are a helpful assistant."}, {"role": "user", "content": "hello"}]
+
+
+async def panggil(cs, kegagalan=(), panggilan=1, deadline=None, threshold=None, on_delta=None, **stub):
+    """
+    Makes `panggilan` calls to a fresh stub endpoint. Returns a dict with every call's
+    (success, result, seconds), the requests that reached the stub and the breaker status.
+    """
+    server = await StubLLMServer(**{"latency": 0.01, "token_rate": 0, "response_tokens": 5, **stub}, kegagalan=kegagalan).start()
+    task = f"test_{server.port}"
+    if deadline is not None:
+        cs.LLM_TASK_DEADLINES[task] = deadline
+    breaker = cs.LLM_ROUTER.breaker(server.url)
+    if threshold is not None:
+        breaker.threshold = threshold
+    hasil = []
+    try:
+        for _ in range(panggilan):
+            t0 = time.perf_counter()
+            success, result = await cs.call_llm_async(PESAN, f"stub@{server.url}", "test", task=task, use_cache=False, on_delta=on_delta)
+            hasil.append((success, result, time.perf_counter() - t0))
+        return {"calls": hasil, "requests": server.requests, "circuit": breaker.status}
+    finally:
+        cs.LLM_TASK_DEADLINES.pop(task, None)
+        await server.close()
+
+
+def test_rate_limited_call_waits_for_retry_after(cs, jalankan):
+    hasil = jalankan(panggil(cs, [(429, 1)]))
+    success, _, detik = hasil["calls"][-1]
+    assert success
+    assert hasil["requests"] == 2
+    assert detik >= 1.0
+    assert hasil["circuit"] == "closed"
+
+
+def test_bad_gateway_is_retried_until_it_recovers(cs, jalankan):
+    hasil = jalankan(panggil(cs, [502, 502]))
+    assert hasil["calls"][-1][0]
+    assert hasil["requests"] == 3
+    assert hasil["circuit"] == "closed"
+
+
+def test_connection_reset_is_retried(cs, jalankan):
+    hasil = jalankan(panggil(cs, ["reset"]))
+    assert hasil["calls"][-1][0]
+    assert hasil["requests"] == 2
+
+
+def test_client_error_is_not_retried_and_keeps_circuit_closed(cs, jalankan):
+    hasil = jalankan(panggil(cs, [400]))
+    assert not hasil["calls"][-1][0]
+    assert hasil["requests"] == 1
+    assert hasil["circuit"] == "closed"
+
+
+def test_hung_upstream_is_cut_off_at_the_deadline(cs, jalankan):
+    hasil = jalankan(panggil(cs, ["hang"], deadline=0.5))
+    success, result, detik = hasil["calls"][-1]
+    assert not success
+    assert "did not answer" in result
+    assert 0.5 <= detik < 2.0
+
+
+def test_deadline_timeouts_open_the_circuit(cs, jalankan):
+    hasil = jalankan(panggil(cs, itertools.repeat("hang"), panggilan=3, deadline=0.3, threshold=2))
+    assert hasil["circuit"] == "open"
+    # The third call is rejected by the open circuit instead of waiting out another deadline
+    assert hasil["requests"] == 2
+    assert hasil["calls"][-1][2] < 0.1
+
+
+def test_endpoint_down_opens_circuit_and_fails_fast(cs, jalankan):
+    hasil = jalankan(panggil(cs, itertools.repeat(503), panggilan=4, threshold=3))
+    assert not any(success for success, _, _ in hasil["calls"])
+    assert hasil["circuit"] == "open"
+    assert hasil["requests"] == 3
+    assert hasil["calls"][-1][2] < 0.1
+
+
+def test_streamed_answer_is_not_cut_off_by_the_deadline(cs, jalankan):
+    potongan = []
+
+    async def on_delta(teks):
+        potongan.append(teks)
+
+    # 30 tokens at 50/s take about 0.6s, twice the deadline
+    hasil = jalankan(panggil(cs, deadline=0.3, on_delta=on_delta, latency=0.05, token_rate=50, response_tokens=30))
+    success, result, detik = hasil["calls"][-1]
+    assert success
+    assert detik > 0.3
+    assert "".join(potongan) == result
+    assert len(result.split()) == 30
@@ -0,0 +1,84 @@
+"""
+The single-pass MarkdownV2 renderer must only produce text the Bot API accepts: balanced
+entities, every special character escaped, and the visible text of the raw message preserved.
+periksa_markdown_v2 parses the result the way Telegram does.
+"""
+import random
+
+import pytest
+
+from tests.support import POTONGAN_FUZZ, periksa_markdown_v2, tanpa_markup
+
+
+def diterima(cs, pesan: str) -> str:
+    """Renders `pesan`, asserts Telegram would accept it and returns the visible text."""
+    galat, terlihat = periksa_markdown_v2(cs.format_pesan_markdown_v2(pesan))
+    assert galat is None, f"{galat} for {pesan!r}"
+    return terlihat
+
+
+def test_checker_rejects_unescaped_and_unbalanced_markup():
+    assert periksa_markdown_v2("1. item")[0] == "unescaped '.'"
+    assert periksa_markdown_v2("*bold")[0] == "unclosed * entity"
+    assert periksa_markdown_v2("`code")[0] == "unclosed code"
+    assert periksa_markdown_v2("*a _b* c_")[0] == "crossing * entities"
+
+
+def test_special_characters_are_escaped(cs):
+    pesan = "v1.2 (beta) [draft] {x} #3 a+b=c x|y -> done! ~ok~ > quote"
+    assert diterima(cs, pesan) == pesan
+
+
+@pytest.mark.parametrize("pesan, terlihat", [
+    ("*✅ SUCCESS* File `add_numbers.py` successfully deleted.", "✅ SUCCESS File add_numbers.py successfully deleted."),
+    ("**Summary**: use `dict.get()`.", "Summary: use dict.get()."),
+    ("_italic_ and __underline__", "italic and underline"),
+])
+def test_paired_markup_becomes_entities(cs, pesan, terlihat):
+    assert diterima(cs, pesan) == terlihat
+
+
+@pytest.mark.parametrize("pesan", [
+    "2 * 3 = 6",
+    "* first item\n* second item",
+    "snake_case_name and __init__.py",
+    "*bold `code` still bold*",
+    "unclosed `code",
+    "```python\nprint('a.b')",
+    "C:\\path\\file.py",
+    "trailing backslash \\",
+])
+def test_broken_markup_is_repaired_without_losing_text(cs, pesan):
+    terlihat = diterima(cs, pesan)
+    assert tanpa_markup(terlihat) == tanpa_markup(pesan)
+
+
+def test_code_block_keeps_its_language_and_content(cs):
+    pesan = "Fix:\n```python\nvalue = config.get('path', '/tmp')  # a.b\n```\nDone."
+    hasil = cs.format_pesan_markdown_v2(pesan)
+    assert "```python\nvalue = config.get('path', '/tmp')  # a.b\n```" in hasil
+    terlihat = diterima(cs, pesan)
+    assert terlihat.startswith("Fix:\n") and terlihat.endswith("Done.")
+    assert "value = config.get('path', '/tmp')  # a.b" in terlihat
+
+
+def test_ansi_colors_are_removed(cs):
+    assert diterima(cs, "\033[31mError\033[0m: boom.") == "Error: boom."
+
+
+def test_fuzzed_messages_are_accepted_and_keep_their_text(cs):
+    acak = random.Random(25)
+    for _ in range(2000):
+        pesan = "".join(acak.choice(POTONGAN_FUZZ) for _ in range(acak.randint(1, 120)))
+        terlihat = diterima(cs, pesan)
+        assert tanpa_markup(terlihat) == tanpa_markup(cs._teks_polos(pesan)), pesan
+
+
+def test_split_parts_are_each_accepted(cs):
+    blok = "```log\n" + "\n".join(f"[{i:05d}] compiling module_{i}.c ... *ok* (0.{i:03d}s)" for i in range(400)) + "\n```"
+    bagian = cs.pisah_pesan_telegram("*📜 LOG*\n" + blok)
+    assert len(bagian) > 1
+    for pesan in bagian:
+        teks = cs.format_pesan_markdown_v2(pesan)
+        assert len(teks) <= cs.TELEGRAM_MESSAGE_LIMIT
+        assert periksa_markdown_v2(teks)[0] is None
@@ -0,0 +1,63 @@
+"""
+pisah_pesan_telegram splits long messages so every rendered part fits Telegram's 4096-character
+limit; code blocks cut by a split are closed and reopened with the same fence.
+"""
+from tests.support import periksa_markdown_v2
+
+
+def isi_kode(bagian: list) -> list:
+    """Lines inside the code fences of every part, in order."""
+    baris = []
+    for pesan in bagian:
+        dalam = False
+        for b in pesan.split("\n"):
+            if b.startswith("```"):
+                dalam = not dalam
+            elif dalam:
+                baris.append(b)
+    return baris
+
+
+def periksa_bagian(cs, bagian: list):
+    for pesan in bagian:
+        teks = cs.format_pesan_markdown_v2(pesan)
+        assert len(teks) <= cs.TELEGRAM_MESSAGE_LIMIT
+        assert periksa_markdown_v2(teks)[0] is None
+
+
+def test_message_that_fits_is_not_split(cs):
+    pesan = "*📜 LOG*\n```log\n" + "x" * 4000 + "\n```"
+    assert cs.pisah_pesan_telegram(pesan) == [pesan]
+
+
+def test_code_block_is_reopened_with_its_fence_in_every_part(cs):
+    baris = [f"[{i:04d}] step {i} done" for i in range(600)]
+    bagian = cs.pisah_pesan_telegram("*📜 LOG*\n```log\n" + "\n".join(baris) + "\n```\nFinished.")
+    assert len(bagian) > 1
+    periksa_bagian(cs, bagian)
+    assert bagian[0].startswith("*📜 LOG*\n```log\n")
+    for pesan in bagian[:-1]:
+        assert pesan.endswith("\n```")
+    for pesan in bagian[1:]:
+        assert pesan.startswith("```log\n")
+    assert bagian[-1].endswith("\n```\nFinished.")
+    # Splits happen on line boundaries, so every line arrives whole and in order
+    assert isi_kode(bagian) == baris
+
+
+def test_code_line_longer_than_the_limit_is_cut(cs):
+    panjang = "A" * 10_000
+    bagian = cs.pisah_pesan_telegram("```\nstart\n" + panjang + "\nend\n```")
+    assert len(bagian) >= 3
+    periksa_bagian(cs, bagian)
+    assert "".join(isi_kode(bagian)) == "start" + panjang + "end"
+
+
+def test_text_is_costed_as_escaped(cs):
+    # Every character needs escaping, so the raw text fits but its rendering does not
+    pesan = "\n".join("." * 99 for _ in range(30))
+    assert len(pesan) < cs.TELEGRAM_MESSAGE_LIMIT
+    bagian = cs.pisah_pesan_telegram(pesan)
+    assert len(bagian) == 2
+    periksa_bagian(cs, bagian)
+    assert "\n".join(bagian) == pesan
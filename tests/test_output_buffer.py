@@ -0,0 +1,60 @@
+"""
+OutputRingBuffer keeps only the newest lines within its line and byte caps, and its readers
+(tail_chars, tail_lines, window) see the same output the joined text would.
+"""
+
+
+def test_oldest_lines_are_evicted_at_the_line_cap(cs):
+    buf = cs.OutputRingBuffer(max_lines=3, max_bytes=1000)
+    for i in range(5):
+        buf.append(f"line {i}")
+    assert buf.text() == "line 2\nline 3\nline 4"
+    assert (len(buf), buf.total_lines, buf.dropped_lines) == (3, 5, 2)
+
+
+def test_oldest_lines_are_evicted_at_the_byte_cap(cs):
+    buf = cs.OutputRingBuffer(max_lines=100, max_bytes=18)
+    # Each line costs its UTF-8 bytes plus one for the newline: "é" is two bytes
+    buf.extend(["aaaa", "bbbb", "éééé", "cccc"])
+    assert buf.text() == "éééé\ncccc"
+    assert buf.nbytes == 9 + 5
+    assert buf.dropped_lines == 2
+
+
+def test_extend_matches_appending_one_by_one(cs):
+    lines = [f"{i} " + "x" * (i % 7) for i in range(50)]
+    batch = cs.OutputRingBuffer(max_lines=10, max_bytes=60)
+    batch.extend(lines)
+    single = cs.OutputRingBuffer(max_lines=10, max_bytes=60)
+    for line in lines:
+        single.append(line)
+    assert batch.text() == single.text()
+    assert (batch.total_lines, batch.dropped_lines, batch.nbytes) == (single.total_lines, single.dropped_lines, single.nbytes)
+
+
+def test_line_larger_than_the_budget_keeps_its_tail(cs):
+    buf = cs.OutputRingBuffer(max_lines=10, max_bytes=40)
+    buf.append("short")
+    buf.append("x" * 100 + "END")
+    # A quarter of the budget is kept, so the line does not push out everything else
+    assert buf.text() == "short\n" + ("x" * 100 + "END")[-10:]
+    assert buf.nbytes == 6 + 11
+
+
+def test_tail_chars_matches_the_joined_text(cs):
+    buf = cs.OutputRingBuffer(max_lines=100, max_bytes=10_000)
+    buf.extend(f"output line {i}" for i in range(40))
+    teks = buf.text()
+    for n in (1, 5, 14, 15, 16, 100, len(teks), len(teks) + 50):
+        assert buf.tail_chars(n) == teks[-n:]
+    assert cs.OutputRingBuffer().tail_chars(500) == ""
+
+
+def test_window_uses_line_numbers_since_the_start(cs):
+    buf = cs.OutputRingBuffer(max_lines=4, max_bytes=1000)
+    buf.extend(str(i) for i in range(10))
+    assert buf.window(7, 9) == ["7", "8"]
+    # Lines 0-5 were dropped; asking for them returns what is left of the range
+    assert buf.window(0, 8) == ["6", "7"]
+    assert buf.window(8) == ["8", "9"]
+    assert buf.tail_lines(3) == ["7", "8", "9"]
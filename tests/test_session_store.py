@@ -0,0 +1,44 @@
+"""
+SessionStore persistence: a chat's context survives a restart (a new store on the same SQLite
+file), apart from the output ring buffer, which starts empty.
+"""
+import pytest
+
+
+def toko(cs, path):
+    return cs.SessionStore(str(path), memory_chats=4, history_max_messages=20, history_max_chars=2000, ttl=3600)
+
+
+@pytest.fixture
+def pesan_terkirim(cs, monkeypatch):
+    """Replaces call_llm_async with a stub and returns the list of message lists it was given."""
+    terkirim = []
+
+    async def call_llm_async(messages, *args, **kwargs):
+        terkirim.append(messages)
+        return True, "ok"
+
+    monkeypatch.setattr(cs, "call_llm_async", call_llm_async)
+    return terkirim
+
+
+def test_error_log_reaches_the_prompt_after_reload(cs, jalankan, monkeypatch, pesan_terkirim, tmp_path):
+    log = "".join(f"line {i}\n" for i in range(200)) + "Traceback (most recent call last):\nZeroDivisionError: division by zero\n"
+    lama = toko(cs, tmp_path / "sessions.db")
+    konteks = lama.context(7)
+    konteks.update(last_error_log=log, last_command_run="python calc.py", last_user_message_intent="shell")
+    konteks["full_error_output"].extend(log.splitlines())
+    lama.flush()
+
+    baru = toko(cs, tmp_path / "sessions.db")
+    konteks = baru.context(7)
+    assert konteks["last_error_log"] == log
+    assert konteks["last_command_run"] == "python calc.py"
+    assert konteks["full_error_output"].tail_chars(500) == ""
+
+    monkeypatch.setattr(cs, "SESSION_STORE", baru)
+    success, _ = jalankan(cs.minta_jawaban_konversasi_async(7, "why did it fail?"))
+    assert success
+    prompt = "\n".join(str(m["content"]) for m in pesan_terkirim[-1])
+    assert "`python calc.py` with error log:\n```\n" + log[-500:] + "\n```" in prompt
+    assert baru.history(7)[-1] == {"role": "assistant", "content": "ok"}
@@ -0,0 +1,114 @@
+"""Background shell jobs: slot accounting and the per-job debug question."""
+import asyncio
+import os
+import sys
+
+from tests.support import CHAT_ID, FakeBot, FakeContext, FakeUpdate
+
+
+def test_waiting_job_holds_no_slot(cs, jalankan):
+    manager = cs.ShellJobManager(max_concurrent=1, max_per_chat=1, max_queued=5)
+
+    async def skenario():
+        await manager._ambil_slot(2)
+        menunggu = asyncio.ensure_future(manager._ambil_slot(1))
+        await asyncio.sleep(0.01)
+        # Queued for the global slot without taking its own chat's slot meanwhile
+        assert not menunggu.done()
+        assert manager._berjalan[1] == 0
+        manager._lepas_slot(2)
+        await asyncio.wait_for(menunggu, 1)
+        assert dict(manager._berjalan) == {1: 1}
+
+    jalankan(skenario())
+
+
+def test_cancelled_waiter_leaves_slots_untouched(cs, jalankan):
+    manager = cs.ShellJobManager(max_concurrent=1, max_per_chat=1, max_queued=5)
+
+    async def skenario():
+        await manager._ambil_slot(1)
+        menunggu = asyncio.ensure_future(manager._ambil_slot(1))
+        await asyncio.sleep(0.01)
+        menunggu.cancel()
+        await asyncio.gather(menunggu, return_exceptions=True)
+        manager._lepas_slot(1)
+        assert not manager._berjalan and not manager._penunggu
+
+    jalankan(skenario())
+
+
+def test_failed_job_asks_with_buttons_bound_to_that_job(cs, jalankan, tmp_path):
+    skrip = tmp_path / "gagal.py"
+    skrip.write_text("raise ValueError('boom')\n")
+    perintah = f"{sys.executable} {skrip}"
+    bot = FakeBot()
+    context = FakeContext(bot)
+
+    async def skenario():
+        job = cs.SHELL_JOB_MANAGER.submit(f"python {skrip}", FakeUpdate(perintah), context)
+        await job.task
+        await cs.TELEGRAM_SEND_QUEUE.tunggu_kosong(CHAT_ID)
+        tertunda = cs.get_user_context(CHAT_ID)["pending_debug"]
+        kunci = next(k for k, v in tertunda.items() if v["job"] == job.id)
+        assert tertunda[kunci]["command"] == job.command
+        assert "ValueError: boom" in tertunda[kunci]["error_log"]
+
+        tombol = bot.calls[-1][2]["reply_markup"].inline_keyboard[0]
+        assert [b.callback_data for b in tombol] == [f"debug:{kunci}:yes", f"debug:{kunci}:no"]
+
+        await cs.handle_debug_callback(FakeUpdate(callback_data=f"debug:{kunci}:no"), context)
+        await cs.TELEGRAM_SEND_QUEUE.tunggu_kosong(CHAT_ID)
+        assert kunci not in tertunda
+        # A second press finds nothing to answer
+        terkirim = len(bot.calls)
+        await cs.handle_debug_callback(FakeUpdate(callback_data=f"debug:{kunci}:yes"), context)
+        await cs.TELEGRAM_SEND_QUEUE.tunggu_kosong(CHAT_ID)
+        assert len(bot.calls) == terkirim + 1
+
+    jalankan(skenario())
+
+
+def jalankan_job(cs, jalankan, perintah: str):
+    async def skenario():
+        job = cs.SHELL_JOB_MANAGER.submit(perintah, FakeUpdate(perintah), FakeContext(FakeBot()))
+        await job.task
+        await cs.TELEGRAM_SEND_QUEUE.tunggu_kosong(CHAT_ID)
+        return job
+    return jalankan(skenario())
+
+
+def test_exit_code_and_signal_are_reported_apart(cs, jalankan):
+    keluar = jalankan_job(cs, jalankan, "exit 9")
+    assert keluar.exit_status == 9
+    assert keluar.keterangan_exit() == "exit=9"
+
+    dibunuh = jalankan_job(cs, jalankan, "kill -KILL $$")
+    assert dibunuh.exit_status == -9
+    assert dibunuh.keterangan_exit() == "signal=SIGKILL"
+
+
+def test_output_limit_counts_bytes_not_characters(cs, jalankan, monkeypatch):
+    monkeypatch.setattr(cs, "SHELL_LIMITS", {"output": 4000})
+    # 3000 characters, but 6000 bytes of UTF-8
+    job = jalankan_job(cs, jalankan, f"{sys.executable} -c \"print('é' * 3000)\"")
+    assert job.alasan and "output limit" in job.alasan
+
+
+def test_pty_reader_counts_raw_bytes(cs, jalankan):
+    async def skenario():
+        baca, tulis = os.pipe()
+        os.set_blocking(baca, False)
+        reader = cs.PtyLineReader(baca)
+        data = "héllo\r\nprogress 10%\rprogress 100%\r\n".encode()
+        os.write(tulis, data)
+        os.close(tulis)
+        baris = []
+        while (potongan := await reader.read_lines()) is not None:
+            baris.extend(potongan)
+        reader.close()
+        os.close(baca)
+        assert baris == ["héllo", "progress 100%"]
+        assert reader.byte_dibaca == len(data)
+
+    jalankan(skenario())
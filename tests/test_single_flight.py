@@ -0,0 +1,65 @@
+"""
+Identical concurrent LLM calls share one upstream request (SingleFlight): cancelling one caller
+does not cancel the others, and every streaming caller receives the whole answer.
+"""
+import asyncio
+
+from tests.support import StubLLMServer
+
+PESAN = [{"role": "system", "content": "You are a helpful assistant."}, {"role": "user", "content": "explain this error"}]
+
+
+def coalesced(cs, task: str) -> float:
+    return sum(nilai for nama, label, nilai in cs.METRICS.counter() if nama == "llm_coalesced_total" and label.get("task") == task)
+
+
+def test_cancelled_caller_leaves_the_shared_call_running(cs, jalankan):
+    jumlah = 6
+
+    async def skenario():
+        server = await StubLLMServer(latency=0.3, token_rate=0, response_tokens=5).start()
+        task = f"test_{server.port}"
+        try:
+            tugas = [asyncio.ensure_future(cs.call_llm_async(PESAN, f"stub@{server.url}", "test", task=task, use_cache=False))
+                     for _ in range(jumlah)]
+            await asyncio.sleep(0.1)
+            tugas[0].cancel()
+            hasil = await asyncio.gather(*tugas, return_exceptions=True)
+            return hasil, server.requests, coalesced(cs, task)
+        finally:
+            await server.close()
+
+    hasil, requests, digabung = jalankan(skenario())
+    assert isinstance(hasil[0], asyncio.CancelledError)
+    assert all(success for success, _ in hasil[1:])
+    assert len({jawaban for _, jawaban in hasil[1:]}) == 1
+    assert requests == 1
+    assert digabung == jumlah - 1
+
+
+class Pengumpul:
+    def __init__(self):
+        self.potongan = []
+
+    async def terima(self, teks):
+        self.potongan.append(teks)
+
+
+def test_waiters_sharing_one_callback_each_get_the_full_stream(cs, jalankan):
+    pengumpul = Pengumpul()
+
+    async def skenario():
+        server = await StubLLMServer(latency=0.05, token_rate=100, response_tokens=20).start()
+        try:
+            # The same bound method for both callers, e.g. two updates handled by one object
+            return await asyncio.gather(*(cs.call_llm_async(PESAN, f"stub@{server.url}", "test", task=f"test_{server.port}",
+                                                            use_cache=False, on_delta=pengumpul.terima) for _ in range(2))), server.requests
+        finally:
+            await server.close()
+
+    hasil, requests = jalankan(skenario())
+    assert requests == 1
+    (success_a, jawaban), (success_b, _) = hasil
+    assert success_a and success_b
+    assert len(jawaban.split()) == 20
+    assert len("".join(pengumpul.potongan)) == 2 * len(jawaban)